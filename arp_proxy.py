@@ -0,0 +1,95 @@
+import struct
+import time
+from collections import OrderedDict
+
+from ryu.lib.packet import packet, ethernet, arp
+from ryu.lib.packet import ether_types
+
+# Proxy ARP: le richieste ARP degli host vengono risolte dal controller e la
+# risposta esce dall'access switch di ingresso con una PacketOut, invece di
+# essere inoltrata in broadcast sul backbone. La tabella IP -> MAC viene dalla
+# policy (host dichiarati) e dagli ARP osservati; le voci apprese scadono dopo
+# max_age secondi e le più vecchie vengono scartate oltre max_entries.
+
+ETH_HLEN = 14
+_ARP = struct.Struct('!HHBBH6s4s6s4s')   # htype, ptype, hlen, plen, op, sha, spa, tha, tpa
+
+
+def _ip(buf):
+    return '%d.%d.%d.%d' % tuple(buf)
+
+
+def parse_arp(data):
+    # (op, sha, spa, tpa) di un ARP Ethernet/IPv4 non taggato, altrimenti None
+    if len(data) < ETH_HLEN + _ARP.size:
+        return None
+    if struct.unpack_from('!H', data, 12)[0] != ether_types.ETH_TYPE_ARP:
+        return None
+    htype, ptype, hlen, plen, op, sha, spa, _, tpa = _ARP.unpack_from(data, ETH_HLEN)
+    if htype != 1 or ptype != ether_types.ETH_TYPE_IP or hlen != 6 or plen != 4:
+        return None
+    return op, sha.hex(':'), _ip(spa), _ip(tpa)
+
+
+def build_reply(mac, ip, dst_mac, dst_ip):
+    p = packet.Packet()
+    p.add_protocol(ethernet.ethernet(dst=dst_mac, src=mac,
+                                     ethertype=ether_types.ETH_TYPE_ARP))
+    p.add_protocol(arp.arp(opcode=arp.ARP_REPLY, src_mac=mac, src_ip=ip,
+                           dst_mac=dst_mac, dst_ip=dst_ip))
+    p.serialize()
+    return bytes(p.data)
+
+
+class ArpProxy(object):
+
+    def __init__(self, max_entries=4096, max_age=300.0):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._learned = OrderedDict()   # ip -> (mac, ultimo avvistamento)
+
+        self.replies = 0
+        self.misses = 0
+
+    def learn(self, ip, mac, now=None):
+        now = time.time() if now is None else now
+        self._learned.pop(ip, None)
+        if len(self._learned) >= self.max_entries:
+            self._learned.popitem(last=False)
+        self._learned[ip] = (mac, now)
+
+    def lookup(self, ip, known=None, now=None):
+        # Gli host dichiarati nella policy hanno la precedenza su quelli appresi
+        if known and ip in known:
+            return known[ip]
+        entry = self._learned.get(ip)
+        if entry is None:
+            return None
+        now = time.time() if now is None else now
+        if now - entry[1] >= self.max_age:
+            del self._learned[ip]
+            return None
+        return entry[0]
+
+    def process(self, data, known=None, allowed=None):
+        # Impara il mittente e, per una richiesta risolvibile, restituisce il
+        # frame di risposta; None se la richiesta va gestita come prima.
+        # allowed(mac_richiedente, mac_target) applica i confini di slice.
+        parsed = parse_arp(data)
+        if parsed is None:
+            return None
+        op, sha, spa, tpa = parsed
+        if spa != '0.0.0.0':
+            self.learn(spa, sha)
+        if op != arp.ARP_REQUEST or spa == tpa:   # risposte e ARP gratuiti
+            return None
+
+        mac = self.lookup(tpa, known)
+        if mac is None or mac == sha or (allowed is not None and not allowed(sha, mac)):
+            self.misses += 1
+            return None
+        self.replies += 1
+        return build_reply(mac, tpa, sha, spa)
+
+    def size(self):
+        return len(self._learned)
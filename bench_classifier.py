@@ -0,0 +1,103 @@
+import argparse
+import time
+
+from ryu.lib.packet import packet, ethernet, ipv4, udp, tcp, arp, vlan
+from ryu.lib.packet import ether_types
+
+from packet_classifier import classify
+
+# Microbenchmark: pacchetti/s del classificatore veloce rispetto al parsing
+# completo usato in origine nei PacketIn handler (packet.Packet + get_protocol)
+
+
+def build_frames():
+    h1, h3 = '00:00:00:00:00:01', '00:00:00:00:00:03'
+    frames = []
+
+    # Video UDP/9999
+    p = packet.Packet()
+    p.add_protocol(ethernet.ethernet(dst=h3, src=h1, ethertype=ether_types.ETH_TYPE_IP))
+    p.add_protocol(ipv4.ipv4(src='10.0.0.1', dst='10.0.0.3', proto=17))
+    p.add_protocol(udp.udp(src_port=40000, dst_port=9999))
+    p.add_protocol(b'\x00' * 1200)
+    frames.append(p)
+
+    # Bulk TCP
+    p = packet.Packet()
+    p.add_protocol(ethernet.ethernet(dst=h3, src=h1, ethertype=ether_types.ETH_TYPE_IP))
+    p.add_protocol(ipv4.ipv4(src='10.0.0.1', dst='10.0.0.3', proto=6))
+    p.add_protocol(tcp.tcp(src_port=40001, dst_port=5201))
+    p.add_protocol(b'\x00' * 1400)
+    frames.append(p)
+
+    # ARP request
+    p = packet.Packet()
+    p.add_protocol(ethernet.ethernet(dst='ff:ff:ff:ff:ff:ff', src=h1,
+                                     ethertype=ether_types.ETH_TYPE_ARP))
+    p.add_protocol(arp.arp(src_mac=h1, src_ip='10.0.0.1',
+                           dst_mac='00:00:00:00:00:00', dst_ip='10.0.0.3'))
+    frames.append(p)
+
+    # VLAN (percorso lento)
+    p = packet.Packet()
+    p.add_protocol(ethernet.ethernet(dst=h3, src=h1, ethertype=ether_types.ETH_TYPE_8021Q))
+    p.add_protocol(vlan.vlan(vid=10, ethertype=ether_types.ETH_TYPE_IP))
+    p.add_protocol(ipv4.ipv4(src='10.0.0.1', dst='10.0.0.3', proto=17))
+    p.add_protocol(udp.udp(src_port=40000, dst_port=9999))
+    frames.append(p)
+
+    for p in frames:
+        p.serialize()
+    return [bytes(p.data) for p in frames]
+
+
+def full_parse(data):
+    pkt = packet.Packet(data)
+    eth = pkt.get_protocol(ethernet.ethernet)
+    if not eth:
+        return None
+    ip_pkt = pkt.get_protocol(ipv4.ipv4)
+    udp_pkt = pkt.get_protocol(udp.udp)
+    is_video = bool(ip_pkt and udp_pkt and
+                    (udp_pkt.dst_port == 9999 or udp_pkt.src_port == 9999))
+    return eth.src, eth.dst, eth.ethertype, is_video
+
+
+def fast_parse(data):
+    info = classify(data)
+    if not info:
+        return None
+    is_video = (info.ip_proto == 17 and
+                (info.dst_port == 9999 or info.src_port == 9999))
+    return info.src, info.dst, info.ethertype, is_video
+
+
+def run(fn, frames, count):
+    start = time.perf_counter()
+    n = 0
+    while n < count:
+        for data in frames:
+            fn(data)
+        n += len(frames)
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='PacketIn classifier microbenchmark')
+    ap.add_argument('-n', '--count', type=int, default=200000,
+                    help='pacchetti per ciascun percorso')
+    args = ap.parse_args()
+
+    frames = build_frames()
+    for data in frames:
+        assert full_parse(data) == fast_parse(data), data
+
+    full = run(full_parse, frames, args.count)
+    fast = run(fast_parse, frames, args.count)
+    print("packet.Packet : %12.0f pkt/s" % full)
+    print("classify      : %12.0f pkt/s" % fast)
+    print("speedup       : %12.1fx" % (fast / full))
+
+
+if __name__ == '__main__':
+    main()
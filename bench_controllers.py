@@ -0,0 +1,360 @@
+import argparse
+import gc
+import json
+import logging
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+
+from ryu.controller import ofp_event
+from ryu.controller.handler import MAIN_DISPATCHER
+from ryu.lib import hub, pcaplib
+from ryu.lib.packet import packet, ethernet, ipv4, udp, tcp, arp
+from ryu.lib.packet import ether_types
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+
+from packet_classifier import classify
+from packet_workers import THREADS, PROCESSES
+from slice_policy import load_policy, DEFAULT_POLICY_FILE
+
+# Benchmark offline dei controller: i PacketIn (sintetici o letti da un pcap)
+# vengono passati direttamente a _packet_in_handler, senza Mininet né OVS.
+# I datapath sono finti: registrano i messaggi inviati e rispondono subito
+# alle barrier. Ogni pacchetto entra dall'access switch dell'host sorgente
+# (caso peggiore: nessuna regola già installata lo intercetta).
+# Con lo stesso seed la traccia è identica, quindi i risultati sono
+# confrontabili fra commit diversi (--json salva anche l'hash del commit).
+# Il warmup gira su un'istanza del controller scartata subito dopo: scalda
+# l'interprete e le cache a livello di modulo, mentre il controller misurato
+# parte senza regole né MAC imparati, come le passate di tempo e di memoria.
+# Il primo pacchetto di ogni flusso misurato (MAC learning, calcolo del
+# percorso, installazione delle regole) è riportato anche a parte (cold).
+# Con --workers i PacketIn vengono accodati ai worker dei controller (la
+# decodifica dei frame esce dal hub, le decisioni no): la latenza è quella
+# dell'handler nel worker, il throughput include l'attesa dello svuotamento
+# delle code e il costo della decodifica a lotti.
+
+APPS = {
+    'static':  ('static_slicing', 'StrictSliceDPID'),
+    'service': ('service_slicing', 'SliceEnforcingController'),
+    'dynamic': ('dynamic_slicing', 'SliceEnforcingController'),
+}
+
+
+class MockDatapath(object):
+
+    def __init__(self, dpid):
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.xid = 0
+        self.counts = {}
+        self.pending_barriers = []
+
+    def set_xid(self, msg):
+        self.xid += 1
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg, close_socket=False):
+        # Come Datapath.send_msg: xid e serializzazione fanno parte del costo
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+        name = msg.__class__.__name__
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if isinstance(msg, ofproto_v1_3_parser.OFPBarrierRequest):
+            self.pending_barriers.append(msg.xid)
+        return True
+
+    def barrier_replies(self):
+        xids, self.pending_barriers = self.pending_barriers, []
+        for xid in xids:
+            reply = ofproto_v1_3_parser.OFPBarrierReply(self)
+            reply.xid = xid
+            yield ofp_event.EventOFPBarrierReply(reply)
+
+
+def build_frame(src, dst, kind, sport, ip_of):
+    p = packet.Packet()
+    if kind == 'arp':
+        p.add_protocol(ethernet.ethernet(dst='ff:ff:ff:ff:ff:ff', src=src,
+                                         ethertype=ether_types.ETH_TYPE_ARP))
+        p.add_protocol(arp.arp(src_mac=src, src_ip=ip_of[src],
+                               dst_mac='00:00:00:00:00:00', dst_ip=ip_of[dst]))
+    else:
+        p.add_protocol(ethernet.ethernet(dst=dst, src=src, ethertype=ether_types.ETH_TYPE_IP))
+        if kind == 'tcp':
+            p.add_protocol(ipv4.ipv4(src=ip_of[src], dst=ip_of[dst], proto=6))
+            p.add_protocol(tcp.tcp(src_port=sport, dst_port=5201))
+        else:
+            p.add_protocol(ipv4.ipv4(src=ip_of[src], dst=ip_of[dst], proto=17))
+            p.add_protocol(udp.udp(src_port=sport, dst_port=9999 if kind == 'video' else 5001))
+        p.add_protocol(b'\x00' * 64)
+    p.serialize()
+    return bytes(p.data)
+
+
+def synthetic_trace(pol, count, flows, seed):
+    # Pool fisso di flussi (coppia di host, tipo, porta sorgente) da cui la
+    # traccia pesca: i pacchetti ripetuti misurano anche la cache delle regole
+    rnd = random.Random(seed)
+    hosts = sorted(pol.host_location)
+    ip_of = {mac: '10.0.0.%d' % (i + 1) for i, mac in enumerate(hosts)}
+    kinds = ['video'] * 3 + ['tcp'] * 5 + ['udp'] + ['arp']
+    pool = []
+    for _ in range(flows):
+        src, dst = rnd.sample(hosts, 2)
+        kind = rnd.choice(kinds)
+        dpid, in_port = pol.host_location[src]
+        pool.append((dpid, in_port, build_frame(src, dst, kind, rnd.randint(1024, 65535), ip_of)))
+    return [pool[rnd.randrange(flows)] for _ in range(count)]
+
+
+def pcap_trace(pol, path, count):
+    # Ingresso dedotto dal MAC sorgente; i frame di host sconosciuti sono scartati
+    trace = []
+    with open(path, 'rb') as f:
+        for _, buf in pcaplib.Reader(f):
+            info = classify(buf)
+            if info is None or info.src not in pol.host_location:
+                continue
+            dpid, in_port = pol.host_location[info.src]
+            trace.append((dpid, in_port, bytes(buf)))
+            if count and len(trace) >= count:
+                break
+    return trace
+
+
+def make_app(name, pol, workers=0, worker_mode=THREADS):
+    module, cls = APPS[name]
+    base = getattr(__import__(module), cls)
+    # Sottoclasse: la classe del controller resta intatta
+    cls = type(cls, (base,), {
+        'WORKERS': workers,
+        'WORKER_MODE': worker_mode,
+        'STATE_FILE': '',        # nessuno snapshot: ogni misura parte a freddo
+        'PACKET_IN_RATE': 0,     # la traccia supera di proposito il limite per sorgente
+        'METRICS_PORT': 0,
+    })
+    app = cls()
+    datapaths = {}
+    for dpid in sorted(pol.links):
+        dp = MockDatapath(dpid)
+        datapaths[dpid] = dp
+        ev = ofp_event.EventOFPStateChange(dp)
+        ev.state = MAIN_DISPATCHER
+        app._state_change_handler(ev)
+        features = ofproto_v1_3_parser.OFPSwitchFeatures(dp, datapath_id=dpid)
+        app.switch_features_handler(ofp_event.EventOFPSwitchFeatures(features))
+        deliver_barriers(app, dp)
+    return app, datapaths
+
+
+def deliver_barriers(app, dp):
+    for ev in dp.barrier_replies():
+        app._barrier_reply_handler(ev)
+
+
+def packet_in_events(datapaths, trace):
+    parser, ofp = ofproto_v1_3_parser, ofproto_v1_3
+    events = []
+    for dpid, in_port, data in trace:
+        dp = datapaths[dpid]
+        msg = parser.OFPPacketIn(dp, buffer_id=ofp.OFP_NO_BUFFER, total_len=len(data),
+                                 reason=ofp.OFPR_NO_MATCH, table_id=0, cookie=0,
+                                 match=parser.OFPMatch(in_port=in_port), data=data)
+        events.append((dp, ofp_event.EventOFPPacketIn(msg)))
+    return events
+
+
+def replay(app, events, datapaths):
+    # Latenza dell'handler per ogni PacketIn, nell'ordine della traccia
+    # (None per quelli scartati dai worker)
+    latencies = [None] * len(events)
+    perf = time.perf_counter
+    workers = app.workers
+    if workers is not None:
+        handler = workers.handler
+        index = {id(ev): i for i, (dp, ev) in enumerate(events)}
+
+        def timed(ev, info):
+            t0 = perf()
+            handler(ev, info)
+            latencies[index[id(ev)]] = perf() - t0
+
+        workers.handler = timed
+        target = sum(workers.processed) + workers.dropped + len(events)
+        for dp, ev in events:
+            app._packet_in_handler(ev)
+            if workers.pending() >= workers.batch * workers.n:
+                hub.sleep(0)
+        while sum(workers.processed) + workers.dropped < target:
+            hub.sleep(0)
+            for dp in datapaths.values():
+                deliver_barriers(app, dp)
+        workers.handler = handler
+        flush_all(app, datapaths)
+        return latencies
+
+    for i, (dp, ev) in enumerate(events):
+        t0 = perf()
+        app._packet_in_handler(ev)
+        # La PacketOut attende anche le regole a valle sugli altri switch
+        for other in datapaths.values():
+            deliver_barriers(app, other)
+        latencies[i] = perf() - t0
+    flush_all(app, datapaths)
+    return latencies
+
+
+def flush_all(app, datapaths):
+    # FlowMod senza attese ancora in coda (inviate a tempo dal controller)
+    for dp in datapaths.values():
+        app.flows.flush(dp, now=True)
+        deliver_barriers(app, dp)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+def total_counts(datapaths):
+    counts = {}
+    for dp in datapaths.values():
+        for name, n in dp.counts.items():
+            counts[name] = counts.get(name, 0) + n
+    return counts
+
+
+def first_packets(events):
+    # Indici del primo PacketIn di ogni flusso (switch di ingresso e campi classificati)
+    seen = set()
+    result = []
+    for i, (dp, ev) in enumerate(events):
+        flow = (dp.id, classify(ev.msg.data))
+        if flow not in seen:
+            seen.add(flow)
+            result.append(i)
+    return result
+
+
+def bench(name, pol, trace, warmup, workers=0, worker_mode=THREADS):
+    # Warmup su un'istanza a parte
+    app, datapaths = make_app(name, pol, workers, worker_mode)
+    replay(app, packet_in_events(datapaths, trace[:warmup]), datapaths)
+    if app.workers is not None:
+        app.workers.stop()
+
+    # Passata temporizzata
+    app, datapaths = make_app(name, pol, workers, worker_mode)
+    events = packet_in_events(datapaths, trace)
+    before = total_counts(datapaths)
+    gc.collect()
+    start = time.perf_counter()
+    timings = replay(app, events, datapaths)
+    elapsed = time.perf_counter() - start
+    after = total_counts(datapaths)
+    sent = {k: after[k] - before.get(k, 0) for k in after if after[k] != before.get(k, 0)}
+    if app.workers is not None:
+        app.workers.stop()
+
+    # Passata separata per la memoria (tracemalloc rallenta l'esecuzione),
+    # dallo stesso stato iniziale
+    app, datapaths = make_app(name, pol, workers, worker_mode)
+    mem_events = packet_in_events(datapaths, trace)
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    replay(app, mem_events, datapaths)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if app.workers is not None:
+        app.workers.stop()
+
+    latencies = sorted(t for t in timings if t is not None)
+    cold = sorted(timings[i] for i in first_packets(events) if timings[i] is not None)
+    n = len(events)
+    return {
+        'app': name,
+        'packets': n,
+        'pps': n / elapsed if elapsed else 0.0,
+        'p50_us': percentile(latencies, 50) * 1e6,
+        'p99_us': percentile(latencies, 99) * 1e6,
+        'cold_packets': len(cold),
+        'cold_p50_us': percentile(cold, 50) * 1e6,
+        'cold_p99_us': percentile(cold, 99) * 1e6,
+        'flowmods_per_pkt': sent.get('OFPFlowMod', 0) / float(n) if n else 0.0,
+        'sent': sent,
+        'mem_growth_kib': (current - base) / 1024.0,
+        'mem_peak_kib': (peak - base) / 1024.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Offline PacketIn replay benchmark')
+    ap.add_argument('apps', nargs='*', metavar='app',
+                    help='controller da misurare: %s (default: tutti)' % ', '.join(sorted(APPS)))
+    ap.add_argument('-n', '--count', type=int, default=20000,
+                    help='PacketIn per controller')
+    ap.add_argument('--flows', type=int, default=200,
+                    help='flussi distinti nella traccia sintetica')
+    ap.add_argument('--seed', type=int, default=1, help='seed della traccia sintetica')
+    ap.add_argument('--warmup', type=int, default=1000,
+                    help='PacketIn iniziali replicati su un controller a parte prima delle misure')
+    ap.add_argument('--pcap', help='usa i frame di un pcap invece della traccia sintetica')
+    ap.add_argument('--policy', default=DEFAULT_POLICY_FILE, help='file di policy')
+    ap.add_argument('--workers', type=int, default=0,
+                    help='worker per la decodifica dei PacketIn (0 = nell\'handler)')
+    ap.add_argument('--worker-mode', choices=(THREADS, PROCESSES), default=THREADS,
+                    help='decodifica dei frame in thread nativi o processi')
+    ap.add_argument('--json', help='salva i risultati in questo file')
+    args = ap.parse_args()
+    for name in args.apps:
+        if name not in APPS:
+            ap.error('controller sconosciuto: %s' % name)
+    args.apps = args.apps or sorted(APPS)
+
+    logging.disable(logging.WARNING)
+    pol = load_policy(args.policy)
+    if args.pcap:
+        trace = pcap_trace(pol, args.pcap, args.count)
+    else:
+        trace = synthetic_trace(pol, args.count, args.flows, args.seed)
+
+    results = []
+    print("%-8s %8s %12s %10s %10s %12s %12s %12s" % (
+        'app', 'pkts', 'pkt/s', 'p50 us', 'p99 us', 'cold p50 us', 'FlowMod/pkt', 'mem KiB'))
+    for name in args.apps:
+        r = bench(name, pol, trace, args.warmup, args.workers, args.worker_mode)
+        results.append(r)
+        print("%-8s %8d %12.0f %10.1f %10.1f %12.1f %12.3f %12.1f" % (
+            r['app'], r['packets'], r['pps'], r['p50_us'], r['p99_us'], r['cold_p50_us'],
+            r['flowmods_per_pkt'], r['mem_growth_kib']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'args': vars(args),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
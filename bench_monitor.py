@@ -0,0 +1,130 @@
+import argparse
+import json
+import logging
+import random
+
+from rate_estimator import EWMA, WINDOW, RAW
+
+# Benchmark offline delle decisioni della slicing dinamica: profili di rate
+# video simulati (tempo simulato, nessuno switch) vengono passati al monitor
+# del controller (_monitor_step), con diverse stime del rate e intervalli di
+# campionamento. Per ogni combinazione: transizioni, flap, tempo di reazione
+# (dal primo campione oltre la soglia alla transizione), ritardo della
+# protezione rispetto all'inizio del burst e campioni al minuto (ognuno è un
+# giro di richieste di statistiche agli switch).
+
+SLOT = 0.05   # risoluzione della simulazione, secondi
+
+CONFIGS = {
+    # Monitor originale: ultimo campione, un secondo fisso
+    'original': {'RATE_ESTIMATOR': RAW, 'RATE_CONFIRM': 0,
+                 'MONITOR_MIN_INTERVAL': 1.0, 'MONITOR_MAX_INTERVAL': 1.0},
+    'raw':      {'RATE_ESTIMATOR': RAW},
+    'window':   {'RATE_ESTIMATOR': WINDOW},
+    'ewma':     {'RATE_ESTIMATOR': EWMA},
+}
+
+
+def step_profile(duration, rng):
+    # 4 Mbit/s, 9 Mbit/s da 20.3 s a 60 s
+    return [(9.0 if 20.3 <= i * SLOT < 60 else 4.0)
+            for i in range(int(duration / SLOT))], [20.3]
+
+
+def ramp_profile(duration, rng):
+    # Da 4 a 10 Mbit/s in 30 s a partire da 10 s (8 Mbit/s a 30 s), poi 10
+    return [min(max(4.0 + (i * SLOT - 10) * 0.2, 4.0), 10.0)
+            for i in range(int(duration / SLOT))], [30.0]
+
+
+def spikes_profile(duration, rng):
+    # 5 Mbit/s con picchi di mezzo secondo a 12 Mbit/s ogni 8 s
+    return [(12.0 if (i * SLOT) % 8 < 0.5 else 5.0) for i in range(int(duration / SLOT))], []
+
+
+def noisy_profile(duration, rng):
+    # 7 Mbit/s con rumore (deviazione 1.5) ricampionato ogni mezzo secondo
+    rates, value = [], 7.0
+    for i in range(int(duration / SLOT)):
+        if i % int(0.5 / SLOT) == 0:
+            value = max(rng.gauss(7.0, 1.5), 0.0)
+        rates.append(value)
+    return rates, []
+
+
+PROFILES = {'step': step_profile, 'ramp': ramp_profile, 'spikes': spikes_profile,
+            'noisy': noisy_profile}
+
+
+def make_app(config):
+    from dynamic_slicing import SliceEnforcingController
+    # Sottoclasse per configurazione: le costanti della classe restano intatte
+    cls = type('BenchController', (SliceEnforcingController,),
+               dict(config, STATE_FILE='', METRICS_PORT=0))
+    app = cls()
+    app.allow_non_video_upper = True
+    app._last_transition = -cls.MIN_DWELL
+    app._last_measure = 0.0
+    return app
+
+
+def run(config, rates, bursts):
+    app = make_app(config)
+    now, slot, samples = 0.0, 0, 0
+    end = len(rates) * SLOT
+    while now < end:
+        interval = app.monitor_interval.interval
+        last = min(int(round((now + interval) / SLOT)), len(rates))
+        app._video_bytes = sum(rates[slot:last]) * SLOT * 1e6 / 8
+        now, slot = last * SLOT, last
+        app._monitor_step(now)
+        samples += 1
+    result = app.decisions.summary()
+    result['samples_per_min'] = samples * 60.0 / end
+    # Ritardo della protezione dall'inizio di ogni burst atteso
+    protect = [t for t, state, _, _ in app.decisions.transitions if not state]
+    delays = [min(t for t in protect if t >= b) - b for b in bursts
+              if any(t >= b for t in protect)]
+    result['protect_delay'] = max(delays) if delays else None
+    return result
+
+
+def fmt(value):
+    return '-' if value is None else '%.2f' % value
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Offline benchmark of dynamic slicing decisions')
+    ap.add_argument('configs', nargs='*', metavar='config',
+                    help='configurazioni: %s (default: tutte)' % ', '.join(sorted(CONFIGS)))
+    ap.add_argument('--profile', action='append', choices=sorted(PROFILES),
+                    help='profili di rate video (default: tutti)')
+    ap.add_argument('--duration', type=float, default=120.0, help='secondi simulati')
+    ap.add_argument('--seed', type=int, default=1, help='seed del profilo rumoroso')
+    ap.add_argument('--json', help='salva i risultati in questo file')
+    args = ap.parse_args()
+    configs = args.configs or sorted(CONFIGS)
+    profiles = args.profile or sorted(PROFILES)
+
+    logging.disable(logging.WARNING)
+
+    results = []
+    print("%-8s %-9s %6s %6s %10s %10s %10s %10s" % (
+        'profile', 'config', 'trans', 'flaps', 'react avg', 'react max', 'protect', 'samp/min'))
+    for profile in profiles:
+        rates, bursts = PROFILES[profile](args.duration, random.Random(args.seed))
+        for name in configs:
+            r = run(CONFIGS[name], rates, bursts)
+            r.update(profile=profile, config=name)
+            results.append(r)
+            print("%-8s %-9s %6d %6d %10s %10s %10s %10.1f" % (
+                profile, name, r['transitions'], r['flaps'], fmt(r['reaction_mean']),
+                fmt(r['reaction_max']), fmt(r['protect_delay']), r['samples_per_min']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
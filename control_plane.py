@@ -0,0 +1,83 @@
+import collections
+import time
+
+# Protezione del canale di controllo, condivisa dai controller, su due livelli:
+#  - sullo switch: OFPSetConfig con miss_send_len e un meter in pacchetti/s
+#    sulla table-miss, così un host che genera PacketIn non satura il canale
+#  - nel controller: token bucket per MAC sorgente (per switch); i PacketIn
+#    oltre la soglia vengono scartati prima di ogni elaborazione
+# Il MAC sorgente viene letto dai byte grezzi del frame, senza parsing.
+
+
+class ControlPlaneGuard(object):
+
+    def __init__(self, logger=None, rate=0, burst=0, size=4096,
+                 meter_id=None, meter_pps=0, meter_burst=0, miss_send_len=None):
+        self.logger = logger
+        self.rate = rate                 # PacketIn/s per sorgente (0 = nessun limite)
+        self.burst = burst or rate
+        self.size = size
+        self.meter_id = meter_id if meter_pps else None
+        self.meter_pps = meter_pps
+        self.meter_burst = meter_burst
+        self.miss_send_len = miss_send_len
+        self._buckets = collections.OrderedDict()   # (dpid, MAC) -> [gettoni, istante]
+        self.limited = 0
+
+    def allow(self, dpid, data, now=None):
+        if not self.rate or data is None or len(data) < 12:
+            return True
+        now = time.time() if now is None else now
+        key = (dpid, bytes(data[6:12]))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # Sorgenti meno recenti fuori oltre `size` voci (MAC casuali)
+            if len(self._buckets) >= self.size:
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[key] = [float(self.burst), now]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return True
+        self.limited += 1
+        if self.logger and self.limited % 1000 == 1:
+            self.logger.warning("PacketIn limitati: DPID=%s sorgente %s (%d in totale)",
+                                dpid, ':'.join('%02x' % b for b in key[1]), self.limited)
+        return False
+
+    def attach(self, parser, inst):
+        # Istruzioni di una regola verso il controller precedute dal meter
+        if self.meter_id is None:
+            return inst
+        return [parser.OFPInstructionMeter(self.meter_id)] + list(inst)
+
+    def meter_mod(self, dp, command):
+        parser, ofp = dp.ofproto_parser, dp.ofproto
+        flags = ofp.OFPMF_PKTPS | ofp.OFPMF_STATS
+        if self.meter_burst:
+            flags |= ofp.OFPMF_BURST
+        bands = [parser.OFPMeterBandDrop(rate=self.meter_pps, burst_size=self.meter_burst)]
+        return parser.OFPMeterMod(dp, command=command, flags=flags,
+                                  meter_id=self.meter_id, bands=bands)
+
+    def configure(self, dp, warm=False):
+        # Inviati subito, prima delle FlowMod accodate che usano il meter. A
+        # freddo il meter viene ricreato (la delete toglie anche la vecchia
+        # table-miss, reinstallata subito dopo); a caldo add seguita da modify
+        parser, ofp = dp.ofproto_parser, dp.ofproto
+        if self.miss_send_len is not None:
+            dp.send_msg(parser.OFPSetConfig(dp, ofp.OFPC_FRAG_NORMAL, self.miss_send_len))
+        if self.meter_id is None:
+            return
+        if not warm:
+            dp.send_msg(parser.OFPMeterMod(dp, command=ofp.OFPMC_DELETE, meter_id=self.meter_id))
+        dp.send_msg(self.meter_mod(dp, ofp.OFPMC_ADD))
+        if warm:
+            dp.send_msg(self.meter_mod(dp, ofp.OFPMC_MODIFY))
+
+    def forget(self, dpid):
+        for key in [k for k in self._buckets if k[0] == dpid]:
+            del self._buckets[key]
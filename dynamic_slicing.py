@@ -1,133 +1,854 @@
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, set_ev_cls
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
+from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet, ethernet, ipv4, udp
+from ryu.lib.packet import ether_types
 from ryu.lib import hub
 import time
 
+from arp_proxy import ArpProxy
+from control_plane import ControlPlaneGuard
+from flow_cache import flow_key
+from flow_lifecycle import FlowLifecycle, DEFAULT, VIDEO
+from flow_programmer import FlowProgrammer
+from heavy_hitters import SpaceSaving
+from mac_table import MacTable
+from metrics import ControllerMetrics
+from packet_classifier import classify
+from packet_workers import PacketInWorkers, THREADS
+from path_engine import PathEngine, WIDEST, LEAST_LOADED
+from rate_estimator import RateEstimator, AdaptiveInterval, DecisionTrace, EWMA
+from slice_meters import SliceMeters
+from slice_policy import SlicePolicy, L4_FIELDS
+from state_snapshot import WarmRestart, state_path
+
 
 class SliceEnforcingController(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
-    # Porte verso backbone
-    PORT_S2 = 3  # Porta verso S2
-    PORT_S3 = 4  # Porta verso S3
+    # Slice della policy (slice_policy.json): il video (UDP 9999) usa la
+    # upper (S2), il non-video la lower (S3) o la upper se consentito. Una
+    # policy senza queste due slice viene rifiutata al caricamento; le altre
+    # slice della policy non vengono usate
+    SLICE_UPPER = 'upper'
+    SLICE_LOWER = 'lower'
     QUEUE_LOW  = 1  # coda bassa priorità per non-video
     QUEUE_HIGH = 0  # coda alta priorità per video
 
-    # Host collegati a S1 e S4
-    HOST_PORTS = {
-        1: [1,2],  # S1: h1, h2
-        4: [1,2],  # S4: h3, h4
-    }
-
     PRIORITY_DEFAULT = 10
     PRIORITY_VIDEO   = 20
 
+    # Timeout (idle, hard) in secondi delle regole installate dai PacketIn,
+    # per classe (0 = nessuno): le tabelle restano limitate e una regola
+    # rimasta su una slice superata scade da sola. Le regole di base non
+    # scadono; le transizioni (modify) non toccano i timeout.
+    TIMEOUT_VIDEO   = (30, 0)
+    TIMEOUT_DEFAULT = (60, 600)
+
+    # Misura del traffico video:
+    #  - MEASURE_FLOW_STATS: il video viene inoltrato da regole installate sugli
+    #    access switch (marcate con COOKIE_VIDEO) e il monitor legge i contatori
+    #    con OFPFlowStatsRequest; solo il primo pacchetto di ogni flusso video
+    #    arriva al controller
+    #  - MEASURE_PACKET_IN: comportamento originale, ogni pacchetto video viene
+    #    inviato al controller e contato in _packet_in_handler
+    #  - MEASURE_METER: come MEASURE_FLOW_STATS, ma il monitor legge i byte
+    #    entrati nel meter del servizio video (OFPMeterStatsRequest, una
+    #    risposta per switch invece di una voce per regola); senza un meter
+    #    per il video si usano le flow stats
+    MEASURE_FLOW_STATS = 'flow_stats'
+    MEASURE_PACKET_IN  = 'packet_in'
+    MEASURE_METER      = 'meter'
+    MEASURE_MODE = MEASURE_FLOW_STATS
+
+    # Meter OpenFlow 1.3 sugli access switch (sezione "meters" della policy):
+    # il traffico dagli host verso il backbone passa dal meter del proprio
+    # servizio (video) o della slice su cui viaggia, che cambia con le
+    # transizioni. Le code restano per la priorità sui collegamenti; i limiti
+    # di banda sono nei meter. Spento per switch senza supporto ai meter.
+    METERS = True
+
+    # Percorsi end-to-end (path_engine.py): verso un host dichiarato su un
+    # altro access switch le regole a valle dell'ingresso vengono installate
+    # al primo pacchetto lungo il percorso della slice (widest path per il
+    # video, il meno carico per il non-video), senza PacketIn né flood sul
+    # backbone. Per il non-video il percorso viene preparato su entrambe le
+    # slice, così una transizione cambia solo la regola di ingresso. Un
+    # collegamento che cade (OFPPortStatus) toglie le regole dei percorsi
+    # che lo usavano.
+    PATHS = True
+
+    COOKIE_VIDEO     = 0x1
+    COOKIE_NON_VIDEO = 0x2   # regole non-video verso il backbone
+    COOKIE_FLOW      = 0x3   # regole non-video per flusso verso il backbone
+    COOKIE_MASK      = 0xffffffffffffffff
+
+    # Offload per flusso: sugli access switch il traffico TCP/UDP non-video
+    # verso il backbone ha una regola per 5-tupla (MAC, protocollo, porte L4).
+    # Le flow stats alimentano un top-k Space-Saving e solo gli elefanti
+    # (almeno ELEPHANT_MBPS garantiti) vengono spostati: fuori dalla upper
+    # quando il video è protetto, di nuovo sulla upper quando c'è spazio. Gli
+    # altri flussi restano sulle regole già installate.
+    OFFLOAD_ELEPHANTS = True
+    PRIORITY_FLOW_PUNT = 11
+    PRIORITY_FLOW      = 12
+    FLOW_IDLE_TIMEOUT  = 30
+    ELEPHANT_MBPS      = 0.5
+    ELEPHANT_TOP_K     = 8
+    UPPER_CAPACITY_MBPS = 10.0
+
+    # Condivisione della upper slice con isteresi: il non-video lascia S2 quando
+    # il video raggiunge VIDEO_THRESHOLD_MBPS e vi torna solo quando scende sotto
+    # VIDEO_RELEASE_MBPS, dopo almeno MIN_DWELL secondi dall'ultima transizione
+    VIDEO_THRESHOLD_MBPS = 8.0
+    VIDEO_RELEASE_MBPS   = 6.0
+    MIN_DWELL = 5.0
+
+    # Stima del rate video (rate_estimator.py) su cui si decide: EWMA con
+    # emivita RATE_HALF_LIFE_UP in salita e RATE_HALF_LIFE_DOWN in discesa,
+    # WINDOW (media sugli ultimi RATE_WINDOW secondi) o RAW (ultimo campione).
+    # Il monitor campiona ogni MONITOR_MIN_INTERVAL secondi vicino alla
+    # soglia dello stato attuale o dopo un salto del rate (entrambi entro
+    # MONITOR_MARGIN volte l'isteresi THRESHOLD - RELEASE) e raddoppia
+    # l'intervallo fino a MONITOR_MAX_INTERVAL quando è stabile.
+    # Il video viene protetto anche quando i campioni restano oltre la soglia
+    # per RATE_CONFIRM secondi, prima che la stima la raggiunga (0 = spento).
+    # Le ultime DECISION_TRACE_SIZE decisioni restano in self.decisions;
+    # flap = transizione che annulla la precedente entro FLAP_WINDOW secondi
+    RATE_ESTIMATOR       = EWMA
+    RATE_HALF_LIFE_UP    = 1.0
+    RATE_HALF_LIFE_DOWN  = 3.0
+    RATE_WINDOW          = 5.0
+    RATE_CONFIRM         = 0.75
+    MONITOR_MIN_INTERVAL = 0.25
+    MONITOR_MAX_INTERVAL = 1.0
+    MONITOR_MARGIN       = 0.5
+    DECISION_TRACE_SIZE  = 3600
+    FLAP_WINDOW          = 30.0
+
+    # Canale di controllo (control_plane.py): al più PACKET_IN_RATE PacketIn/s
+    # (burst PACKET_IN_BURST) per MAC sorgente, gli altri scartati dal
+    # controller (0 = nessun limite); regole verso il controller limitate
+    # sullo switch dal meter CONTROL_METER_ID a CONTROL_METER_PPS
+    # pacchetti/s (0 = spento). MISS_SEND_LEN va allo switch con OFPSetConfig
+    # ed è il max_len delle azioni verso il controller: valori minori di
+    # OFPCML_NO_BUFFER richiedono uno switch che bufferizza i pacchetti.
+    # Con MEASURE_PACKET_IN ogni pacchetto video passa dal controller: il
+    # limite per sorgente e il meter sulle regole video non si applicano.
+    PACKET_IN_RATE    = 100
+    PACKET_IN_BURST   = 200
+    CONTROL_METER_ID  = 0xffff
+    CONTROL_METER_PPS = 1000
+    CONTROL_METER_BURST = 200
+    MISS_SEND_LEN     = ofproto_v1_3.OFPCML_NO_BUFFER
+
+    # Decodifica dei frame dei PacketIn fuori dal hub (packet_workers.py), a
+    # lotti in un thread nativo (THREADS) o in processi (PROCESSES), con una
+    # coda per gruppo di datapath in ognuno dei WORKERS worker: i PacketIn di
+    # uno switch restano in ordine. Le decisioni restano seriali nel hub:
+    # nessun guadagno di throughput, latenza maggiore. Opzionale, per tenere
+    # il hub reattivo durante raffiche di frame; 0 = tutto nell'handler.
+    WORKERS     = 0
+    WORKER_MODE = THREADS
+
+    # Tabella MAC limitata: voci scadute dopo MAC_AGING secondi senza traffico,
+    # LRU oltre MAC_TABLE_SIZE voci
+    MAC_TABLE_SIZE = 4096
+    MAC_AGING      = 300
+
+    # Metriche Prometheus su http://127.0.0.1:METRICS_PORT/metrics (0 = spento)
+    METRICS_PORT   = 9101
+    STATS_INTERVAL = 5
+
+    # Riavvio a caldo: tabella MAC e regole installate salvate in STATE_FILE
+    # e riconciliate con le flow stats all'aggancio degli switch ('' = spento)
+    STATE_FILE = state_path('dynamic_slicing')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.mac_to_port = {}
+        self.mac_table = MacTable(self.MAC_TABLE_SIZE, self.MAC_AGING)
+        self.arp = ArpProxy(self.MAC_TABLE_SIZE, self.MAC_AGING)
+        self.datapaths = {}
+        self.flows = FlowProgrammer(self.logger)
+        self.state = WarmRestart(self.STATE_FILE, self.mac_table, self.flows, self.logger)
+        self.meters = SliceMeters(self.logger)
+        self.paths = PathEngine(self.logger)
+        self.lifecycle = FlowLifecycle(self.logger)
+        rate = 0 if self.MEASURE_MODE == self.MEASURE_PACKET_IN else self.PACKET_IN_RATE
+        self.guard = ControlPlaneGuard(self.logger, rate, self.PACKET_IN_BURST,
+                                       self.MAC_TABLE_SIZE, self.CONTROL_METER_ID,
+                                       self.CONTROL_METER_PPS, self.CONTROL_METER_BURST,
+                                       self.MISS_SEND_LEN)
+        self.workers = None
+        if self.WORKERS:
+            self.workers = PacketInWorkers(self.WORKERS, self._handle_packet_in, classify,
+                                           self.WORKER_MODE, alive=self._datapath_alive,
+                                           logger=self.logger)
+        self.video_rate = RateEstimator(self.RATE_ESTIMATOR, self.RATE_HALF_LIFE_UP,
+                                        self.RATE_HALF_LIFE_DOWN, self.RATE_WINDOW)
+        self.monitor_interval = AdaptiveInterval(self.MONITOR_MIN_INTERVAL,
+                                                 self.MONITOR_MAX_INTERVAL, self.MONITOR_MARGIN)
+        self.decisions = DecisionTrace(self.DECISION_TRACE_SIZE, self.FLAP_WINDOW)
+        self.metrics = ControllerMetrics(self.logger)
+        self.metrics.track(self)
+        self.metrics.serve(self.METRICS_PORT)
+
+        self.policy = SlicePolicy(logger=self.logger,
+                                  required_slices=(self.SLICE_UPPER, self.SLICE_LOWER))
+        self.policy.add_listener(self._policy_reloaded)
+        self.policy.watch()
+        self.meters.configure(self.policy.compiled.meters if self.METERS else {})
+        self.paths.configure(self.policy.compiled)
 
         # Monitor per traffico video
         self._video_bytes   = 0
+        self._upper_bytes   = 0
+        self._drop_bytes    = 0   # byte scartati dai meter
         self._last_measure  = time.time()
-        self.allow_non_video_upper = True
+        self._flow_bytes = {}         # (dpid, match) -> ultimo byte_count
+        self._elephants = SpaceSaving(self.ELEPHANT_TOP_K * 4)
+        self._port_tx_bytes    = {}   # (dpid, port_no) -> ultimo tx_bytes
+        self._last_table_stats = {}   # dpid -> ultima richiesta di table stats
+        # Stato della condivisione ripreso dallo snapshot: le regole sugli
+        # switch lo riflettono già
+        saved = self.state.store.section('dynamic')
+        self.allow_non_video_upper = saved.get('allow_non_video_upper', True)
+        self._last_transition = saved.get('last_transition', 0.0)
         self._monitor_thread = hub.spawn(self._monitor)
 
     def _monitor(self):
         while True:
-            now = time.time()
-            elapsed = now - self._last_measure
-            if elapsed > 0:
-                video_mbps = (self._video_bytes * 8.0) / 1e6 / elapsed
-                self._video_bytes = 0
-                self._last_measure = now
-                self.allow_non_video_upper = (video_mbps < 8.0)  # soglia 8 Mbps
-                self.logger.info("Video=%.2f Mbps - allow_non_video_upper=%s",
-                                 video_mbps, self.allow_non_video_upper)
-            hub.sleep(1)
+            interval = self._monitor_step(time.time())
+            for dp in list(self.datapaths.values()):
+                self._request_stats(dp)
+            hub.sleep(interval)
+
+    def _monitor_step(self, now):
+        # Un campione: stima del rate video, decisione e prossimo intervallo
+        elapsed = now - self._last_measure
+        if elapsed <= 0:
+            return self.monitor_interval.interval
+        video_mbps = self.video_rate.update(self._video_bytes, elapsed, now)
+        raw_mbps = self.video_rate.raw
+        upper_mbps = (self._upper_bytes * 8.0) / 1e6 / elapsed
+        drop_mbps = (self._drop_bytes * 8.0) / 1e6 / elapsed
+        self._video_bytes = 0
+        self._upper_bytes = 0
+        self._drop_bytes = 0
+        self._last_measure = now
+        if self.allow_non_video_upper:
+            crossed = raw_mbps >= self.VIDEO_THRESHOLD_MBPS
+        else:
+            crossed = raw_mbps < self.VIDEO_RELEASE_MBPS
+        self.decisions.sample(now, elapsed, raw_mbps, video_mbps, self.allow_non_video_upper,
+                              crossed)
+        self._update_sharing(video_mbps, now)
+        # Prossimo campione in base alla soglia che lo stato (aggiornato) confronta
+        if self.allow_non_video_upper:
+            threshold = self.VIDEO_THRESHOLD_MBPS
+        else:
+            threshold = self.VIDEO_RELEASE_MBPS
+        interval = self.monitor_interval.next(
+            video_mbps, raw_mbps, threshold,
+            self.VIDEO_THRESHOLD_MBPS - self.VIDEO_RELEASE_MBPS)
+        self.logger.debug("Video=%.2f Mbps (campione %.2f) Upper=%.2f Mbps Meter drop=%.2f Mbps - "
+                          "allow_non_video_upper=%s, prossimo campione tra %.2fs", video_mbps,
+                          raw_mbps, upper_mbps, drop_mbps, self.allow_non_video_upper, interval)
+        if self.OFFLOAD_ELEPHANTS:
+            self._balance_elephants(upper_mbps, elapsed)
+            self._elephants.clear()
+        return interval
+
+    def _update_sharing(self, video_mbps, now):
+        if self.allow_non_video_upper:
+            # La protezione del video è immediata
+            sustained = self.RATE_CONFIRM and \
+                self.decisions.crossed_for(now) >= self.RATE_CONFIRM
+            if video_mbps < self.VIDEO_THRESHOLD_MBPS and not sustained:
+                return
+        else:
+            if video_mbps >= self.VIDEO_RELEASE_MBPS:
+                return
+            if now - self._last_transition < self.MIN_DWELL:
+                return
+
+        self.allow_non_video_upper = not self.allow_non_video_upper
+        self._last_transition = now
+        reaction = self.decisions.transition(now, self.allow_non_video_upper, video_mbps)
+        self.state.store.set('dynamic', 'allow_non_video_upper', self.allow_non_video_upper)
+        self.state.store.set('dynamic', 'last_transition', now)
+        self.logger.info("Transizione: non-video su %s (video=%.2f Mbps, reazione %.2fs)",
+                         'S2' if self.allow_non_video_upper else 'S3', video_mbps, reaction)
+        self._reroute_non_video()
+
+    def _balance_elephants(self, upper_mbps, elapsed):
+        pol = self.policy.compiled
+        target = self.SLICE_UPPER if self.allow_non_video_upper else self.SLICE_LOWER
+        headroom = self.UPPER_CAPACITY_MBPS - upper_mbps
+        for key, count, error, (dpid, match, priority, out_port) in \
+                self._elephants.top(self.ELEPHANT_TOP_K):
+            mbps = (count - error) * 8.0 / 1e6 / elapsed
+            if mbps < self.ELEPHANT_MBPS:
+                break
+            dp = self.datapaths.get(dpid)
+            new_port = pol.slice_port.get((dpid, target))
+            if dp is None or new_port is None or new_port == out_port:
+                continue
+            if target == self.SLICE_UPPER:
+                # Rientra sulla upper solo se c'è spazio
+                if mbps > headroom:
+                    continue
+                headroom -= mbps
+            self.logger.info("Elefante DPID=%s %s (%.2f Mbps) spostato su %s",
+                             dpid, dict(match.items()), mbps, target)
+            self.move_flow(dp, match, priority, new_port)
+
+    def move_flow(self, dp, match, priority, out_port):
+        parser = dp.ofproto_parser
+        ofp = dp.ofproto
+        actions = [
+            parser.OFPActionSetQueue(self.QUEUE_LOW),
+            parser.OFPActionOutput(out_port)
+        ]
+        inst = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
+        # Il flusso passa al meter della nuova slice
+        slice_name = self.policy.compiled.port_slice.get(dp.id, {}).get(out_port)
+        inst = self.meters.attach(parser, slice_name, inst)
+        mod = parser.OFPFlowMod(
+            datapath=dp,
+            cookie=self.COOKIE_FLOW,
+            cookie_mask=self.COOKIE_MASK,
+            command=ofp.OFPFC_MODIFY_STRICT,
+            priority=priority,
+            match=match,
+            instructions=inst
+        )
+        # Il flusso cambia slice quando il percorso a valle è pronto
+        hops = []
+        if slice_name is not None and 'eth_src' in match and 'eth_dst' in match:
+            hops = self.standby_paths(slice_name, [(match['eth_src'], match['eth_dst'])])
+        self.flows.when_done(hops, lambda: self._send_mods([(dp, mod)], slice_name))
+
+    def _send_mods(self, mods, slice_name):
+        # Nel frattempo una transizione può aver cambiato la slice del non-video
+        current = self.SLICE_UPPER if self.allow_non_video_upper else self.SLICE_LOWER
+        if slice_name != current:
+            return
+        for dp, mod in mods:
+            self.flows.add(dp, mod)
+            self.flows.flush(dp)
+
+    def _reroute_non_video(self):
+        # Riscrive in un solo messaggio per switch tutte le regole non-video
+        # verso il backbone (modify non-strict filtrato per cookie)
+        pol = self.policy.compiled
+        slice_name = self.SLICE_UPPER if self.allow_non_video_upper else self.SLICE_LOWER
+        mods = []
+        for dp in list(self.datapaths.values()):
+            out_port = pol.slice_port.get((dp.id, slice_name))
+            if out_port is None:
+                continue
+            parser = dp.ofproto_parser
+            ofp = dp.ofproto
+            actions = [
+                parser.OFPActionSetQueue(self.QUEUE_LOW),
+                parser.OFPActionOutput(out_port)
+            ]
+            inst = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
+            inst = self.meters.attach(parser, slice_name, inst)
+            mod = parser.OFPFlowMod(
+                datapath=dp,
+                cookie=self.COOKIE_NON_VIDEO,
+                cookie_mask=self.COOKIE_MASK,
+                command=ofp.OFPFC_MODIFY,
+                match=parser.OFPMatch(),
+                instructions=inst
+            )
+            mods.append((dp, mod))
+        # Gli ingressi cambiano slice quando i percorsi a valle sono pronti
+        self.flows.when_done(self.standby_paths(slice_name),
+                             lambda: self._send_mods(mods, slice_name))
+
+    def _request_stats(self, dp):
+        parser = dp.ofproto_parser
+        ofp = dp.ofproto
+
+        # Regole per switch (metriche), ogni STATS_INTERVAL secondi
+        now = time.time()
+        if now - self._last_table_stats.get(dp.id, 0.0) >= self.STATS_INTERVAL:
+            self._last_table_stats[dp.id] = now
+            dp.send_msg(parser.OFPTableStatsRequest(dp, 0))
+
+        if not self.policy.compiled.is_access(dp.id):
+            if self.PATHS:
+                # Carico dei collegamenti di backbone per i percorsi
+                dp.send_msg(parser.OFPPortStatsRequest(dp, 0, ofp.OFPP_ANY))
+            return
+
+        # Solo le regole video e per flusso, selezionate tramite cookie
+        cookies = []
+        if self.video_flow_stats():
+            cookies.append(self.COOKIE_VIDEO)
+        if self.OFFLOAD_ELEPHANTS:
+            cookies.append(self.COOKIE_FLOW)
+        for cookie in cookies:
+            req = parser.OFPFlowStatsRequest(dp, 0, ofp.OFPTT_ALL,
+                                             ofp.OFPP_ANY, ofp.OFPG_ANY,
+                                             cookie, self.COOKIE_MASK,
+                                             parser.OFPMatch())
+            dp.send_msg(req)
+
+        req = parser.OFPPortStatsRequest(dp, 0, ofp.OFPP_ANY)
+        dp.send_msg(req)
+        self.meters.request(dp)
+
+    def video_meters(self):
+        # Classi con un meter proprio per i servizi della upper (video)
+        pol = self.policy.compiled
+        return {name for key, name in pol.service_names.items()
+                if pol.services[key] == self.SLICE_UPPER and name in self.meters.config}
+
+    def video_flow_stats(self):
+        # Video misurato dai contatori delle regole COOKIE_VIDEO
+        return self.MEASURE_MODE == self.MEASURE_FLOW_STATS or (
+            self.MEASURE_MODE == self.MEASURE_METER and not self.video_meters())
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev):
+        dp = ev.datapath
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[dp.id] = dp
+        elif ev.state == DEAD_DISPATCHER:
+            self.datapaths.pop(dp.id, None)
+            if dp.id is not None:
+                self.flows.forget(dp.id)
+                self.mac_table.forget(dp.id)
+                self.state.forget(dp.id)
+                self.meters.forget(dp.id)
+                self.paths.forget(dp.id)
+                self.lifecycle.forget(dp.id)
+                self.guard.forget(dp.id)
+                self.metrics.forget(dp.id)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def _barrier_reply_handler(self, ev):
+        self.flows.barrier_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def _error_msg_handler(self, ev):
+        # FlowMod rifiutata: il suo future fallisce e la regola esce dalla cache
+        msg = ev.msg
+        if not self.flows.error(msg):
+            self.logger.warning("DPID=%s: errore OpenFlow type=%s code=%s",
+                                msg.datapath.id, msg.type, msg.code)
+
+    @set_ev_cls(ofp_event.EventOFPTableStatsReply, MAIN_DISPATCHER)
+    def _table_stats_reply_handler(self, ev):
+        self.metrics.table_stats(ev.msg.datapath.id, ev.msg.body)
+        self.lifecycle.table_stats(ev.msg.datapath.id, ev.msg.body)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def _flow_removed_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        self.flows.cache.flow_removed(msg)
+        self.lifecycle.flow_removed(msg, VIDEO if msg.cookie == self.COOKIE_VIDEO else DEFAULT)
+        # Byte della regola video dopo l'ultima lettura delle flow stats: il
+        # traffico dell'ultimo intervallo prima della scadenza resta contato
+        last = self._flow_bytes.pop((dpid, tuple(msg.match.items())), 0)
+        if (msg.cookie == self.COOKIE_VIDEO and self.video_flow_stats() and
+                msg.match.get('in_port') in self.policy.compiled.host_ports.get(dpid, ())):
+            self._video_bytes += max(msg.byte_count - last, 0)
+        # Regola di un percorso scaduta: il percorso viene reinstallato al
+        # prossimo PacketIn dall'ingresso
+        if 'eth_src' in msg.match and 'eth_dst' in msg.match:
+            self.paths.removed(dpid, msg.match['eth_src'], msg.match['eth_dst'])
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def _flow_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        stats = self.state.flow_stats_reply(ev.msg)
+        if stats is not None:
+            # Riconciliazione: i contatori delle regole riprese fanno da base
+            for stat in stats:
+                if stat.cookie in (self.COOKIE_VIDEO, self.COOKIE_FLOW):
+                    self._flow_bytes[(dpid, tuple(stat.match.items()))] = stat.byte_count
+            return
+        for stat in ev.msg.body:
+            in_port = stat.match.get('in_port')
+            # Solo le regole di ingresso dagli host: lo stesso flusso ha una
+            # regola anche sull'access switch di uscita e verrebbe contato due volte
+            if in_port not in self.policy.compiled.host_ports.get(dpid, ()):
+                continue
+            key = (dpid, tuple(stat.match.items()))
+            last = self._flow_bytes.get(key, 0)
+            # Contatore ripartito da zero (regola reinstallata)
+            delta = stat.byte_count - last if stat.byte_count >= last else stat.byte_count
+            self._flow_bytes[key] = stat.byte_count
+            if stat.cookie == self.COOKIE_VIDEO:
+                self._video_bytes += delta
+            elif stat.cookie == self.COOKIE_FLOW and delta:
+                out_port = None
+                for inst in stat.instructions:
+                    for action in getattr(inst, 'actions', []):
+                        out_port = getattr(action, 'port', out_port)
+                self._elephants.update(key, delta, (dpid, stat.match, stat.priority, out_port))
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def _port_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        self.metrics.port_stats(dpid, ev.msg.body, self.policy.compiled.port_slice.get(dpid, {}))
+        self.paths.port_stats(dpid, ev.msg.body)
+        upper_port = self.policy.compiled.slice_port.get((dpid, self.SLICE_UPPER))
+        for stat in ev.msg.body:
+            if stat.port_no != upper_port:
+                continue
+            key = (dpid, stat.port_no)
+            last = self._port_tx_bytes.get(key)
+            self._port_tx_bytes[key] = stat.tx_bytes
+            if last is None:
+                continue   # prima lettura: base per le successive
+            delta = stat.tx_bytes - last if stat.tx_bytes >= last else stat.tx_bytes
+            self._upper_bytes += delta
+
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    def _port_status_handler(self, ev):
+        msg = ev.msg
+        ofp = msg.datapath.ofproto
+        up = (msg.reason != ofp.OFPPR_DELETE and not msg.desc.state & ofp.OFPPS_LINK_DOWN
+              and not msg.desc.config & ofp.OFPPC_PORT_DOWN)
+        # Le regole dei percorsi interrotti vengono tolte: il pacchetto
+        # successivo torna al controller dall'ingresso e prende un nuovo percorso
+        for key, path in self.paths.port_status(msg.datapath.id, msg.desc.port_no, up):
+            src, dst = key[:2]
+            for dpid in path:
+                dp = self.datapaths.get(dpid)
+                if dp is not None:
+                    self.delete_flows(dp, dp.ofproto_parser.OFPMatch(eth_src=src, eth_dst=dst))
+                    self.flows.flush(dp)
+
+    @set_ev_cls(ofp_event.EventOFPMeterStatsReply, MAIN_DISPATCHER)
+    def _meter_stats_reply_handler(self, ev):
+        entered, dropped = self.meters.stats_reply(ev.msg.datapath.id, ev.msg.body)
+        self._drop_bytes += sum(dropped.values())
+        if self.MEASURE_MODE == self.MEASURE_METER:
+            # I meter sono solo sulle regole di ingresso: nessun doppio conteggio
+            for name in self.video_meters():
+                self._video_bytes += entered.get(name, 0)
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         dp = ev.msg.datapath   # lo switch
+        # Switch già noto: meter e regole restano, quelle ancora presenti
+        # tornano nella cache
+        warm = self.state.is_warm(dp.id)
+        self.install_base_flows(dp, warm)
+        self.flows.flush(dp)
+        if warm:
+            self.state.request(dp)
+
+    def install_base_flows(self, dp, warm=False):
         parser = dp.ofproto_parser
         ofp = dp.ofproto
 
-        # Proactive match per traffico video
-        match_video_dst = parser.OFPMatch(
-            eth_type=0x0800,   # IPv4
-            ip_proto=17,       # UDP
-            udp_dst=9999
-        )
-        match_video_src = parser.OFPMatch(
-            eth_type=0x0800,
-            ip_proto=17,
-            udp_src=9999
-        )
+        # I meter precedono le regole che li usano (quello del canale di
+        # controllo dopo la delete dei meter delle slice)
+        if self.policy.compiled.is_access(dp.id):
+            self.meters.install(dp, warm)
+        self.guard.configure(dp, warm)
 
-        actions_video = [parser.OFPActionOutput(ofp.OFPP_CONTROLLER,
-                                                ofp.OFPCML_NO_BUFFER)]
+        # Regole verso il controller limitate dal meter del canale di controllo
+        actions_controller = [parser.OFPActionOutput(ofp.OFPP_CONTROLLER, self.MISS_SEND_LEN)]
+        inst_controller = self.guard.attach(parser, [
+            parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions_controller)])
+        inst_video = inst_controller
+        if self.MEASURE_MODE == self.MEASURE_PACKET_IN:
+            inst_video = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS,
+                                                       actions_controller)]
 
-        self.add_flow(dp, 15, match_video_dst, actions_video)
-        self.add_flow(dp, 15, match_video_src, actions_video)
+        # Il video arriva al controller finché non ha una propria regola
+        # (priorità 20), anche se esiste già una regola non-video per la coppia
+        for ip_proto, port, slice_name in self.policy.compiled.service_matches:
+            if slice_name != self.SLICE_UPPER:
+                continue
+            for field in L4_FIELDS[ip_proto]:
+                match_video = parser.OFPMatch(
+                    eth_type=0x0800,   # IPv4
+                    ip_proto=ip_proto,
+                    **{field: port}
+                )
+                self.add_flow(dp, 15, match_video, None, inst=inst_video)
+
+        # TCP/UDP dagli host al controller, per le regole per flusso
+        if self.OFFLOAD_ELEPHANTS:
+            for in_port in self.policy.compiled.host_ports.get(dp.id, ()):
+                for ip_proto in L4_FIELDS:
+                    match_flow = parser.OFPMatch(in_port=in_port, eth_type=0x0800,
+                                                 ip_proto=ip_proto)
+                    self.add_flow(dp, self.PRIORITY_FLOW_PUNT, match_flow, None,
+                                  inst=inst_controller)
 
         # Regola di default
         match_default = parser.OFPMatch()
-        actions_default = [parser.OFPActionOutput(ofp.OFPP_CONTROLLER,
-                                                  ofp.OFPCML_NO_BUFFER)]
-        self.add_flow(dp, 0, match_default, actions_default)
+        self.add_flow(dp, 0, match_default, None, inst=inst_controller)
+
+    def delete_flows(self, dp, match=None):
+        parser = dp.ofproto_parser
+        ofp = dp.ofproto
+        mod = parser.OFPFlowMod(datapath=dp, command=ofp.OFPFC_DELETE,
+                                table_id=ofp.OFPTT_ALL, out_port=ofp.OFPP_ANY,
+                                out_group=ofp.OFPG_ANY, match=match or parser.OFPMatch())
+        return self.flows.add(dp, mod)
+
+    def arp_reply(self, dp, in_port, data, allowed=None):
+        # Proxy ARP: risponde dall'access switch di ingresso se il target è noto
+        reply = self.arp.process(data, self.policy.compiled.host_ips, allowed)
+        if reply is None:
+            return False
+        parser, ofp = dp.ofproto_parser, dp.ofproto
+        out = parser.OFPPacketOut(datapath=dp, buffer_id=ofp.OFP_NO_BUFFER,
+                                  in_port=ofp.OFPP_CONTROLLER,
+                                  actions=[parser.OFPActionOutput(in_port)], data=reply)
+        self.flows.packet_out(dp, out)
+        return True
+
+    def host_moved(self, mac, dpid, port):
+        # Le regole verso il MAC puntano alla vecchia posizione: vengono
+        # rimosse su tutti gli switch e il MAC viene reimparato da capo
+        self.logger.info("Host %s spostato: DPID=%s porta %s", mac, dpid, port)
+        self.mac_table.remove(mac)
+        self.mac_table.learn(dpid, mac, port)
+        for other in list(self.datapaths.values()):
+            self.delete_flows(other, other.ofproto_parser.OFPMatch(eth_dst=mac))
+            self.flows.flush(other)
+
+    def _policy_reloaded(self, policy):
+        # Host, porte e servizi possono essere cambiati: si riparte dalle
+        # regole di base (la barrier separa delete e nuove regole)
+        self.mac_table.clear()
+        self.state.clear_macs()
+        self._flow_bytes.clear()
+        self._elephants.clear()
+        self.meters.configure(policy.meters if self.METERS else {})
+        self.paths.configure(policy)
+        for dp in list(self.datapaths.values()):
+            self.delete_flows(dp)
+            self.flows.flush(dp)
+            self.install_base_flows(dp)
+            self.flows.flush(dp)
 
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+    def set_meter_rate(self, name, rate_kbps, burst_kbit=None):
+        # Limite di una classe cambiato a runtime, senza toccare le regole
+        self.meters.set_rate(list(self.datapaths.values()), name, rate_kbps, burst_kbit)
+
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None, cookie=0,
+                 timeout=(0, 0), meter=None, inst=None):
         parser = datapath.ofproto_parser
         ofproto = datapath.ofproto
-        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        if inst is None:
+            inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        if meter is not None:
+            inst = self.meters.attach(parser, meter, inst)
+        key = flow_key(0, priority, match, inst, cookie, timeout)
+        if buffer_id is None or buffer_id == ofproto.OFP_NO_BUFFER:
+            # Regola già installata: niente FlowMod da costruire
+            fut = self.flows.cached(datapath, key)
+            if fut is not None:
+                return fut
         mod = parser.OFPFlowMod(
             datapath=datapath,
+            cookie=cookie,
             buffer_id=buffer_id if buffer_id is not None else ofproto.OFP_NO_BUFFER,
             priority=priority,
+            idle_timeout=timeout[0],
+            hard_timeout=timeout[1],
             match=match,
-            instructions=inst
+            instructions=inst,
+            flags=ofproto.OFPFF_SEND_FLOW_REM
         )
-        datapath.send_msg(mod)
+        return self.flows.add(datapath, mod, key)
+
+    def add_video_flows(self, datapath, in_port, src, dst, info, actions, meter=False):
+        # meter: regola di ingresso verso il backbone, con il meter del servizio
+        parser = datapath.ofproto_parser
+        services = self.policy.compiled.services
+        service_names = self.policy.compiled.service_names
+        src_field, dst_field = L4_FIELDS[info.ip_proto]
+        fut = None
+        for field, port in ((dst_field, info.dst_port), (src_field, info.src_port)):
+            if services.get((info.ip_proto, port)) != self.SLICE_UPPER:
+                continue
+            match = parser.OFPMatch(
+                in_port=in_port,
+                eth_src=src,
+                eth_dst=dst,
+                eth_type=0x0800,
+                ip_proto=info.ip_proto,
+                **{field: port}
+            )
+            name = None
+            if meter:
+                name = self.meters.pick(service_names.get((info.ip_proto, port)),
+                                        self.SLICE_UPPER)
+            fut = self.add_flow(datapath, self.PRIORITY_VIDEO, match, actions,
+                                cookie=self.COOKIE_VIDEO, timeout=self.TIMEOUT_VIDEO, meter=name)
+        return fut
+
+    def route(self, dp, in_port, src, dst, info, is_video, after=None):
+        # Regole a valle dell'access switch di ingresso verso l'host
+        # dichiarato dst; restituisce la porta di uscita dall'ingresso per
+        # la slice corrente, None se dst non è raggiungibile così. In
+        # `after` i future ancora da confermare delle regole a valle sulla
+        # slice corrente
+        loc = self.policy.compiled.host_location.get(dst)
+        if loc is None or loc[0] == dp.id:
+            return None
+        if is_video:
+            plans = [(self.SLICE_UPPER, WIDEST, self.QUEUE_HIGH)]
+            target = self.SLICE_UPPER
+        else:
+            plans = [(self.SLICE_UPPER, LEAST_LOADED, self.QUEUE_LOW),
+                     (self.SLICE_LOWER, LEAST_LOADED, self.QUEUE_LOW)]
+            target = self.SLICE_UPPER if self.allow_non_video_upper else self.SLICE_LOWER
+
+        out_port = None
+        for slice_name, kind, queue_id in plans:
+            port, futures = self.route_slice(dp.id, in_port, src, dst, loc, slice_name, kind,
+                                             queue_id, info, is_video)
+            if port is not None and slice_name == target:
+                out_port = port
+                if after is not None:
+                    after.extend(futures)
+        return out_port
+
+    def route_slice(self, dpid, in_port, src, dst, loc, slice_name, kind, queue_id,
+                    info=None, is_video=False):
+        # Percorso di una slice dall'ingresso dpid a loc: (porta di uscita
+        # dall'ingresso, future da confermare delle regole a valle), con
+        # porta None se la slice non ha un percorso
+        pol = self.policy.compiled
+        port = pol.slice_port.get((dpid, slice_name))
+        path = port and self.paths.path_via(slice_name, dpid, port, loc[0], kind)
+        if not path:
+            return None, []
+        # Regole a valle già installate se il percorso non è cambiato
+        key = (src, dst, slice_name, kind)
+        if is_video:
+            key += tuple(p for p in (info.dst_port, info.src_port)
+                         if pol.services.get((info.ip_proto, p)) == self.SLICE_UPPER)
+        if not self.paths.record(key, path):
+            return port, self.paths.pending(key)
+        futures = []
+        for hop_dpid, port_in, port_out in self.paths.hops(path, in_port, loc[1])[1:]:
+            other = self.datapaths.get(hop_dpid)
+            if other is None:
+                continue
+            parser = other.ofproto_parser
+            actions = [
+                parser.OFPActionSetQueue(queue_id),
+                parser.OFPActionOutput(port_out)
+            ]
+            if is_video:
+                futures.append(self.add_video_flows(other, port_in, src, dst, info, actions))
+            else:
+                match = parser.OFPMatch(in_port=port_in, eth_src=src, eth_dst=dst)
+                futures.append(self.add_flow(other, self.PRIORITY_DEFAULT, match, actions,
+                                             timeout=self.TIMEOUT_DEFAULT))
+            self.flows.flush(other)
+        self.paths.installing(key, futures)
+        return port, futures
+
+    def standby_paths(self, slice_name, pairs=None):
+        # Prima di spostare regole di ingresso non-video su slice_name: le
+        # regole a valle di quella slice, senza traffico, possono essere
+        # scadute per idle timeout e vengono reinstallate. Restituisce i
+        # future da attendere prima di riscrivere l'ingresso
+        if not self.PATHS:
+            return []
+        pol = self.policy.compiled
+        futures = []
+        if pairs is None:
+            pairs = self.paths.pairs(LEAST_LOADED)
+        for src, dst in pairs:
+            ingress = pol.host_location.get(src)
+            loc = pol.host_location.get(dst)
+            if ingress is None or loc is None or ingress[0] == loc[0]:
+                continue
+            futures.extend(self.route_slice(ingress[0], ingress[1], src, dst, loc, slice_name,
+                                            LEAST_LOADED, self.QUEUE_LOW)[1])
+        return futures
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
+        if not self.guard.allow(ev.msg.datapath.id, ev.msg.data):
+            return
+        if self.workers is not None:
+            self.workers.submit(ev)
+            return
+        self._handle_packet_in(ev)
+
+    def _datapath_alive(self, dp):
+        # PacketIn ancora in coda nei worker di uno switch disconnesso
+        return self.datapaths.get(dp.id) is dp
+
+    def _handle_packet_in(self, ev, info=None):
+        start = time.perf_counter()
+        self._process_packet_in(ev, info)
+        self.flows.flush(ev.msg.datapath)
+        self.metrics.observe_packet_in(ev.msg.datapath.id, time.perf_counter() - start)
+
+    def _process_packet_in(self, ev, info=None):
         msg = ev.msg
         dp = msg.datapath
         dpid = dp.id
         parser = dp.ofproto_parser
         ofp = dp.ofproto
         in_port = msg.match['in_port']
+        pol = self.policy.compiled
 
-        pkt = packet.Packet(msg.data)  # estrae il pacchetto
-        eth = pkt.get_protocol(ethernet.ethernet)
-        if not eth:  # ignora traffico non Ethernet
+        if info is None:
+            info = classify(msg.data)  # estrae i campi del pacchetto
+        if not info:  # ignora traffico non Ethernet
             return
 
-        src = eth.src
-        dst = eth.dst
+        src = info.src
+        dst = info.dst
 
-        # MAC learning
-        self.mac_to_port.setdefault(dpid, {})
-        self.mac_to_port[dpid][src] = in_port
+        # MAC learning: un cambio di porta da/verso una porta host è uno spostamento
+        moved = self.mac_table.learn(dpid, src, in_port)
+        if moved is not None and (pol.is_host_port(dpid, moved) or
+                                  pol.is_host_port(dpid, in_port)):
+            self.host_moved(src, dpid, in_port)
 
-        ip_pkt  = pkt.get_protocol(ipv4.ipv4)
-        udp_pkt = pkt.get_protocol(udp.udp)
+        # Proxy ARP: le richieste risolvibili non attraversano il backbone
+        if (info.ethertype == ether_types.ETH_TYPE_ARP and pol.is_host_port(dpid, in_port)
+                and self.arp_reply(dp, in_port, msg.data)):
+            return
 
         # Flag se pacchetto è video (UDP porta 9999)
-        is_video = bool(ip_pkt and udp_pkt and
-                        (udp_pkt.dst_port == 9999 or udp_pkt.src_port == 9999))
+        is_video = (pol.slice_for(info.ip_proto, info.src_port, info.dst_port)
+                    == self.SLICE_UPPER)
 
-        if is_video:
+        if is_video and self.MEASURE_MODE == self.MEASURE_PACKET_IN:
             self._video_bytes += len(msg.data)
 
-        if dpid in (1, 4):  # Access switches
-            if dst in self.mac_to_port[dpid]:
-                out_port = self.mac_to_port[dpid][dst]
+        fut = None  # installazione da attendere prima della PacketOut
+        hops = []   # e regole a valle del percorso
+        if pol.is_access(dpid):  # Access switches
+            host_ports = pol.host_ports[dpid]
+            port_upper = pol.slice_port[(dpid, self.SLICE_UPPER)]
+            port_lower = pol.slice_port[(dpid, self.SLICE_LOWER)]
+            out_port = self.mac_table.get(dpid, dst)
+            # Host remoto dichiarato: percorso completo, anche se dst non è
+            # ancora stato imparato (niente flood)
+            if (self.PATHS and pol.is_host_port(dpid, in_port) and
+                    (out_port is None or out_port not in host_ports)):
+                out_port = self.route(dp, in_port, src, dst, info, is_video, hops) or out_port
+            if out_port is not None:
 
                 # Se è un host locale
-                if out_port in self.HOST_PORTS[dpid]:
+                if out_port in host_ports:
                     if is_video:
                         queue_id = self.QUEUE_HIGH
                     else:
@@ -139,31 +860,76 @@ class SliceEnforcingController(app_manager.RyuApp):
                 else:
                     # Verso backbone: scegli porta e coda
                     if is_video:
-                        out_port = self.PORT_S2     # upper slice obbligatoria
+                        out_port = port_upper     # upper slice obbligatoria
                         queue_id = self.QUEUE_HIGH
                     else:
                         if self.allow_non_video_upper:
-                            out_port = self.PORT_S2  # upper slice consentita
+                            out_port = port_upper  # upper slice consentita
                             queue_id = self.QUEUE_LOW
                         else:
-                            out_port = self.PORT_S3  # lower slice
+                            out_port = port_lower  # lower slice
                             queue_id = self.QUEUE_LOW
                     actions = [
                         parser.OFPActionSetQueue(queue_id),
                         parser.OFPActionOutput(out_port)
                     ]
+
+                # Dagli host verso il backbone: meter della classe
+                ingress = pol.is_host_port(dpid, in_port) and out_port not in host_ports
+                meter = None
+                if ingress:
+                    meter = self.SLICE_UPPER if out_port == port_upper else self.SLICE_LOWER
+
+                # Regole video sul datapath, contate poi dalle flow stats o dai meter
+                if is_video and self.MEASURE_MODE != self.MEASURE_PACKET_IN:
+                    fut = self.add_video_flows(dp, in_port, src, dst, info, actions,
+                                               meter=ingress)
+                elif (not is_video and self.OFFLOAD_ELEPHANTS and
+                      out_port not in host_ports and info.ip_proto in L4_FIELDS):
+                    # Regola per flusso, spostabile singolarmente se diventa un elefante
+                    src_field, dst_field = L4_FIELDS[info.ip_proto]
+                    match = parser.OFPMatch(
+                        in_port=in_port,
+                        eth_src=src,
+                        eth_dst=dst,
+                        eth_type=0x0800,
+                        ip_proto=info.ip_proto,
+                        **{src_field: info.src_port, dst_field: info.dst_port}
+                    )
+                    fut = self.add_flow(dp, self.PRIORITY_FLOW, match, actions,
+                                        cookie=self.COOKIE_FLOW,
+                                        timeout=(self.FLOW_IDLE_TIMEOUT, self.TIMEOUT_DEFAULT[1]),
+                                        meter=meter)
+                elif not is_video:
+                    # Le regole verso il backbone sono marcate per essere
+                    # riscritte a ogni transizione di allow_non_video_upper
+                    match = parser.OFPMatch(
+                        in_port=in_port,
+                        eth_src=src,
+                        eth_dst=dst
+                    )
+                    if out_port in host_ports:
+                        cookie = 0
+                    else:
+                        cookie = self.COOKIE_NON_VIDEO
+                    # Sopra le regole TCP/UDP verso il controller
+                    prio = self.PRIORITY_DEFAULT
+                    if self.OFFLOAD_ELEPHANTS and out_port in host_ports:
+                        prio = self.PRIORITY_FLOW
+                    fut = self.add_flow(dp, prio, match, actions, cookie=cookie,
+                                        timeout=self.TIMEOUT_DEFAULT, meter=meter)
             else:
                 # Flood iniziale se MAC sconosciuto
-                flood_ports = list(self.HOST_PORTS[dpid])
+                flood_ports = list(host_ports)
                 if is_video:
-                    flood_ports.append(self.PORT_S2)
+                    flood_ports.append(port_upper)
                     queue_id = self.QUEUE_HIGH
                 else:
                     if self.allow_non_video_upper:
-                        flood_ports.append(self.PORT_S2)
+                        flood_ports.append(port_upper)
                         queue_id = self.QUEUE_LOW
                     else:
-                        flood_ports.append(self.PORT_S3)
+                        flood_ports.append(port_lower)
                         queue_id = self.QUEUE_LOW
 
                 actions = (
@@ -172,8 +938,8 @@ class SliceEnforcingController(app_manager.RyuApp):
                 )
 
         else:  # Backbone switches (s2, s3)
-            if dst in self.mac_to_port[dpid]:
-                out_port = self.mac_to_port[dpid][dst]
+            out_port = self.mac_table.get(dpid, dst)
+            if out_port is not None:
                 if is_video:
                     queue_id = self.QUEUE_HIGH
                 else:
@@ -191,12 +957,13 @@ class SliceEnforcingController(app_manager.RyuApp):
                 )
 
                 priority = self.PRIORITY_VIDEO if is_video else self.PRIORITY_DEFAULT
+                timeout = self.TIMEOUT_VIDEO if is_video else self.TIMEOUT_DEFAULT
 
                 if msg.buffer_id != ofp.OFP_NO_BUFFER:
-                    self.add_flow(dp, priority, match, actions, msg.buffer_id)
+                    self.add_flow(dp, priority, match, actions, msg.buffer_id, timeout=timeout)
                     return
                 else:
-                    self.add_flow(dp, priority, match, actions)
+                    fut = self.add_flow(dp, priority, match, actions, timeout=timeout)
             else:
                 if is_video:
                     queue_id = self.QUEUE_HIGH
@@ -214,4 +981,4 @@ class SliceEnforcingController(app_manager.RyuApp):
             in_port=in_port, actions=actions,
             data=data
         )
-        dp.send_msg(out)
+        self.flows.packet_out(dp, out, after=[fut] + hops)
@@ -0,0 +1,279 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+from mininet.log import setLogLevel, info
+
+from topology import Environment, generate
+
+# Esperimenti automatici sulla topologia di topology.py: flussi video
+# (UDP 9999) e bulk (TCP) con iperf3 secondo un programma temporale, ping
+# continui fra coppie di host e campionamento dei contatori delle porte di
+# backbone del primo access switch. Il controller va avviato a parte
+# (ryu-manager ...); i risultati finiscono in un file JSON.
+#
+# Tempo di reroute: dall'intervallo iperf3 in cui il video supera
+# VIDEO_THRESHOLD_MBPS al primo campione in cui la porta della lower slice
+# trasporta più di LOWER_ACTIVE_MBPS (il non-video ha lasciato S2).
+
+VIDEO_PORT = 9999
+BULK_PORT  = 5201
+VIDEO_THRESHOLD_MBPS = 8.0
+LOWER_ACTIVE_MBPS    = 0.5
+SAMPLE_INTERVAL = 0.2
+PING_INTERVAL   = 0.2
+
+DEFAULT_SCHEDULE = [
+    {'name': 'bulk-h2-h4', 'src': 'h2', 'dst': 'h4', 'kind': 'bulk', 'start': 0, 'duration': 40},
+    {'name': 'video-h1-h3', 'src': 'h1', 'dst': 'h3', 'kind': 'video', 'start': 10,
+     'duration': 20, 'bw': '9M'},
+]
+DEFAULT_PINGS = [('h1', 'h3'), ('h2', 'h4'), ('h1', 'h4'), ('h2', 'h3')]
+
+_PING_LINE = re.compile(r'^\[(\d+\.\d+)\].*icmp_seq=(\d+).*time=([\d.]+) ms')
+_PING_SUMMARY = re.compile(r'(\d+) packets transmitted, (\d+) received')
+
+
+def random_schedule(hosts, count, duration, seed=1):
+    # count flussi fra host distinti; al più un video per destinazione
+    rnd = random.Random(seed)
+    schedule = []
+    for i in range(count):
+        src, dst = rnd.sample(hosts, 2)
+        kind = rnd.choice(['video', 'bulk'])
+        start = round(rnd.uniform(0, duration / 2.0), 1)
+        flow = {'name': '%s-%s-%s-%d' % (kind, src, dst, i), 'src': src, 'dst': dst,
+                'kind': kind, 'start': start,
+                'duration': round(rnd.uniform(5, duration - start), 1)}
+        if kind == 'video':
+            flow['bw'] = '%dM' % rnd.randint(2, 10)
+            if any(f['kind'] == 'video' and f['dst'] == dst for f in schedule):
+                flow['kind'] = 'bulk'
+                flow['name'] = flow['name'].replace('video', 'bulk', 1)
+                del flow['bw']
+        schedule.append(flow)
+    return schedule
+
+
+def check_schedule(schedule):
+    # Un solo video per host di destinazione, anche in tempi diversi: i
+    # server iperf3 (-s -1, una sola prova) partono tutti all'inizio e la
+    # porta video è la stessa
+    seen = {}
+    for flow in schedule:
+        if flow['kind'] != 'video':
+            continue
+        other = seen.setdefault(flow['dst'], flow)
+        if other is not flow:
+            raise ValueError("video %s e %s verso lo stesso host" % (other['name'], flow['name']))
+
+
+def summarize(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {'min': values[0], 'avg': sum(values) / len(values), 'max': values[-1],
+            'p99': values[min(len(values) - 1, int(0.99 * len(values)))]}
+
+
+class ExperimentRunner(object):
+
+    def __init__(self, env, spec, schedule, pings=DEFAULT_PINGS):
+        check_schedule(schedule)
+        self.env = env
+        self.spec = spec
+        self.schedule = schedule
+        self.pings = pings
+        self.flows = {}
+        self.ping_results = {}
+        self.samples = []
+        self._stop = threading.Event()
+
+        # Porte di backbone del primo access switch, una per slice
+        links = spec['links']
+        self.access = min(int(d) for d, _, _ in spec['hosts'].values())
+        self.slice_ports = {}
+        for name, sl in spec['slices'].items():
+            for dpid in sl['path']:
+                if str(dpid) in links[str(self.access)]:
+                    self.slice_ports[name] = links[str(self.access)][str(dpid)]
+                    break
+
+    def host(self, name):
+        return self.env.net.get(name)
+
+    def duration(self):
+        return max(f['start'] + f['duration'] for f in self.schedule)
+
+    def run(self):
+        servers = []
+        for i, flow in enumerate(self.schedule):
+            flow['port'] = VIDEO_PORT if flow['kind'] == 'video' else BULK_PORT + i
+            servers.append(self.host(flow['dst']).popen(
+                ['iperf3', '-s', '-1', '-p', str(flow['port'])]))
+        time.sleep(1)
+
+        total = self.duration() + 2
+        self.t0 = time.time()
+        threads = [threading.Thread(target=self._sample)]
+        threads += [threading.Thread(target=self._ping, args=(src, dst, total))
+                    for src, dst in self.pings]
+        workers = [threading.Thread(target=self._flow, args=(flow,)) for flow in self.schedule]
+        for t in threads + workers:
+            t.start()
+        for t in workers:
+            t.join()
+        for t in threads[1:]:
+            t.join()
+        self._stop.set()
+        threads[0].join()
+        for p in servers:
+            if p.poll() is None:
+                p.terminate()
+        return self.results()
+
+    def _flow(self, flow):
+        time.sleep(max(0.0, self.t0 + flow['start'] - time.time()))
+        dst = self.host(flow['dst'])
+        cmd = ['iperf3', '-c', dst.IP(), '-p', str(flow['port']), '-J', '-i', '0.5',
+               '-t', str(flow['duration'])]
+        if flow['kind'] == 'video':
+            cmd += ['-u', '-b', flow.get('bw', '9M')]
+        started = time.time() - self.t0
+        out, _ = self.host(flow['src']).popen(cmd).communicate()
+        try:
+            report = json.loads(out)
+        except ValueError:
+            report = {'error': 'output iperf3 non valido'}
+        self.flows[flow['name']] = {'started': started, 'report': report}
+
+    def _ping(self, src, dst, total):
+        cmd = ['ping', '-D', '-i', str(PING_INTERVAL), '-w', str(int(total)),
+               self.host(dst).IP()]
+        out, _ = self.host(src).popen(cmd).communicate()
+        rtts, sent, received = [], 0, 0
+        for line in out.decode(errors='replace').splitlines():
+            m = _PING_LINE.match(line)
+            if m:
+                rtts.append((float(m.group(1)) - self.t0, float(m.group(3))))
+                continue
+            m = _PING_SUMMARY.search(line)
+            if m:
+                sent, received = int(m.group(1)), int(m.group(2))
+        self.ping_results['%s-%s' % (src, dst)] = {
+            'sent': sent, 'received': received,
+            'loss': 1.0 - float(received) / sent if sent else None,
+            'rtt_ms': summarize([r for _, r in rtts]),
+            'samples': rtts,
+        }
+
+    def _sample(self):
+        def tx_bytes(port):
+            path = '/sys/class/net/s%d-eth%d/statistics/tx_bytes' % (self.access, port)
+            with open(path) as f:
+                return int(f.read())
+        while not self._stop.is_set():
+            self.samples.append((time.time() - self.t0,
+                                 {name: tx_bytes(port) for name, port in self.slice_ports.items()}))
+            self._stop.wait(SAMPLE_INTERVAL)
+
+    def port_rates(self):
+        # Mbit/s per slice fra campioni consecutivi
+        rates = []
+        for (t1, b1), (t2, b2) in zip(self.samples, self.samples[1:]):
+            rates.append((t2, {name: (b2[name] - b1[name]) * 8 / 1e6 / (t2 - t1) for name in b2}))
+        return rates
+
+    def reroute_time(self, rates):
+        lower = self.spec.get('default_slice')
+        for flow in self.schedule:
+            if flow['kind'] != 'video' or flow['name'] not in self.flows:
+                continue
+            run = self.flows[flow['name']]
+            crossed = None
+            for interval in run['report'].get('intervals', []):
+                s = interval['sum']
+                if s['bits_per_second'] / 1e6 >= VIDEO_THRESHOLD_MBPS:
+                    crossed = run['started'] + s['end']
+                    break
+            if crossed is None:
+                continue
+            for t, rate in rates:
+                if t >= crossed and rate.get(lower, 0.0) >= LOWER_ACTIVE_MBPS:
+                    return {'flow': flow['name'], 'threshold_crossed': crossed,
+                            'non_video_moved': t, 'reroute_s': t - crossed}
+            return {'flow': flow['name'], 'threshold_crossed': crossed,
+                    'non_video_moved': None, 'reroute_s': None}
+        return None
+
+    def results(self):
+        flows = {}
+        for name, run in self.flows.items():
+            end = run['report'].get('end', {})
+            total = end.get('sum') or end.get('sum_received') or {}
+            flows[name] = {
+                'started': run['started'],
+                'mbps': total.get('bits_per_second', 0.0) / 1e6,
+                'jitter_ms': total.get('jitter_ms'),
+                'lost_percent': total.get('lost_percent'),
+                'retransmits': end.get('sum_sent', {}).get('retransmits'),
+                'error': run['report'].get('error'),
+                'iperf3': run['report'],
+            }
+        rates = self.port_rates()
+        return {
+            'schedule': self.schedule,
+            'flows': flows,
+            'ping': self.ping_results,
+            'port_mbps': rates,
+            'reroute': self.reroute_time(rates),
+        }
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Esperimenti di slicing (iperf3 + ping)')
+    ap.add_argument('--access', type=int, default=2, help='access switch')
+    ap.add_argument('--hosts', type=int, default=2, help='host per access switch')
+    ap.add_argument('--slices', type=int, default=2, help='slice (backbone)')
+    ap.add_argument('--schedule', help='programma dei flussi (JSON, lista di flussi)')
+    ap.add_argument('--random', type=int, metavar='N', help='N flussi casuali')
+    ap.add_argument('--duration', type=float, default=60, help='durata dei flussi casuali')
+    ap.add_argument('--seed', type=int, default=1, help='seed dei flussi casuali')
+    ap.add_argument('--controller', default='', help='etichetta del controller in uso')
+    ap.add_argument('-o', '--out', default='results.json', help='file dei risultati')
+    args = ap.parse_args()
+
+    try:
+        spec = generate(args.access, args.hosts, args.slices)
+    except ValueError as e:
+        ap.error(str(e))
+    if args.schedule:
+        with open(args.schedule) as f:
+            schedule = json.load(f)
+    elif args.random:
+        names = ['h%d' % n for n in range(1, len(spec['hosts']) + 1)]
+        schedule = random_schedule(names, args.random, args.duration, args.seed)
+    else:
+        schedule = [dict(f) for f in DEFAULT_SCHEDULE]
+
+    setLogLevel('info')
+    env = Environment(spec)
+    try:
+        info("*** Attesa del controller\n")
+        env.net.waitConnected()
+        env.net.pingAll()   # MAC learning e ARP prima delle misure
+        runner = ExperimentRunner(env, spec, schedule)
+        info("*** Esperimento di %.0f s\n" % runner.duration())
+        results = runner.run()
+    finally:
+        env.net.stop()
+
+    results['controller'] = args.controller
+    results['topology'] = {'access': args.access, 'hosts': args.hosts, 'slices': args.slices}
+    results['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    info("*** Risultati in %s\n" % args.out)
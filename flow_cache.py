@@ -0,0 +1,193 @@
+import time
+
+# Cache delle regole installate, per datapath, indicizzata da
+# (table_id, priority, match). Una FlowMod ADD identica (stesse istruzioni,
+# cookie e timeout) a una regola già installata o in installazione viene
+# soppressa. Il confronto usa flow_key(), una tupla calcolata dagli oggetti
+# che il chiamante ha già (match e istruzioni), prima di costruire la
+# FlowMod; la stessa tupla finisce nello snapshot su disco. Le voci
+# scadono secondo idle/hard timeout della regola (in modo conservativo: il
+# controller non vede il traffico che rinnova l'idle timeout) e vengono
+# rimosse da FlowRemoved e da FlowMod DELETE/MODIFY. on_change(dpid, chiave,
+# regola o None) segue ogni voce aggiunta, modificata o rimossa (non forget).
+
+
+_FIELDS = {}   # classe di azione/istruzione -> attributi confrontati
+
+
+def rule_key(table_id, priority, match):
+    # Campi ordinati: un match decodificato da FlowRemoved o da una risposta
+    # di statistiche mantiene l'ordine dello switch, non quello di OFPMatch
+    return (table_id, priority, tuple(sorted(match.items())))
+
+
+def instructions_key(objs):
+    # Forma hashable (e serializzabile in JSON) di istruzioni o azioni di
+    # ryu: nome della classe e attributi, senza `len`. Molto più economica
+    # di str(), che passa dallo stringify riflessivo di ryu
+    result = []
+    for obj in objs:
+        cls = obj.__class__
+        fields = _FIELDS.get(cls)
+        if fields is None:
+            fields = _FIELDS[cls] = tuple(sorted(k for k in vars(obj) if k != 'len'))
+        attrs = obj.__dict__
+        item = [cls.__name__]
+        for name in fields:
+            value = attrs.get(name)
+            item.append(instructions_key(value) if value.__class__ is list else value)
+        result.append(tuple(item))
+    return tuple(result)
+
+
+def flow_key(table_id, priority, match, instructions, cookie=0, timeout=(0, 0)):
+    # (chiave della regola, forma di ciò che la FlowMod installa)
+    return (rule_key(table_id, priority, match),
+            (instructions_key(instructions), cookie, timeout[0], timeout[1]))
+
+
+def mod_key(mod):
+    return flow_key(mod.table_id, mod.priority, mod.match, mod.instructions, mod.cookie,
+                    (mod.idle_timeout, mod.hard_timeout))
+
+
+def _covers(match_items, rule_items):
+    # Semantica non-strict: la regola ricade nel match se ne contiene tutti i campi
+    rule_fields = dict(rule_items)
+    return all(rule_fields.get(k) == v for k, v in match_items)
+
+
+class CachedRule(object):
+    __slots__ = ('spec', 'expires', 'future')
+
+    def __init__(self, spec, expires, future):
+        self.spec = spec          # (istruzioni, cookie, idle, hard) come in flow_key
+        self.expires = expires
+        self.future = future
+
+    @property
+    def cookie(self):
+        return self.spec[1]
+
+
+class FlowCache(object):
+
+    def __init__(self, logger=None, report_every=1000):
+        self.logger = logger
+        self.report_every = report_every
+        self._rules = {}   # dpid -> {key: CachedRule}
+        self.on_change = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, dpid, key):
+        # key = flow_key(...): la regola se è installata con la stessa forma.
+        # Le hit vengono contate qui, le miss da insert()
+        rules = self._rules.get(dpid)
+        if not rules:
+            return None
+        rule = rules.get(key[0])
+        if rule is None:
+            return None
+        if rule.expires is not None and time.time() >= rule.expires:
+            del rules[key[0]]
+            self.evictions += 1
+            self._changed(dpid, key[0], None)
+            return None
+        spec = key[1]
+        if rule.spec != spec:
+            # Una regola permanente copre la stessa regola con timeout
+            if rule.spec[:2] != spec[:2] or rule.spec[2] or rule.spec[3]:
+                return None
+        self.hits += 1
+        self._report()
+        return rule
+
+    def insert(self, dpid, key, future):
+        spec = key[1]
+        timeouts = [t for t in spec[2:] if t]
+        expires = time.time() + min(timeouts) if timeouts else None
+        rule = self._rules.setdefault(dpid, {})[key[0]] = CachedRule(spec, expires, future)
+        self.misses += 1
+        self._report()
+        self._changed(dpid, key[0], rule)
+
+    def restore(self, dpid, key, future):
+        # Regola già presente sullo switch (riavvio a caldo del controller)
+        timeouts = [t for t in key[1][2:] if t]
+        expires = time.time() + min(timeouts) if timeouts else None
+        rule = self._rules.setdefault(dpid, {})[key[0]] = CachedRule(key[1], expires, future)
+        self._changed(dpid, key[0], rule)
+
+    def _report(self):
+        if self.logger and (self.hits + self.misses) % self.report_every == 0:
+            self.logger.info("Flow cache: %s", self.summary())
+
+    def _changed(self, dpid, key, rule):
+        if self.on_change is not None:
+            self.on_change(dpid, key, rule)
+
+    def apply(self, dpid, mod):
+        # FlowMod diverse da ADD: aggiorna o rimuove le voci interessate
+        ofp = mod.datapath.ofproto
+        rules = self._rules.get(dpid)
+        if not rules:
+            return
+        strict = mod.command in (ofp.OFPFC_MODIFY_STRICT, ofp.OFPFC_DELETE_STRICT)
+        if strict:
+            key = rule_key(mod.table_id, mod.priority, mod.match)
+            keys = [key] if key in rules else []
+        else:
+            items = mod.match.items()
+            keys = [k for k in rules
+                    if (mod.table_id == ofp.OFPTT_ALL or k[0] == mod.table_id)
+                    and _covers(items, k[2])]
+        keys = [k for k in keys
+                if rules[k].cookie & mod.cookie_mask == mod.cookie & mod.cookie_mask]
+
+        if mod.command in (ofp.OFPFC_DELETE, ofp.OFPFC_DELETE_STRICT):
+            for key in keys:
+                del rules[key]
+                self._changed(dpid, key, None)
+            self.evictions += len(keys)
+        else:
+            inst = instructions_key(mod.instructions)
+            for key in keys:
+                rule = rules[key]
+                rule.spec = (inst,) + rule.spec[1:]
+                self._changed(dpid, key, rule)
+
+    def flow_removed(self, msg):
+        rules = self._rules.get(msg.datapath.id, {})
+        key = rule_key(msg.table_id, msg.priority, msg.match)
+        rule = rules.get(key)
+        if rule is not None and rule.cookie == msg.cookie:
+            del rules[key]
+            self.evictions += 1
+            self._changed(msg.datapath.id, key, None)
+
+    def discard(self, dpid, key, future):
+        # Regola rifiutata dallo switch: esce dalla cache se la voce è ancora
+        # quella della FlowMod (future)
+        rules = self._rules.get(dpid)
+        rule = rules.get(key) if rules else None
+        if rule is not None and rule.future is future:
+            del rules[key]
+            self.evictions += 1
+            self._changed(dpid, key, None)
+
+    def forget(self, dpid):
+        self._rules.pop(dpid, None)
+
+    def size(self, dpid=None):
+        if dpid is not None:
+            return len(self._rules.get(dpid, {}))
+        return sum(len(r) for r in self._rules.values())
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        ratio = 100.0 * self.hits / lookups if lookups else 0.0
+        return ("%d hit, %d miss (%.1f%% FlowMod risparmiate), %d evict, %d regole"
+                % (self.hits, self.misses, ratio, self.evictions, self.size()))
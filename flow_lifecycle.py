@@ -0,0 +1,66 @@
+import collections
+import time
+
+# Ciclo di vita delle regole installate dai PacketIn, condiviso dai
+# controller, che assegnano a ogni classe di regola (video, default, drop)
+# i propri timeout. Le FlowRemoved vengono contate per motivo e i loro
+# contatori finali (byte, pacchetti) per classe; le table stats danno
+# l'occupazione delle tabelle nel tempo, riassunta nel log ogni
+# `report_every` secondi (attuale, media e massimo sull'ultima finestra).
+
+VIDEO   = 'video'
+DEFAULT = 'default'
+DROP    = 'drop'
+
+
+class FlowLifecycle(object):
+
+    def __init__(self, logger=None, report_every=60, history=720):
+        self.logger = logger
+        self.report_every = report_every
+        self.history = history
+        self.removed = {}         # motivo -> regole rimosse
+        self.removed_bytes = {}   # classe -> byte contati dalle regole rimosse
+        self.removed_packets = {}
+        self.occupancy = {}       # dpid -> deque di (istante, regole attive)
+        self.peak = {}            # dpid -> massimo osservato
+        self._last_report = time.time()
+
+    def flow_removed(self, msg, kind):
+        # Motivo della rimozione come nome breve (idle, hard, delete, ...)
+        ofp = msg.datapath.ofproto
+        reason = {ofp.OFPRR_IDLE_TIMEOUT: 'idle', ofp.OFPRR_HARD_TIMEOUT: 'hard',
+                  ofp.OFPRR_DELETE: 'delete'}.get(msg.reason, 'other')
+        self.removed[reason] = self.removed.get(reason, 0) + 1
+        self.removed_bytes[kind] = self.removed_bytes.get(kind, 0) + msg.byte_count
+        self.removed_packets[kind] = self.removed_packets.get(kind, 0) + msg.packet_count
+        return reason
+
+    def table_stats(self, dpid, body, now=None):
+        now = time.time() if now is None else now
+        active = sum(stat.active_count for stat in body)
+        samples = self.occupancy.get(dpid)
+        if samples is None:
+            samples = self.occupancy[dpid] = collections.deque(maxlen=self.history)
+        samples.append((now, active))
+        self.peak[dpid] = max(self.peak.get(dpid, 0), active)
+        if self.logger and now - self._last_report >= self.report_every:
+            self._last_report = now
+            self.logger.info("Tabelle: %s; rimosse %s", self.summary(), self.removed or '-')
+
+    def report(self):
+        # dpid -> {now, mean, max, samples} sulla finestra conservata
+        result = {}
+        for dpid, samples in sorted(self.occupancy.items()):
+            counts = [n for _, n in samples]
+            result[dpid] = {'now': counts[-1], 'mean': float(sum(counts)) / len(counts),
+                            'max': self.peak.get(dpid, 0), 'samples': list(samples)}
+        return result
+
+    def summary(self):
+        return ', '.join('DPID=%s %d (media %.1f, max %d)' % (d, r['now'], r['mean'], r['max'])
+                         for d, r in self.report().items())
+
+    def forget(self, dpid):
+        self.occupancy.pop(dpid, None)
+        self.peak.pop(dpid, None)
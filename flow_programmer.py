@@ -0,0 +1,274 @@
+import time
+from collections import deque
+
+from ryu.lib import hub
+
+from flow_cache import FlowCache, mod_key
+
+# Pipeline di programmazione delle regole condivisa dai controller: le FlowMod
+# vengono accodate per datapath e inviate a batch. Ogni FlowMod restituisce un
+# InstallFuture completato alla ricezione della BarrierReply, così le
+# PacketOut possono essere inviate solo quando la regola è attiva. La
+# OFPBarrierRequest parte solo se serve: quando qualcuno attende un future
+# del batch (anche dopo l'invio) o dopo una delete, che deve precedere le
+# regole successive. flush() a fine gruppo invia subito in questi casi o a
+# batch pieno; altrimenti le FlowMod partono insieme dopo `flush_interval`
+# secondi. Le FlowMod identiche a regole già installate o in installazione
+# vengono soppresse dalla FlowCache. Una FlowMod rifiutata dallo switch
+# (OFPErrorMsg con il suo xid) fa fallire il future (error) ed esce dalla
+# cache, così viene ritentata; le PacketOut che la attendono non partono.
+
+
+class InstallFuture(object):
+
+    def __init__(self, dpid, on_wait=None):
+        self.dpid = dpid
+        self.latency = None
+        self.error = None         # OFPErrorMsg se lo switch ha rifiutato la FlowMod
+        self.waited = False
+        self._on_wait = on_wait   # chiamata alla prima attesa
+        self._event = hub.Event()
+        self._callbacks = []
+
+    def done(self):
+        return self._event.is_set()
+
+    def add_done_callback(self, fn):
+        if self.done():
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+            self._waiting()
+
+    def wait(self, timeout=None):
+        if not self.done():
+            self._waiting()
+        return self._event.wait(timeout)
+
+    def _waiting(self):
+        if not self.waited:
+            self.waited = True
+            if self._on_wait is not None:
+                self._on_wait(self)
+
+    def _set_failed(self, error):
+        self.error = error
+        self._set_done(None)
+
+    def _set_done(self, latency):
+        self.latency = latency
+        self._event.set()
+        callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
+class FlowProgrammer(object):
+
+    def __init__(self, logger, batch_size=64, latency_samples=100, flush_interval=0.01):
+        self.logger = logger
+        self.batch_size = batch_size
+        self.latency_samples = latency_samples
+        self.flush_interval = flush_interval
+
+        self.cache = FlowCache(logger)
+        self._queue = {}      # dpid -> [(mod, future, chiave)] non ancora inviati
+        self._urgent = set()  # dpid con una coda da inviare subito con barrier
+        self._sent = {}       # dpid -> (datapath, [(mod, future, chiave)] inviati senza barrier)
+        self._timers = {}     # dpid -> invio differito
+        self._barriers = {}   # (dpid, xid) -> (istante di invio, batch)
+        self._xids = {}       # (dpid, xid) -> (future, chiave nella cache) non confermati
+        self.latency = {}     # dpid -> ultime latenze di installazione (s)
+
+        self.sent = 0
+        self.batches = 0
+        self.packet_outs = 0
+        self.errors = 0
+
+    def cached(self, dp, key):
+        # Future della regola key (flow_key) già installata o in
+        # installazione, senza costruire la FlowMod; None se va inviata
+        rule = self.cache.lookup(dp.id, key)
+        return rule.future if rule is not None else None
+
+    def add(self, dp, mod, key=None):
+        # key: flow_key della FlowMod, se il chiamante l'ha già calcolata
+        if mod.command == dp.ofproto.OFPFC_ADD:
+            if key is None:
+                key = mod_key(mod)
+            rule = self.cache.lookup(dp.id, key)
+            if rule is not None:
+                # Stessa regola già installata o in installazione: nessuna nuova FlowMod
+                if mod.buffer_id != dp.ofproto.OFP_NO_BUFFER:
+                    self.when_done(rule.future, lambda: self._release_buffer(dp, mod))
+                return rule.future
+            fut = InstallFuture(dp.id, self._waited)
+            self.cache.insert(dp.id, key, fut)
+        else:
+            key = None
+            fut = InstallFuture(dp.id, self._waited)
+            self.cache.apply(dp.id, mod)
+            if mod.command in (dp.ofproto.OFPFC_DELETE, dp.ofproto.OFPFC_DELETE_STRICT):
+                self._urgent.add(dp.id)
+
+        queue = self._queue.setdefault(dp.id, [])
+        queue.append((mod, fut, key))
+        if len(queue) >= self.batch_size:
+            self._send(dp)
+        return fut
+
+    def packet_out(self, dp, out, after=None):
+        # La PacketOut segue le regole: parte solo quando tutti i future di
+        # `after` (uno o una lista, es. regola di ingresso e regole a valle
+        # del percorso su altri switch) sono completati
+        self.when_done(after, lambda: self._send_packet_out(dp, out))
+
+    def when_done(self, after, fn):
+        # fn() subito se i future di `after` sono completati, altrimenti
+        # alla conferma dell'ultimo; mai se una delle FlowMod è stata rifiutata
+        if isinstance(after, InstallFuture):
+            after = (after,)
+        futures = [f for f in after or () if f is not None]
+        pending = [f for f in futures if not f.done()]
+        if not pending:
+            if all(f.error is None for f in futures):
+                fn()
+            return
+        left = [len(pending)]
+
+        def ready(fut):
+            left[0] -= 1
+            if not left[0] and all(f.error is None for f in futures):
+                fn()
+        for fut in pending:
+            fut.add_done_callback(ready)
+
+    def _send_packet_out(self, dp, out):
+        dp.send_msg(out)
+        self.packet_outs += 1
+
+    def flush(self, dp, now=False):
+        # Fine di un gruppo di FlowMod: subito se qualcuno le attende, dopo
+        # una delete o con now, altrimenti insieme alle successive
+        if dp.id not in self._queue:
+            return
+        if now or dp.id in self._urgent:
+            self._send(dp)
+        elif dp.id not in self._timers:
+            self._timers[dp.id] = hub.spawn_after(self.flush_interval, self._timer_flush, dp)
+
+    def _timer_flush(self, dp):
+        self._timers.pop(dp.id, None)
+        self._send(dp)
+
+    def _send(self, dp):
+        batch = self._queue.pop(dp.id, None)
+        if batch:
+            for mod, fut, key in batch:
+                dp.send_msg(mod)
+                self._xids[(dp.id, mod.xid)] = (fut, key)
+            self.sent += len(batch)
+            sent = self._sent.setdefault(dp.id, (dp, []))[1]
+            sent.extend(batch)
+            # Una barrier ogni batch_size FlowMod anche senza attese: le
+            # FlowMod da confermare restano limitate
+            if len(sent) >= self.batch_size:
+                self._urgent.add(dp.id)
+        if dp.id in self._urgent:
+            self._urgent.discard(dp.id)
+            self._barrier(dp.id)
+
+    def _waited(self, fut):
+        # Un future atteso: barrier per la sua FlowMod, subito se è già
+        # stata inviata o se il suo gruppo è già stato chiuso da flush()
+        # (invio differito in attesa), altrimenti al prossimo flush
+        if fut.dpid in self._sent and any(f is fut for _, f, _ in self._sent[fut.dpid][1]):
+            self._barrier(fut.dpid)
+            return
+        self._urgent.add(fut.dpid)
+        queue = self._queue.get(fut.dpid)
+        if not queue:
+            return
+        dp = queue[0][0].datapath
+        timer = self._timers.pop(fut.dpid, None)
+        if timer is not None:
+            hub.kill(timer)
+            self._send(dp)
+        else:
+            # Nel caso non segua un flush
+            self._timers[fut.dpid] = hub.spawn_after(self.flush_interval, self._timer_flush, dp)
+
+    def _barrier(self, dpid):
+        # Chiude con una barrier le FlowMod inviate e non ancora confermate
+        entry = self._sent.pop(dpid, None)
+        if entry is None:
+            return
+        dp, batch = entry
+        barrier = dp.ofproto_parser.OFPBarrierRequest(dp)
+        dp.send_msg(barrier)
+        self._barriers[(dpid, barrier.xid)] = (time.time(), batch)
+        self.batches += 1
+
+    def barrier_reply(self, msg):
+        dpid = msg.datapath.id
+        entry = self._barriers.pop((dpid, msg.xid), None)
+        if entry is None:
+            return
+        sent_at, batch = entry
+        latency = time.time() - sent_at
+        self.latency.setdefault(dpid, deque(maxlen=self.latency_samples)).append(latency)
+        self.logger.debug("DPID=%s: batch di %d FlowMod installato in %.2f ms",
+                          dpid, len(batch), latency * 1000)
+        for mod, fut, key in batch:
+            self._xids.pop((dpid, mod.xid), None)
+            if not fut.done():
+                fut._set_done(latency)
+
+    def error(self, msg):
+        # OFPErrorMsg: True se riguarda una FlowMod inviata da qui
+        dpid = msg.datapath.id
+        entry = self._xids.pop((dpid, msg.xid), None)
+        if entry is None:
+            return False
+        fut, key = entry
+        self.errors += 1
+        self.logger.warning("DPID=%s: FlowMod rifiutata (type=%s code=%s)",
+                            dpid, msg.type, msg.code)
+        if key is not None:
+            self.cache.discard(dpid, key[0], fut)
+        if not fut.done():
+            fut._set_failed(msg)
+        return True
+
+    def forget(self, dpid):
+        # Switch disconnesso: le installazioni in corso non verranno confermate
+        self._queue.pop(dpid, None)
+        self._urgent.discard(dpid)
+        self._sent.pop(dpid, None)
+        timer = self._timers.pop(dpid, None)
+        if timer is not None:
+            hub.kill(timer)
+        self.cache.forget(dpid)
+        for key in [k for k in self._barriers if k[0] == dpid]:
+            del self._barriers[key]
+        for key in [k for k in self._xids if k[0] == dpid]:
+            del self._xids[key]
+
+    def latency_stats(self, dpid):
+        # (campioni, media, massimo) in secondi
+        samples = self.latency.get(dpid)
+        if not samples:
+            return 0, 0.0, 0.0
+        return len(samples), sum(samples) / len(samples), max(samples)
+
+    def _release_buffer(self, dp, mod):
+        # PacketIn duplicato con buffer sullo switch: lo rilascia con le
+        # azioni della regola ora attiva
+        parser, ofp = dp.ofproto_parser, dp.ofproto
+        actions = []
+        for inst in mod.instructions:
+            actions.extend(getattr(inst, 'actions', []))
+        out = parser.OFPPacketOut(datapath=dp, buffer_id=mod.buffer_id,
+                                  in_port=mod.match.get('in_port', ofp.OFPP_CONTROLLER),
+                                  actions=actions)
+        self._send_packet_out(dp, out)
@@ -0,0 +1,34 @@
+# Top-k approssimato con l'algoritmo Space-Saving (Metwally et al.): al più
+# `capacity` contatori; una chiave nuova a tabella piena prende il posto del
+# contatore minimo e ne eredita il valore, che diventa il suo errore massimo.
+# count - error è quindi un limite inferiore garantito del peso della chiave.
+
+
+class SpaceSaving(object):
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._counters = {}   # chiave -> [peso stimato, errore, dati]
+
+    def update(self, key, weight=1, data=None):
+        entry = self._counters.get(key)
+        if entry is None:
+            floor = 0
+            if len(self._counters) >= self.capacity:
+                victim = min(self._counters, key=lambda k: self._counters[k][0])
+                floor = self._counters.pop(victim)[0]
+            entry = self._counters[key] = [floor, floor, data]
+        entry[0] += weight
+        if data is not None:
+            entry[2] = data
+
+    def top(self, n):
+        # [(chiave, peso stimato, errore, dati)] in ordine di peso decrescente
+        items = sorted(self._counters.items(), key=lambda kv: kv[1][0], reverse=True)
+        return [(key, count, error, data) for key, (count, error, data) in items[:n]]
+
+    def clear(self):
+        self._counters.clear()
+
+    def __len__(self):
+        return len(self._counters)
@@ -0,0 +1,114 @@
+import time
+from collections import OrderedDict
+
+# Tabella MAC -> porta per tutti gli switch, limitata e con invecchiamento.
+# Le voci (dpid, mac) sono tenute in ordine LRU: in testa c'è la voce vista
+# meno di recente, che è la prima a scadere (max_age) o a essere rimossa
+# quando la tabella è piena (max_entries). Rivedere un MAC sulla stessa porta
+# aggiorna la voce al più una volta ogni refresh secondi, così i PacketIn
+# ripetuti non riscrivono la tabella; una porta diversa è uno spostamento.
+# on_change(dpid, mac, porta o None) segue voci nuove, spostate, scadute e
+# rimosse (non forget/clear, usati per disconnessioni e reload).
+
+
+class MacTable(object):
+
+    def __init__(self, max_entries=4096, max_age=300.0, refresh=1.0):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.refresh = refresh
+        self._entries = OrderedDict()   # (dpid, mac) -> (porta, ultimo avvistamento)
+        self.on_change = None
+
+        self.moves = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def learn(self, dpid, mac, port, now=None):
+        # Restituisce la porta precedente se il MAC si è spostato, altrimenti None
+        now = time.time() if now is None else now
+        key = (dpid, mac)
+        entry = self._entries.get(key)
+        if entry is not None:
+            old_port, seen = entry
+            if old_port == port:
+                if now - seen >= self.refresh:
+                    self._entries[key] = (port, now)
+                    self._entries.move_to_end(key)
+                return None
+            self.moves += 1
+            self._entries[key] = (port, now)
+            self._entries.move_to_end(key)
+            self._changed(key, port)
+            return old_port
+
+        self._expire(now)
+        if len(self._entries) >= self.max_entries:
+            old, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            self._changed(old, None)
+        self._entries[key] = (port, now)
+        self._changed(key, port)
+        return None
+
+    def _changed(self, key, port):
+        if self.on_change is not None:
+            self.on_change(key[0], key[1], port)
+
+    def get(self, dpid, mac, now=None):
+        entry = self._entries.get((dpid, mac))
+        if entry is None:
+            return None
+        now = time.time() if now is None else now
+        if now - entry[1] >= self.max_age:
+            del self._entries[(dpid, mac)]
+            self.expirations += 1
+            self._changed((dpid, mac), None)
+            return None
+        return entry[0]
+
+    def _expire(self, now):
+        entries = self._entries
+        while entries:
+            key, (_, seen) = next(iter(entries.items()))
+            if now - seen < self.max_age:
+                break
+            del entries[key]
+            self.expirations += 1
+            self._changed(key, None)
+
+    def remove(self, mac, dpid=None):
+        # Rimuove il MAC da uno switch o da tutti; restituisce i dpid interessati
+        if dpid is not None:
+            keys = [(dpid, mac)] if (dpid, mac) in self._entries else []
+        else:
+            keys = [k for k in self._entries if k[1] == mac]
+        for key in keys:
+            del self._entries[key]
+            self._changed(key, None)
+        return [k[0] for k in keys]
+
+    def entries(self, dpid, now=None):
+        # [(mac, porta)] non scaduti di uno switch
+        now = time.time() if now is None else now
+        return [(key[1], port) for key, (port, seen) in self._entries.items()
+                if key[0] == dpid and now - seen < self.max_age]
+
+    def forget(self, dpid):
+        for key in [k for k in self._entries if k[0] == dpid]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def size(self, dpid=None):
+        if dpid is None:
+            return len(self._entries)
+        return sum(1 for k in self._entries if k[0] == dpid)
+
+    def summary(self):
+        return ("%d MAC, %d spostamenti, %d evict, %d scaduti"
+                % (len(self._entries), self.moves, self.evictions, self.expirations))
@@ -0,0 +1,221 @@
+import time
+
+from ryu.lib import hub
+
+# Metriche dei controller esposte in formato testo Prometheus su un endpoint
+# HTTP locale (GET /metrics): PacketIn per dpid, istogramma della latenza
+# dell'handler, FlowMod/PacketOut inviate, regole per switch (table stats),
+# utilizzo dei collegamenti di backbone per slice (port stats) e lo stato di
+# cache, tabella MAC, proxy ARP, meter, regole rimosse e PacketIn limitati.
+# I valori dei componenti condivisi vengono letti al momento dello scrape,
+# senza costi sul percorso dei PacketIn.
+
+LATENCY_BUCKETS = (50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3, 0.1)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, v) for k, v in sorted(labels.items()))
+
+
+class ControllerMetrics(object):
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.packet_in = {}        # dpid -> PacketIn ricevuti
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+        self.flow_entries = {}     # dpid -> regole attive (table stats)
+        self.link_mbps = {}        # (dpid, slice, direzione) -> Mbit/s
+        self._port_bytes = {}      # (dpid, porta) -> (istante, rx_bytes, tx_bytes)
+        self._values = []          # (nome, tipo, help, campioni) letti allo scrape
+        self._server = None
+
+    def observe_packet_in(self, dpid, seconds):
+        self.packet_in[dpid] = self.packet_in.get(dpid, 0) + 1
+        self.latency_sum += seconds
+        self.latency_count += 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.latency_buckets[i] += 1
+                break
+
+    def table_stats(self, dpid, body):
+        self.flow_entries[dpid] = sum(stat.active_count for stat in body)
+
+    def port_stats(self, dpid, body, slice_ports, now=None):
+        # slice_ports: porta di backbone -> slice, per questo switch
+        now = time.time() if now is None else now
+        for stat in body:
+            name = slice_ports.get(stat.port_no)
+            if name is None:
+                continue
+            key = (dpid, stat.port_no)
+            last = self._port_bytes.get(key)
+            self._port_bytes[key] = (now, stat.rx_bytes, stat.tx_bytes)
+            if last is None or now <= last[0]:
+                continue
+            elapsed = now - last[0]
+            for direction, new, old in (('rx', stat.rx_bytes, last[1]), ('tx', stat.tx_bytes, last[2])):
+                delta = new - old if new >= old else new
+                self.link_mbps[(dpid, name, direction)] = delta * 8.0 / 1e6 / elapsed
+
+    def forget(self, dpid):
+        self.flow_entries.pop(dpid, None)
+        for key in [k for k in self._port_bytes if k[0] == dpid]:
+            del self._port_bytes[key]
+        for key in [k for k in self.link_mbps if k[0] == dpid]:
+            del self.link_mbps[key]
+
+    def add_value(self, name, kind, help, fn):
+        # fn() restituisce il valore corrente
+        self._values.append((name, kind, help, lambda: [(None, fn())]))
+
+    def add_family(self, name, kind, help, fn):
+        # fn() restituisce [(etichette, valore)]
+        self._values.append((name, kind, help, fn))
+
+    def track(self, app):
+        # Componenti condivisi dai controller, se presenti
+        flows = getattr(app, 'flows', None)
+        if flows is not None:
+            self.add_value('slicing_flow_mods_sent_total', 'counter',
+                           'FlowMod inviate agli switch', lambda: flows.sent)
+            self.add_value('slicing_packet_outs_sent_total', 'counter',
+                           'PacketOut inviate agli switch', lambda: flows.packet_outs)
+            self.add_value('slicing_barrier_batches_total', 'counter',
+                           'Batch di FlowMod chiusi da una barrier', lambda: flows.batches)
+            self.add_value('slicing_flow_mods_rejected_total', 'counter',
+                           'FlowMod rifiutate dagli switch', lambda: flows.errors)
+            self.add_value('slicing_flow_cache_hits_total', 'counter',
+                           'FlowMod soppresse dalla cache', lambda: flows.cache.hits)
+            self.add_value('slicing_flow_cache_rules', 'gauge',
+                           'Regole installate note alla cache', lambda: flows.cache.size())
+        macs = getattr(app, 'mac_table', None)
+        if macs is not None:
+            self.add_value('slicing_mac_table_entries', 'gauge', 'Voci della tabella MAC',
+                           lambda: len(macs))
+            self.add_value('slicing_mac_table_evictions_total', 'counter',
+                           'Voci rimosse per tabella piena', lambda: macs.evictions)
+            self.add_value('slicing_mac_table_moves_total', 'counter',
+                           'Cambi di porta dei MAC', lambda: macs.moves)
+        arp = getattr(app, 'arp', None)
+        if arp is not None:
+            self.add_value('slicing_arp_proxy_replies_total', 'counter',
+                           'Richieste ARP risolte dal controller', lambda: arp.replies)
+        lifecycle = getattr(app, 'lifecycle', None)
+        if lifecycle is not None:
+            self.add_family('slicing_flow_removed_total', 'counter',
+                            'FlowRemoved ricevute per motivo',
+                            lambda: [({'reason': r}, n) for r, n in sorted(lifecycle.removed.items())])
+            self.add_family('slicing_flow_removed_bytes_total', 'counter',
+                            'Byte contati dalle regole rimosse per classe',
+                            lambda: [({'class': k}, n)
+                                     for k, n in sorted(lifecycle.removed_bytes.items())])
+            self.add_family('slicing_flow_entries_max', 'gauge',
+                            'Massimo di regole attive per switch (table stats)',
+                            lambda: [({'dpid': d}, n) for d, n in sorted(lifecycle.peak.items())])
+        guard = getattr(app, 'guard', None)
+        if guard is not None:
+            self.add_value('slicing_packet_in_limited_total', 'counter',
+                           'PacketIn scartati dal limite per sorgente', lambda: guard.limited)
+        workers = getattr(app, 'workers', None)
+        if workers is not None:
+            self.add_family('slicing_packet_in_worker_processed_total', 'counter',
+                            'PacketIn elaborati per worker',
+                            lambda: [({'worker': i}, n) for i, n in enumerate(workers.processed)])
+            self.add_value('slicing_packet_in_queued', 'gauge', 'PacketIn in attesa nei worker',
+                           workers.pending)
+            self.add_value('slicing_packet_in_queue_dropped_total', 'counter',
+                           'PacketIn scartati a coda piena', lambda: workers.dropped)
+        rate = getattr(app, 'video_rate', None)
+        if rate is not None:
+            self.add_family('slicing_video_mbps', 'gauge', 'Rate video: ultimo campione e stima',
+                            lambda: [({'estimate': 'raw'}, '%.3f' % rate.raw),
+                                     ({'estimate': 'smoothed'}, '%.3f' % rate.rate)])
+        interval = getattr(app, 'monitor_interval', None)
+        if interval is not None:
+            self.add_value('slicing_monitor_interval_seconds', 'gauge',
+                           'Intervallo di campionamento del monitor', lambda: interval.interval)
+        decisions = getattr(app, 'decisions', None)
+        if decisions is not None:
+            self.add_value('slicing_sharing_transitions_total', 'counter',
+                           'Transizioni della condivisione della upper slice',
+                           lambda: decisions.count)
+            self.add_value('slicing_sharing_flaps_total', 'counter',
+                           'Transizioni che annullano la precedente', lambda: decisions.flaps)
+            self.add_value('slicing_sharing_reaction_seconds', 'gauge',
+                           'Tempo di reazione dell\'ultima transizione',
+                           lambda: decisions.last_reaction or 0.0)
+        meters = getattr(app, 'meters', None)
+        if meters is not None:
+            self.add_family('slicing_meter_rate_kbps', 'gauge', 'Banda dei meter per classe',
+                            lambda: [({'class': n}, rate)
+                                     for n, (_, rate, _) in sorted(meters.config.items())])
+            self.add_family('slicing_meter_bytes_total', 'counter',
+                            'Byte entrati nei meter per classe',
+                            lambda: [({'class': n}, v) for n, v in sorted(meters.in_bytes.items())])
+            self.add_family('slicing_meter_dropped_bytes_total', 'counter',
+                            'Byte scartati dai meter per classe',
+                            lambda: [({'class': n}, v)
+                                     for n, v in sorted(meters.drop_bytes.items())])
+
+    def render(self):
+        out = []
+
+        def family(name, kind, help, samples):
+            out.append('# HELP %s %s' % (name, help))
+            out.append('# TYPE %s %s' % (name, kind))
+            for labels, value in samples:
+                out.append('%s%s %s' % (name, _labels(labels), value))
+
+        family('slicing_packet_in_total', 'counter', 'PacketIn ricevuti',
+               [({'dpid': d}, n) for d, n in sorted(self.packet_in.items())])
+
+        samples, cumulative = [], 0
+        for bound, n in zip(LATENCY_BUCKETS, self.latency_buckets):
+            cumulative += n
+            samples.append(({'le': repr(bound)}, cumulative))
+        samples.append(({'le': '+Inf'}, self.latency_count))
+        out.append('# HELP slicing_packet_in_seconds Latenza dell\'handler PacketIn')
+        out.append('# TYPE slicing_packet_in_seconds histogram')
+        for labels, value in samples:
+            out.append('slicing_packet_in_seconds_bucket%s %s' % (_labels(labels), value))
+        out.append('slicing_packet_in_seconds_sum %s' % self.latency_sum)
+        out.append('slicing_packet_in_seconds_count %s' % self.latency_count)
+
+        family('slicing_flow_entries', 'gauge', 'Regole attive per switch (table stats)',
+               [({'dpid': d}, n) for d, n in sorted(self.flow_entries.items())])
+        family('slicing_link_mbps', 'gauge', 'Utilizzo dei collegamenti di backbone per slice',
+               [({'dpid': d, 'slice': s, 'direction': r}, '%.3f' % v)
+                for (d, s, r), v in sorted(self.link_mbps.items())])
+
+        for name, kind, help, fn in self._values:
+            family(name, kind, help, fn())
+        return '\n'.join(out) + '\n'
+
+    def _wsgi(self, environ, start_response):
+        if environ.get('PATH_INFO') not in ('/', '/metrics'):
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'not found\n']
+        body = self.render().encode()
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+    def serve(self, port, host='127.0.0.1'):
+        if port and self._server is None:
+            self._server = hub.spawn(self._serve, host, port)
+
+    def _serve(self, host, port):
+        try:
+            server = hub.WSGIServer((host, port), self._wsgi)
+        except OSError as e:
+            if self.logger:
+                self.logger.error("Metriche: impossibile aprire %s:%d: %s", host, port, e)
+            return
+        if self.logger:
+            self.logger.info("Metriche su http://%s:%d/metrics", host, port)
+        server.serve_forever()
@@ -0,0 +1,80 @@
+import struct
+from collections import namedtuple
+
+from ryu.lib.packet import packet, ethernet, ipv4, tcp, udp
+
+# Classificatore veloce per i PacketIn: legge solo i campi a offset fisso che
+# servono alle decisioni di slicing (MAC, ethertype, protocollo IP, porte L4)
+# direttamente dai byte di msg.data. Per i frame insoliti (VLAN, frammenti IP,
+# frame troncati) ricade sul parsing completo di ryu.
+
+PacketInfo = namedtuple('PacketInfo',
+                        ['src', 'dst', 'ethertype', 'ip_proto', 'src_port', 'dst_port'])
+
+ETH_HLEN = 14
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_VLAN = (0x8100, 0x88a8, 0x9100)
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+_ETHERTYPE = struct.Struct('!H')
+_PORTS = struct.Struct('!HH')
+_IP_FRAG_MASK = 0x3fff   # flag MF + fragment offset
+
+
+def _mac(buf):
+    return buf.hex(':')
+
+
+def classify(data):
+    view = memoryview(data)
+    if len(view) < ETH_HLEN:
+        return None
+
+    (ethertype,) = _ETHERTYPE.unpack_from(view, 12)
+    if ethertype in ETH_TYPE_VLAN:
+        return classify_full(data)
+
+    src = _mac(view[6:12])
+    dst = _mac(view[0:6])
+    if ethertype != ETH_TYPE_IP:
+        return PacketInfo(src, dst, ethertype, None, None, None)
+
+    if len(view) < ETH_HLEN + 20:
+        return classify_full(data)
+
+    ihl = (view[ETH_HLEN] & 0x0f) * 4
+    (frag,) = _ETHERTYPE.unpack_from(view, ETH_HLEN + 6)
+    if ihl < 20 or frag & _IP_FRAG_MASK:
+        return classify_full(data)
+
+    ip_proto = view[ETH_HLEN + 9]
+    if ip_proto not in (IPPROTO_TCP, IPPROTO_UDP):
+        return PacketInfo(src, dst, ethertype, ip_proto, None, None)
+
+    l4 = ETH_HLEN + ihl
+    if len(view) < l4 + 4:
+        return classify_full(data)
+    src_port, dst_port = _PORTS.unpack_from(view, l4)
+    return PacketInfo(src, dst, ethertype, ip_proto, src_port, dst_port)
+
+
+def classify_full(data):
+    try:
+        pkt = packet.Packet(data)
+    except Exception:
+        return None
+    eth = pkt.get_protocol(ethernet.ethernet)
+    if not eth:
+        return None
+
+    ip_pkt = pkt.get_protocol(ipv4.ipv4)
+    if not ip_pkt:
+        return PacketInfo(eth.src, eth.dst, eth.ethertype, None, None, None)
+
+    l4 = pkt.get_protocol(udp.udp) or pkt.get_protocol(tcp.tcp)
+    if not l4:
+        return PacketInfo(eth.src, eth.dst, eth.ethertype, ip_pkt.proto, None, None)
+    return PacketInfo(eth.src, eth.dst, eth.ethertype, ip_pkt.proto,
+                      l4.src_port, l4.dst_port)
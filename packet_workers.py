@@ -0,0 +1,98 @@
+import concurrent.futures
+
+from eventlet import tpool
+from eventlet.queue import Full
+from ryu.lib import hub
+
+# Decodifica dei PacketIn fuori dal hub, condivisa dai controller; opzionale
+# (WORKERS = 0 nei controller) e senza guadagno di throughput: serve solo a
+# tenere libero il hub durante raffiche di frame, al prezzo di una latenza
+# maggiore (coda, lotti, in PROCESSES serializzazione). I worker
+# sono greenlet dello stesso hub di Ryu: solo la decodifica dei frame esce
+# dal hub, le decisioni restano seriali. Ogni datapath ha la coda di un
+# worker (dpid modulo il numero di worker), quindi i PacketIn di uno switch
+# restano in ordine di arrivo. Un worker prende dalla propria coda fino a
+# `batch` PacketIn e ne decodifica i frame in un solo passo:
+#  - THREADS: in un thread nativo (eventlet.tpool); con il GIL non aumenta
+#    il throughput, ma il hub resta libero durante la decodifica
+#  - PROCESSES: in un pool di processi; conviene solo con lotti grandi (i
+#    frame e i risultati vengono serializzati)
+# Poi il worker chiama l'handler per ogni PacketIn del lotto, nel hub, come
+# l'elaborazione seriale: tabella MAC, cache delle regole e FlowMod non sono
+# mai usate da due worker insieme. Una coda piena scarta i PacketIn successivi;
+# i PacketIn di un datapath non più attivo (alive) e i frame che la
+# decodifica non riconosce vengono scartati senza chiamare l'handler.
+
+THREADS   = 'thread'
+PROCESSES = 'process'
+
+
+def _parse_all(parse, frames):
+    return [parse(data) for data in frames]
+
+
+class PacketInWorkers(object):
+
+    def __init__(self, n, handler, parse, mode=THREADS, batch=64, queue_size=4096,
+                 alive=None, logger=None):
+        self.n = n
+        self.handler = handler     # handler(ev, info)
+        self.parse = parse         # funzione pura sui byte del frame
+        self.alive = alive         # alive(datapath): False dopo la disconnessione
+        self.mode = mode
+        self.batch = batch
+        self.logger = logger
+        self.queues = [hub.Queue(queue_size) for _ in range(n)]
+        self.processed = [0] * n
+        self.dropped = 0
+        self._pool = None
+        if mode == PROCESSES:
+            self._pool = concurrent.futures.ProcessPoolExecutor(n)
+        self._threads = [hub.spawn(self._run, i) for i in range(n)]
+
+    def shard(self, dpid):
+        return dpid % self.n
+
+    def submit(self, ev):
+        try:
+            self.queues[self.shard(ev.msg.datapath.id)].put_nowait(ev)
+        except Full:
+            self.dropped += 1
+            if self.logger and self.dropped % 1000 == 1:
+                self.logger.warning("Coda dei PacketIn piena: %d scartati", self.dropped)
+
+    def pending(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def _parse_batch(self, frames):
+        if self._pool is not None:
+            return tpool.execute(lambda: self._pool.submit(_parse_all, self.parse, frames).result())
+        return tpool.execute(_parse_all, self.parse, frames)
+
+    def _run(self, worker):
+        queue = self.queues[worker]
+        while True:
+            batch = [queue.get()]
+            while len(batch) < self.batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                infos = self._parse_batch([ev.msg.data for ev in batch])
+            except Exception:
+                if self.logger:
+                    self.logger.exception("Decodifica dei PacketIn fallita")
+                infos = [None] * len(batch)
+            for ev, info in zip(batch, infos):
+                if info is None or (self.alive is not None and not self.alive(ev.msg.datapath)):
+                    continue
+                try:
+                    self.handler(ev, info)
+                except Exception:
+                    if self.logger:
+                        self.logger.exception("PacketIn non elaborato")
+            self.processed[worker] += len(batch)
+
+    def stop(self):
+        for thread in self._threads:
+            hub.kill(thread)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
@@ -0,0 +1,216 @@
+import heapq
+import time
+
+# Calcolo dei percorsi sulla topologia dichiarata nella policy, condiviso dai
+# controller service e dynamic. Il grafo ha per ogni collegamento banda e
+# ritardo (quelli della slice del backbone, come in topology.py); ogni slice
+# usa solo gli switch del proprio percorso. Due criteri:
+#  - WIDEST: massimizza la banda del collo di bottiglia (video)
+#  - LEAST_LOADED: come WIDEST, ma sulla banda residua misurata dalle port
+#    stats (bulk)
+# A parità di banda vince il ritardo totale minore. I percorsi sono calcolati
+# alla prima richiesta e restano in cache; il cambio di stato di un
+# collegamento (OFPPortStatus) invalida solo i percorsi interessati e
+# restituisce i percorsi installati che lo attraversavano.
+
+WIDEST       = 'widest'
+LEAST_LOADED = 'least_loaded'
+
+
+class PathEngine(object):
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.links = {}       # dpid -> {vicino: porta}
+        self.port_peer = {}   # (dpid, porta) -> vicino
+        self.bw = {}          # (a, b) -> Mbit/s
+        self.delay = {}       # (a, b) -> ms
+        self.nodes = {}       # slice -> switch consentiti
+        self.down = set()     # collegamenti (a, b) non attivi
+        self.load = {}        # (a, b) -> Mbit/s in uscita da a verso b
+        self._paths = {}      # (slice, criterio, da, a) -> percorso o None
+        self._routes = {}     # chiave del chiamante -> percorso installato
+        self._pending = {}    # chiave -> future delle regole della rotta non confermate
+        self._tx_bytes = {}   # (dpid, porta) -> (istante, tx_bytes)
+
+    def configure(self, pol):
+        self.links = {dpid: dict(nbrs) for dpid, nbrs in pol.links.items()}
+        self.port_peer = {(dpid, port): nbr for dpid, nbrs in self.links.items()
+                          for nbr, port in nbrs.items()}
+        self.bw = dict(pol.link_bw)
+        self.delay = dict(pol.link_delay)
+        self.nodes = {name: frozenset(path) for name, path in pol.slice_paths.items()}
+        self.down.clear()
+        self.load.clear()
+        self._paths.clear()
+        self._routes.clear()
+        self._pending.clear()
+        self._tx_bytes.clear()
+
+    def path(self, slice_name, src, dst, kind=WIDEST):
+        # Lista di DPID da src a dst (access switch) dentro la slice
+        key = (slice_name, kind, src, dst)
+        if key not in self._paths:
+            self._paths[key] = self._widest(slice_name, src, dst, kind == LEAST_LOADED)
+        return self._paths[key]
+
+    def path_via(self, slice_name, src, port, dst, kind=WIDEST):
+        # Percorso che lascia src dalla porta data (la porta della slice
+        # sull'access switch), poi scelto dal criterio
+        hop = self.port_peer.get((src, port))
+        if hop is None or (src, hop) in self.down:
+            return None
+        if hop == dst:
+            return [src, dst]
+        tail = self.path(slice_name, hop, dst, kind)
+        if not tail or src in tail:
+            return None
+        return [src] + tail
+
+    def _capacity(self, a, b, residual):
+        bw = self.bw.get((a, b), 0.0)
+        if residual:
+            bw = max(bw - self.load.get((a, b), 0.0), 0.0)
+        return bw
+
+    def _widest(self, slice_name, src, dst, residual):
+        nodes = self.nodes.get(slice_name) or frozenset(self.links)
+        if src not in nodes or dst not in nodes:
+            return None
+        # Dijkstra sul collo di bottiglia (massimo) e poi sul ritardo (minimo)
+        best = {src: (float('inf'), 0.0)}
+        prev = {src: None}
+        heap = [(-float('inf'), 0.0, src)]
+        done = set()
+        while heap:
+            neg_width, delay, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            if node == dst:
+                break
+            for nbr in sorted(self.links.get(node, {})):
+                if nbr not in nodes or nbr in done or (node, nbr) in self.down:
+                    continue
+                width = min(-neg_width, self._capacity(node, nbr, residual))
+                total = delay + self.delay.get((node, nbr), 0.0)
+                old = best.get(nbr)
+                if old is None or width > old[0] or (width == old[0] and total < old[1]):
+                    best[nbr] = (width, total)
+                    prev[nbr] = node
+                    heapq.heappush(heap, (-width, total, nbr))
+        if dst not in done:
+            return None
+        path = [dst]
+        while prev[path[-1]] is not None:
+            path.append(prev[path[-1]])
+        return path[::-1]
+
+    def hops(self, path, in_port, out_port):
+        # [(dpid, porta di ingresso, porta di uscita)] lungo il percorso
+        result = []
+        for i, dpid in enumerate(path):
+            port_in = in_port if i == 0 else self.links[dpid][path[i - 1]]
+            port_out = out_port if i == len(path) - 1 else self.links[dpid][path[i + 1]]
+            result.append((dpid, port_in, port_out))
+        return result
+
+    def record(self, key, path):
+        # False se la rotta è già installata su questo percorso
+        path = tuple(path)
+        if self._routes.get(key) == path:
+            return False
+        self._routes[key] = path
+        self._pending.pop(key, None)
+        return True
+
+    def installing(self, key, futures):
+        # Future delle regole appena inviate per la rotta
+        futures = [f for f in futures if f is not None and not f.done()]
+        if futures:
+            self._pending[key] = futures
+
+    def pending(self, key):
+        # Future non ancora completati delle regole di una rotta già
+        # registrata (un secondo pacchetto prima delle BarrierReply)
+        futures = self._pending.get(key)
+        if not futures:
+            return []
+        futures = [f for f in futures if not f.done()]
+        if futures and key in self._routes:
+            self._pending[key] = futures
+        else:
+            del self._pending[key]
+        return futures
+
+    def pairs(self, kind):
+        # Coppie (src, dst) con una rotta installata con il criterio kind
+        return {k[:2] for k in self._routes if k[3] == kind}
+
+    def removed(self, dpid, src, dst):
+        # Regola di una rotta scaduta su dpid: la rotta va reinstallata
+        for key in [k for k, p in self._routes.items() if k[:2] == (src, dst) and dpid in p]:
+            del self._routes[key]
+
+    def port_status(self, dpid, port_no, up):
+        # Restituisce [(chiave, percorso)] delle rotte installate sul
+        # collegamento appena caduto; [] se nulla cambia
+        nbr = self.port_peer.get((dpid, port_no))
+        if nbr is None:
+            return []
+        link, reverse = (dpid, nbr), (nbr, dpid)
+        if up:
+            if link not in self.down:
+                return []
+            self.down.discard(link)
+            self.down.discard(reverse)
+            # Un collegamento in più può migliorare qualunque percorso
+            self._paths.clear()
+            if self.logger:
+                self.logger.info("Collegamento %s-%s attivo", dpid, nbr)
+            return []
+        if link in self.down:
+            return []
+        self.down.add(link)
+        self.down.add(reverse)
+        for key in [k for k, p in self._paths.items() if p and self._uses(p, link)]:
+            del self._paths[key]
+        broken = [(k, p) for k, p in self._routes.items() if self._uses(p, link)]
+        for key, _ in broken:
+            del self._routes[key]
+        if self.logger:
+            self.logger.info("Collegamento %s-%s non attivo: %d percorsi da ricalcolare",
+                             dpid, nbr, len(broken))
+        return broken
+
+    @staticmethod
+    def _uses(path, link):
+        a, b = link
+        return any((x, y) in ((a, b), (b, a)) for x, y in zip(path, path[1:]))
+
+    def port_stats(self, dpid, body, now=None):
+        # Carico dei collegamenti in uscita da dpid; i percorsi LEAST_LOADED
+        # vengono ricalcolati alla richiesta successiva
+        now = time.time() if now is None else now
+        for stat in body:
+            nbr = self.port_peer.get((dpid, stat.port_no))
+            if nbr is None:
+                continue
+            key = (dpid, stat.port_no)
+            last = self._tx_bytes.get(key)
+            self._tx_bytes[key] = (now, stat.tx_bytes)
+            if last is None or now <= last[0]:
+                continue
+            delta = stat.tx_bytes - last[1] if stat.tx_bytes >= last[1] else stat.tx_bytes
+            self.load[(dpid, nbr)] = delta * 8.0 / 1e6 / (now - last[0])
+        for key in [k for k in self._paths if k[1] == LEAST_LOADED]:
+            del self._paths[key]
+
+    def forget(self, dpid):
+        for key in [k for k in self._tx_bytes if k[0] == dpid]:
+            del self._tx_bytes[key]
+        # Lo switch ripartirà senza le regole dei percorsi
+        for key in [k for k, p in self._routes.items() if dpid in p]:
+            del self._routes[key]
+        for key in [k for k in self._pending if k not in self._routes]:
+            del self._pending[key]
@@ -0,0 +1,131 @@
+import collections
+import json
+import time
+
+# Stima del rate per le decisioni della slicing dinamica, in tre parti:
+#  - RateEstimator: Mbit/s da campioni (byte, secondi) di durata variabile;
+#    EWMA con emivita distinta in salita (reazione ai burst) e in discesa
+#    (niente rientri su un calo momentaneo), media su finestra scorrevole
+#    (WINDOW) o solo l'ultimo campione (RAW, come il monitor originale)
+#  - AdaptiveInterval: intervallo di campionamento minimo vicino alla soglia
+#    che lo stato attuale confronta o dopo un salto del rate (entrambi in
+#    frazione dell'isteresi fra le due soglie), raddoppiato a ogni campione
+#    stabile fino al massimo, così a regime le richieste di statistiche sono poche
+#  - DecisionTrace: campioni e transizioni recenti, con il tempo di reazione
+#    (dall'inizio del primo campione oltre la soglia alla transizione) e i flap
+#    (transizioni che annullano la precedente entro `flap_window` secondi)
+
+EWMA   = 'ewma'
+WINDOW = 'window'
+RAW    = 'raw'
+
+
+class RateEstimator(object):
+
+    def __init__(self, mode=EWMA, half_life_up=0.5, half_life_down=3.0, window=5.0):
+        self.mode = mode
+        self.half_life_up = half_life_up
+        self.half_life_down = half_life_down
+        self.window = window
+        self.raw = 0.0       # ultimo campione, Mbit/s
+        self.rate = 0.0      # stima
+        self._started = False
+        self._samples = collections.deque()   # (istante, byte, secondi)
+
+    def update(self, nbytes, elapsed, now=None):
+        if elapsed <= 0:
+            return self.rate
+        now = time.time() if now is None else now
+        self.raw = nbytes * 8.0 / 1e6 / elapsed
+        if self.mode == WINDOW:
+            self._samples.append((now, nbytes, elapsed))
+            while len(self._samples) > 1 and self._samples[0][0] <= now - self.window:
+                self._samples.popleft()
+            total = sum(s[2] for s in self._samples)
+            self.rate = sum(s[1] for s in self._samples) * 8.0 / 1e6 / total
+        elif self.mode == EWMA and self._started:
+            # Peso del campione in base alla sua durata: con intervalli
+            # variabili la costante di tempo resta la stessa
+            half = self.half_life_up if self.raw > self.rate else self.half_life_down
+            alpha = 1.0 - 0.5 ** (elapsed / half) if half > 0 else 1.0
+            self.rate += alpha * (self.raw - self.rate)
+        else:
+            self.rate = self.raw
+        self._started = True
+        return self.rate
+
+
+class AdaptiveInterval(object):
+
+    def __init__(self, minimum=0.25, maximum=1.0, margin=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.margin = margin      # frazione dell'isteresi
+        self.interval = minimum
+
+    def next(self, rate, raw, threshold, gap):
+        # threshold: la soglia che farebbe cambiare lo stato attuale;
+        # gap: distanza fra le due soglie dell'isteresi
+        band = self.margin * gap
+        if abs(rate - threshold) <= band or abs(raw - rate) > band:
+            self.interval = self.minimum
+        else:
+            self.interval = min(self.interval * 2, self.maximum)
+        return self.interval
+
+
+class DecisionTrace(object):
+
+    def __init__(self, size=3600, flap_window=30.0):
+        self.flap_window = flap_window
+        self.samples = collections.deque(maxlen=size)       # (istante, grezzo, stima, stato)
+        self.transitions = collections.deque(maxlen=size)   # (istante, stato, stima, reazione)
+        self.count = 0
+        self.flaps = 0
+        self.last_reaction = None
+        self.crossed_since = None   # inizio dei campioni oltre la soglia dello stato attuale
+        self.crossed_samples = 0
+        self._last = None           # istante dell'ultima transizione
+
+    def sample(self, now, elapsed, raw, rate, state, crossed):
+        # `crossed`: il campione grezzo (gli ultimi `elapsed` secondi) supera
+        # la soglia che farebbe cambiare lo stato attuale
+        self.samples.append((now, raw, rate, state))
+        if not crossed:
+            self.crossed_since = None
+            self.crossed_samples = 0
+            return
+        if self.crossed_since is None:
+            self.crossed_since = now - elapsed
+        self.crossed_samples += 1
+
+    def crossed_for(self, now):
+        # Da quanti secondi il rate misurato resta oltre la soglia; almeno
+        # due campioni, perché uno solo, se lungo, può mediare un picco breve
+        if self.crossed_samples < 2:
+            return 0.0
+        return now - self.crossed_since
+
+    def transition(self, now, state, rate):
+        reaction = now - self.crossed_since if self.crossed_since is not None else 0.0
+        if self._last is not None and now - self._last < self.flap_window:
+            self.flaps += 1
+        self.transitions.append((now, state, rate, reaction))
+        self.count += 1
+        self.last_reaction = reaction
+        self.crossed_since = None
+        self.crossed_samples = 0
+        self._last = now
+        return reaction
+
+    def summary(self):
+        reactions = [t[3] for t in self.transitions]
+        return {'samples': len(self.samples), 'transitions': self.count, 'flaps': self.flaps,
+                'reaction_mean': sum(reactions) / len(reactions) if reactions else None,
+                'reaction_max': max(reactions) if reactions else None}
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(),
+                       'samples': list(self.samples),
+                       'transitions': list(self.transitions)}, f, indent=1)
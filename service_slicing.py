@@ -1,154 +1,590 @@
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, set_ev_cls
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
+from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet, ethernet, ipv4, udp
+from ryu.lib.packet import ether_types
+from ryu.lib import hub
+import time
+
+from arp_proxy import ArpProxy
+from control_plane import ControlPlaneGuard
+from flow_cache import flow_key
+from flow_lifecycle import FlowLifecycle, DEFAULT, VIDEO
+from flow_programmer import FlowProgrammer
+from mac_table import MacTable
+from metrics import ControllerMetrics
+from packet_classifier import classify
+from packet_workers import PacketInWorkers, THREADS
+from path_engine import PathEngine, WIDEST, LEAST_LOADED
+from slice_meters import SliceMeters
+from slice_policy import SlicePolicy, L4_FIELDS
+from state_snapshot import WarmRestart, state_path
 
 
 class SliceEnforcingController(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
-    # Porte verso backbone
-    PORT_S2 = 3  # Porta verso S2
-    PORT_S3 = 4  # Porta verso S3
-
-    # Host collegati a S1 e S4
-    HOST_PORTS = {
-        1: [1,2],   # S1: h1, h2
-        4: [1,2],   # S4: h3, h4
-    }
+    # Host, porte di backbone delle slice (S2 upper, S3 lower) e servizi
+    # (UDP 9999 -> upper) vengono da slice_policy.json
 
     PRIORITY_DEFAULT = 10
     PRIORITY_VIDEO   = 20
 
+    # Timeout (idle, hard) in secondi delle regole installate dai PacketIn,
+    # per classe (0 = nessuno): le tabelle restano limitate e una regola
+    # superata scade da sola. Regole di base e pipeline non scadono.
+    TIMEOUT_VIDEO   = (30, 0)
+    TIMEOUT_DEFAULT = (60, 600)
+
+    # Pipeline multi-tabella (opzionale):
+    #  - tabella 0: classificazione del servizio, scrive lo slice ID nei metadata
+    #  - tabella 1: inoltro L2 su eth_dst, una regola per host
+    #  - tabella 2 (access switch): uscita verso il backbone della slice
+    # Le regole crescono come host + servizi e un nuovo host costa una sola
+    # FlowMod per switch.
+    PIPELINE = False
+
+    TABLE_CLASSIFY = 0
+    TABLE_L2       = 1
+    TABLE_SLICE    = 2
+
+    METADATA_MASK = 0xff
+
+    HOSTS = 0   # dpid fittizio delle voci host nella MacTable della pipeline
+
+    # Meter OpenFlow 1.3 sugli access switch (sezione "meters" della policy):
+    # il traffico dagli host verso il backbone passa dal meter del proprio
+    # servizio o, in mancanza, della propria slice. Con la pipeline i meter
+    # sono per slice (tabella 2). Spento per switch senza supporto ai meter.
+    METERS = True
+
+    # Percorsi end-to-end (path_engine.py): verso un host dichiarato su un
+    # altro access switch le regole vengono installate su tutto il percorso
+    # della slice al primo pacchetto (widest path per i servizi, il meno
+    # carico per il resto), senza PacketIn né flood sul backbone. Un
+    # collegamento che cade (OFPPortStatus) toglie le regole dei percorsi
+    # che lo usavano. Non usato con la pipeline.
+    PATHS = True
+
+    # Canale di controllo (control_plane.py): al più PACKET_IN_RATE PacketIn/s
+    # (burst PACKET_IN_BURST) per MAC sorgente, gli altri scartati dal
+    # controller (0 = nessun limite); regole verso il controller limitate
+    # sullo switch dal meter CONTROL_METER_ID a CONTROL_METER_PPS
+    # pacchetti/s (0 = spento). MISS_SEND_LEN va allo switch con OFPSetConfig
+    # ed è il max_len delle azioni verso il controller: valori minori di
+    # OFPCML_NO_BUFFER richiedono uno switch che bufferizza i pacchetti.
+    PACKET_IN_RATE    = 100
+    PACKET_IN_BURST   = 200
+    CONTROL_METER_ID  = 0xffff
+    CONTROL_METER_PPS = 1000
+    CONTROL_METER_BURST = 200
+    MISS_SEND_LEN     = ofproto_v1_3.OFPCML_NO_BUFFER
+
+    # Decodifica dei frame dei PacketIn fuori dal hub (packet_workers.py), a
+    # lotti in un thread nativo (THREADS) o in processi (PROCESSES), con una
+    # coda per gruppo di datapath in ognuno dei WORKERS worker: i PacketIn di
+    # uno switch restano in ordine. Le decisioni restano seriali nel hub:
+    # nessun guadagno di throughput, latenza maggiore. Opzionale, per tenere
+    # il hub reattivo durante raffiche di frame; 0 = tutto nell'handler.
+    WORKERS     = 0
+    WORKER_MODE = THREADS
+
+    # Tabella MAC limitata: voci scadute dopo MAC_AGING secondi senza traffico,
+    # LRU oltre MAC_TABLE_SIZE voci
+    MAC_TABLE_SIZE = 4096
+    MAC_AGING      = 300
+
+    # Metriche Prometheus su http://127.0.0.1:METRICS_PORT/metrics (0 = spento)
+    METRICS_PORT   = 9101
+    STATS_INTERVAL = 5
+
+    # Riavvio a caldo: tabella MAC e regole installate salvate in STATE_FILE
+    # e riconciliate con le flow stats all'aggancio degli switch ('' = spento)
+    STATE_FILE = state_path('service_slicing')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.mac_to_port = {}
+        self.mac_table = MacTable(self.MAC_TABLE_SIZE, self.MAC_AGING)
+        self.arp = ArpProxy(self.MAC_TABLE_SIZE, self.MAC_AGING)
+        self.datapaths = {}
+        # Pipeline: MAC -> (dpid, porta) dell'access switch, limitata e con
+        # invecchiamento come la tabella MAC
+        self.hosts = MacTable(self.MAC_TABLE_SIZE, self.MAC_AGING)
+        self.flows = FlowProgrammer(self.logger)
+        self.state = WarmRestart(self.STATE_FILE, self.mac_table, self.flows, self.logger)
+        self.meters = SliceMeters(self.logger)
+        self.paths = PathEngine(self.logger)
+        self.lifecycle = FlowLifecycle(self.logger)
+        self.guard = ControlPlaneGuard(self.logger, self.PACKET_IN_RATE, self.PACKET_IN_BURST,
+                                       self.MAC_TABLE_SIZE, self.CONTROL_METER_ID,
+                                       self.CONTROL_METER_PPS, self.CONTROL_METER_BURST,
+                                       self.MISS_SEND_LEN)
+        self.workers = None
+        if self.WORKERS:
+            self.workers = PacketInWorkers(self.WORKERS, self._handle_packet_in, classify,
+                                           self.WORKER_MODE, alive=self._datapath_alive,
+                                           logger=self.logger)
+        self.metrics = ControllerMetrics(self.logger)
+        self.metrics.track(self)
+        self.metrics.serve(self.METRICS_PORT)
+
+        self.policy = SlicePolicy(logger=self.logger)
+        self.policy.add_listener(self._policy_reloaded)
+        self.policy.watch()
+        self.meters.configure(self.policy.compiled.meters if self.METERS else {})
+        self.paths.configure(self.policy.compiled)
+
+        self._stats_thread = hub.spawn(self._stats_loop)
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         dp = ev.msg.datapath   # lo switch
+        # Switch già noto: meter e regole restano, quelle ancora presenti
+        # tornano nella cache
+        warm = self.state.is_warm(dp.id)
+        self.install_base_flows(dp, warm)
+        self.flows.flush(dp)
+        if warm:
+            self.state.request(dp)
+
+    def install_base_flows(self, dp, warm=False):
         parser = dp.ofproto_parser
         ofp = dp.ofproto
 
-        # Proactive match per traffico video
-        match_video_dst = parser.OFPMatch(
-            eth_type=0x0800,   # IPv4
-            ip_proto=17,       # UDP
-            udp_dst=9999
-        )
+        # I meter precedono le regole che li usano (quello del canale di
+        # controllo dopo la delete dei meter delle slice)
+        if self.policy.compiled.is_access(dp.id):
+            self.meters.install(dp, warm)
+        self.guard.configure(dp, warm)
 
-        match_video_src = parser.OFPMatch(
-            eth_type=0x0800,
-            ip_proto=17,
-            udp_src=9999
-        )
+        if self.PIPELINE:
+            self.install_pipeline(dp)
+            return
 
-        actions_video = [parser.OFPActionOutput(ofp.OFPP_CONTROLLER,
-                                                ofp.OFPCML_NO_BUFFER)]
+        # Regole verso il controller limitate dal meter del canale di controllo
+        actions_controller = [parser.OFPActionOutput(ofp.OFPP_CONTROLLER, self.MISS_SEND_LEN)]
+        inst_controller = self.guard.attach(parser, [
+            parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions_controller)])
 
-        self.add_flow(dp, 15, match_video_dst, actions_video)
-        self.add_flow(dp, 15, match_video_src, actions_video)
+        # Proactive match per i servizi classificati (es. video)
+        for slice_name, match in self.service_matches(parser):
+            self.add_flow(dp, 15, match, None, inst=inst_controller)
 
         # Regola di default
         match_default = parser.OFPMatch()
-        actions_default = [parser.OFPActionOutput(ofp.OFPP_CONTROLLER,
-                                                  ofp.OFPCML_NO_BUFFER)]
+        self.add_flow(dp, 0, match_default, None, inst=inst_controller)
+
+    def service_matches(self, parser):
+        # Un match per porta sorgente e uno per porta destinazione di ogni servizio
+        for ip_proto, port, slice_name in self.policy.compiled.service_matches:
+            for field in L4_FIELDS[ip_proto]:
+                match = parser.OFPMatch(eth_type=0x0800, ip_proto=ip_proto, **{field: port})
+                yield slice_name, match
+
+    def delete_flows(self, dp, match=None):
+        parser = dp.ofproto_parser
+        ofp = dp.ofproto
+        mod = parser.OFPFlowMod(datapath=dp, command=ofp.OFPFC_DELETE,
+                                table_id=ofp.OFPTT_ALL, out_port=ofp.OFPP_ANY,
+                                out_group=ofp.OFPG_ANY, match=match or parser.OFPMatch())
+        return self.flows.add(dp, mod)
+
+    def arp_reply(self, dp, in_port, data, allowed=None):
+        # Proxy ARP: risponde dall'access switch di ingresso se il target è noto
+        reply = self.arp.process(data, self.policy.compiled.host_ips, allowed)
+        if reply is None:
+            return False
+        parser, ofp = dp.ofproto_parser, dp.ofproto
+        out = parser.OFPPacketOut(datapath=dp, buffer_id=ofp.OFP_NO_BUFFER,
+                                  in_port=ofp.OFPP_CONTROLLER,
+                                  actions=[parser.OFPActionOutput(in_port)], data=reply)
+        self.flows.packet_out(dp, out)
+        return True
+
+    def host_moved(self, mac, dpid, port):
+        # Le regole verso il MAC puntano alla vecchia posizione: vengono
+        # rimosse su tutti gli switch e il MAC viene reimparato da capo
+        self.logger.info("Host %s spostato: DPID=%s porta %s", mac, dpid, port)
+        self.mac_table.remove(mac)
+        self.mac_table.learn(dpid, mac, port)
+        for other in list(self.datapaths.values()):
+            self.delete_flows(other, other.ofproto_parser.OFPMatch(eth_dst=mac))
+            self.flows.flush(other)
+
+    def _policy_reloaded(self, policy):
+        # Host, porte e servizi possono essere cambiati: si riparte dalle
+        # regole di base (la barrier separa delete e nuove regole)
+        self.mac_table.clear()
+        self.state.clear_macs()
+        self.hosts.clear()
+        self.meters.configure(policy.meters if self.METERS else {})
+        self.paths.configure(policy)
+        for dp in list(self.datapaths.values()):
+            self.delete_flows(dp)
+            self.flows.flush(dp)
+            self.install_base_flows(dp)
+            self.flows.flush(dp)
+
+    def set_meter_rate(self, name, rate_kbps, burst_kbit=None):
+        # Limite di una classe cambiato a runtime, senza toccare le regole
+        self.meters.set_rate(list(self.datapaths.values()), name, rate_kbps, burst_kbit)
+
+    def route(self, dp, in_port, src, dst, slice_name, info, is_video, after=None):
+        # Regole a valle dell'access switch di ingresso lungo il percorso
+        # della slice verso l'host dichiarato dst; restituisce la porta di
+        # uscita dall'ingresso, None se dst non è raggiungibile così. In
+        # `after` i future delle regole a valle ancora da confermare
+        pol = self.policy.compiled
+        loc = pol.host_location.get(dst)
+        port = pol.slice_port.get((dp.id, slice_name))
+        if loc is None or loc[0] == dp.id or port is None:
+            return None
+        kind = WIDEST if is_video else LEAST_LOADED
+        path = self.paths.path_via(slice_name, dp.id, port, loc[0], kind)
+        if not path:
+            return None
+        # Una rotta per coppia di host (e porta del servizio, per il video):
+        # le regole a valle sono già installate se il percorso non è cambiato
+        key = (src, dst, slice_name, kind)
+        if is_video:
+            key += tuple(p for p in (info.dst_port, info.src_port)
+                         if (info.ip_proto, p) in pol.services)
+        if not self.paths.record(key, path):
+            if after is not None:
+                after.extend(self.paths.pending(key))
+            return port
+        timeout = self.TIMEOUT_VIDEO if is_video else self.TIMEOUT_DEFAULT
+        futures = []
+        for dpid, port_in, port_out in self.paths.hops(path, in_port, loc[1])[1:]:
+            other = self.datapaths.get(dpid)
+            if other is None:
+                continue
+            parser = other.ofproto_parser
+            actions = [parser.OFPActionOutput(port_out)]
+            for priority, match in self.route_matches(parser, port_in, src, dst, info, is_video):
+                futures.append(self.add_flow(other, priority, match, actions, timeout=timeout))
+            self.flows.flush(other)
+        self.paths.installing(key, futures)
+        if after is not None:
+            after.extend(futures)
+        return port
+
+    def route_matches(self, parser, in_port, src, dst, info, is_video):
+        if not is_video:
+            yield self.PRIORITY_DEFAULT, parser.OFPMatch(in_port=in_port, eth_src=src, eth_dst=dst)
+            return
+        src_field, dst_field = L4_FIELDS[info.ip_proto]
+        for field, port in ((dst_field, info.dst_port), (src_field, info.src_port)):
+            if (info.ip_proto, port) in self.policy.compiled.services:
+                yield self.PRIORITY_VIDEO, parser.OFPMatch(
+                    in_port=in_port, eth_src=src, eth_dst=dst, eth_type=0x0800,
+                    ip_proto=info.ip_proto, **{field: port})
+
+    def install_pipeline(self, dp):
+        parser = dp.ofproto_parser
+        ofp = dp.ofproto
+        pol = self.policy.compiled
+
+        # Tabella 0: classificazione
+        for slice_name, match in self.service_matches(parser):
+            inst = self.classify_inst(parser, pol.slice_ids[slice_name])
+            self.add_flow(dp, 15, match, None, inst=inst)
+        self.add_flow(dp, 0, parser.OFPMatch(), None,
+                      inst=self.classify_inst(parser, pol.slice_ids[pol.default_slice]))
+
+        # Tabella 1: destinazioni sconosciute al controller
+        actions = [parser.OFPActionOutput(ofp.OFPP_CONTROLLER, self.MISS_SEND_LEN)]
+        inst = self.guard.attach(parser, [
+            parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)])
+        self.add_flow(dp, 0, parser.OFPMatch(), None, table_id=self.TABLE_L2, inst=inst)
 
-        self.add_flow(dp, 0, match_default, actions_default)
+        # Tabella 2: porta di backbone per slice
+        if pol.is_access(dp.id):
+            for slice_name, slice_id in pol.slice_ids.items():
+                port = pol.slice_port.get((dp.id, slice_name))
+                if port is None:
+                    continue
+                match = parser.OFPMatch(metadata=(slice_id, self.METADATA_MASK))
+                actions = [parser.OFPActionOutput(port)]
+                self.add_flow(dp, self.PRIORITY_DEFAULT, match, actions,
+                              table_id=self.TABLE_SLICE, meter=slice_name)
 
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+        for mac, loc in self.hosts.entries(self.HOSTS):
+            self.install_host(dp, mac, loc)
+
+    def classify_inst(self, parser, slice_id):
+        return [parser.OFPInstructionWriteMetadata(slice_id, self.METADATA_MASK),
+                parser.OFPInstructionGotoTable(self.TABLE_L2)]
+
+    def learn_host(self, dpid, in_port, src):
+        # Nuovo host (o host spostato): una regola in tabella 1 per ogni
+        # switch. Prima del proxy ARP, che non fa arrivare il PacketIn alla pipeline
+        if in_port not in self.policy.compiled.host_ports.get(dpid, ()):
+            return
+        loc = (dpid, in_port)
+        known = self.hosts.get(self.HOSTS, src)
+        self.hosts.learn(self.HOSTS, src, loc)
+        if known != loc:
+            for other in list(self.datapaths.values()):
+                self.install_host(other, src, loc)
+                self.flows.flush(other)
+
+    def install_host(self, dp, mac, loc):
+        parser = dp.ofproto_parser
+        pol = self.policy.compiled
+        host_dpid, host_port = loc
+        match = parser.OFPMatch(eth_dst=mac)
+
+        if dp.id == host_dpid:
+            actions = [parser.OFPActionOutput(host_port)]
+            return self.add_flow(dp, self.PRIORITY_DEFAULT, match, actions,
+                                 table_id=self.TABLE_L2)
+        if pol.is_access(dp.id):
+            # Host remoto: la porta dipende dalla slice
+            inst = [parser.OFPInstructionGotoTable(self.TABLE_SLICE)]
+            return self.add_flow(dp, self.PRIORITY_DEFAULT, match, None,
+                                 table_id=self.TABLE_L2, inst=inst)
+        # Backbone: porta verso l'access switch dell'host
+        port = pol.links.get(dp.id, {}).get(host_dpid)
+        if port is not None:
+            actions = [parser.OFPActionOutput(port)]
+            return self.add_flow(dp, self.PRIORITY_DEFAULT, match, actions,
+                                 table_id=self.TABLE_L2)
+        return None
+
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None,
+                 table_id=0, inst=None, meter=None, timeout=(0, 0)):
         parser = datapath.ofproto_parser
         ofproto = datapath.ofproto
-        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        if inst is None:
+            inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        if meter is not None:
+            inst = self.meters.attach(parser, meter, inst)
+        key = flow_key(table_id, priority, match, inst, 0, timeout)
+        if buffer_id is None or buffer_id == ofproto.OFP_NO_BUFFER:
+            # Regola già installata: niente FlowMod da costruire
+            fut = self.flows.cached(datapath, key)
+            if fut is not None:
+                return fut
         mod = parser.OFPFlowMod(
             datapath=datapath,
+            table_id=table_id,
             buffer_id=buffer_id if buffer_id is not None else ofproto.OFP_NO_BUFFER,
             priority=priority,
+            idle_timeout=timeout[0],
+            hard_timeout=timeout[1],
             match=match,
-            instructions=inst
+            instructions=inst,
+            flags=ofproto.OFPFF_SEND_FLOW_REM
         )
-        datapath.send_msg(mod)
+        return self.flows.add(datapath, mod, key)
+
+    def _stats_loop(self):
+        while True:
+            for dp in list(self.datapaths.values()):
+                self._request_stats(dp)
+            hub.sleep(self.STATS_INTERVAL)
+
+    def _request_stats(self, dp):
+        parser = dp.ofproto_parser
+        ofp = dp.ofproto
+        dp.send_msg(parser.OFPTableStatsRequest(dp, 0))
+        # Access switch per le metriche, tutti per il carico dei percorsi
+        if dp.id in self.policy.compiled.port_slice or self.PATHS:
+            dp.send_msg(parser.OFPPortStatsRequest(dp, 0, ofp.OFPP_ANY))
+        self.meters.request(dp)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def _port_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        self.metrics.port_stats(dpid, ev.msg.body, self.policy.compiled.port_slice.get(dpid, {}))
+        self.paths.port_stats(dpid, ev.msg.body)
+
+    @set_ev_cls(ofp_event.EventOFPPortStatus, MAIN_DISPATCHER)
+    def _port_status_handler(self, ev):
+        msg = ev.msg
+        ofp = msg.datapath.ofproto
+        up = (msg.reason != ofp.OFPPR_DELETE and not msg.desc.state & ofp.OFPPS_LINK_DOWN
+              and not msg.desc.config & ofp.OFPPC_PORT_DOWN)
+        # Le regole dei percorsi interrotti vengono tolte: il pacchetto
+        # successivo torna al controller dall'ingresso e prende un nuovo percorso
+        for key, path in self.paths.port_status(msg.datapath.id, msg.desc.port_no, up):
+            src, dst = key[:2]
+            for dpid in path:
+                dp = self.datapaths.get(dpid)
+                if dp is not None:
+                    self.delete_flows(dp, dp.ofproto_parser.OFPMatch(eth_src=src, eth_dst=dst))
+                    self.flows.flush(dp)
+
+    @set_ev_cls(ofp_event.EventOFPMeterStatsReply, MAIN_DISPATCHER)
+    def _meter_stats_reply_handler(self, ev):
+        self.meters.stats_reply(ev.msg.datapath.id, ev.msg.body)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev):
+        dp = ev.datapath
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[dp.id] = dp
+        elif ev.state == DEAD_DISPATCHER and dp.id is not None:
+            self.datapaths.pop(dp.id, None)
+            self.flows.forget(dp.id)
+            self.mac_table.forget(dp.id)
+            self.state.forget(dp.id)
+            self.meters.forget(dp.id)
+            self.paths.forget(dp.id)
+            self.lifecycle.forget(dp.id)
+            self.guard.forget(dp.id)
+            self.metrics.forget(dp.id)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def _barrier_reply_handler(self, ev):
+        self.flows.barrier_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def _error_msg_handler(self, ev):
+        # FlowMod rifiutata: il suo future fallisce e la regola esce dalla cache
+        msg = ev.msg
+        if not self.flows.error(msg):
+            self.logger.warning("DPID=%s: errore OpenFlow type=%s code=%s",
+                                msg.datapath.id, msg.type, msg.code)
+
+    @set_ev_cls(ofp_event.EventOFPTableStatsReply, MAIN_DISPATCHER)
+    def _table_stats_reply_handler(self, ev):
+        self.metrics.table_stats(ev.msg.datapath.id, ev.msg.body)
+        self.lifecycle.table_stats(ev.msg.datapath.id, ev.msg.body)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def _flow_stats_reply_handler(self, ev):
+        self.state.flow_stats_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def _flow_removed_handler(self, ev):
+        msg = ev.msg
+        self.flows.cache.flow_removed(msg)
+        self.lifecycle.flow_removed(msg, VIDEO if msg.priority == self.PRIORITY_VIDEO else DEFAULT)
+        # Regola di un percorso scaduta: il percorso viene reinstallato al
+        # prossimo PacketIn dall'ingresso
+        if 'eth_src' in msg.match and 'eth_dst' in msg.match:
+            self.paths.removed(msg.datapath.id, msg.match['eth_src'], msg.match['eth_dst'])
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
+        if not self.guard.allow(ev.msg.datapath.id, ev.msg.data):
+            return
+        if self.workers is not None:
+            self.workers.submit(ev)
+            return
+        self._handle_packet_in(ev)
+
+    def _datapath_alive(self, dp):
+        # PacketIn ancora in coda nei worker di uno switch disconnesso
+        return self.datapaths.get(dp.id) is dp
+
+    def _handle_packet_in(self, ev, info=None):
+        start = time.perf_counter()
+        self._process_packet_in(ev, info)
+        self.flows.flush(ev.msg.datapath)
+        self.metrics.observe_packet_in(ev.msg.datapath.id, time.perf_counter() - start)
+
+    def _process_packet_in(self, ev, info=None):
         msg = ev.msg
         dp = msg.datapath
         dpid = dp.id
         parser = dp.ofproto_parser
         ofp = dp.ofproto
         in_port = msg.match['in_port']
+        pol = self.policy.compiled
 
-        pkt = packet.Packet(msg.data)  # estrae il pacchetto
-        eth = pkt.get_protocol(ethernet.ethernet)
-        if not eth:  # ignora traffico non Ethernet
+        if info is None:
+            info = classify(msg.data)  # estrae i campi del pacchetto
+        if not info:  # ignora traffico non Ethernet
             return
 
-        src = eth.src
-        dst = eth.dst
+        src = info.src
+        dst = info.dst
 
-        # MAC learning
-        self.mac_to_port.setdefault(dpid, {})
-        self.mac_to_port[dpid][src] = in_port
+        # MAC learning: un cambio di porta da/verso una porta host è uno spostamento
+        moved = self.mac_table.learn(dpid, src, in_port)
+        if moved is not None and (pol.is_host_port(dpid, moved) or
+                                  pol.is_host_port(dpid, in_port)):
+            self.host_moved(src, dpid, in_port)
+        if self.PIPELINE:
+            self.learn_host(dpid, in_port, src)
+
+        # Proxy ARP: le richieste risolvibili non attraversano il backbone
+        if (info.ethertype == ether_types.ETH_TYPE_ARP and pol.is_host_port(dpid, in_port)
+                and self.arp_reply(dp, in_port, msg.data)):
+            return
 
-        ip_pkt = pkt.get_protocol(ipv4.ipv4)
-        udp_pkt = pkt.get_protocol(udp.udp)
+        # Slice del servizio (video: UDP porta 9999 -> upper)
+        slice_name = pol.slice_for(info.ip_proto, info.src_port, info.dst_port)
+        is_video = slice_name != pol.default_slice
 
-        # Flag se pacchetto è video (UDP porta 9999)
-        is_video = bool(ip_pkt and udp_pkt and
-                        (udp_pkt.dst_port == 9999 or udp_pkt.src_port == 9999))
+        if self.PIPELINE:
+            self._pipeline_packet_in(msg, dst, slice_name)
+            return
 
-        if dpid in (1, 4):  # Access switches
-            if dst in self.mac_to_port[dpid]:
-                out_port = self.mac_to_port[dpid][dst]
+        fut = None  # installazione da attendere prima della PacketOut
+        hops = []   # e regole a valle del percorso
+        if pol.is_access(dpid):  # Access switches
+            out_port = self.mac_table.get(dpid, dst)
+            # Host remoto dichiarato: percorso completo, anche se dst non è
+            # ancora stato imparato (niente flood)
+            if (self.PATHS and pol.is_host_port(dpid, in_port) and
+                    (out_port is None or out_port not in pol.host_ports[dpid])):
+                out_port = self.route(dp, in_port, src, dst, slice_name, info, is_video,
+                                      hops) or out_port
+            if out_port is not None:
 
                 # Se l'output port è sbagliata la cambia
-                if is_video and out_port == self.PORT_S3:
-                    out_port = self.PORT_S2
-                elif not is_video and out_port == self.PORT_S2:
-                    out_port = self.PORT_S3
+                meter = None
+                if out_port not in pol.host_ports[dpid]:
+                    out_port = pol.slice_port.get((dpid, slice_name), out_port)
+                    # Dagli host verso il backbone: meter del servizio o della slice
+                    if pol.is_host_port(dpid, in_port):
+                        meter = slice_name
 
                 actions = [parser.OFPActionOutput(out_port)]
 
                 if is_video:
-                    if udp_pkt and udp_pkt.dst_port == 9999:
+                    src_field, dst_field = L4_FIELDS[info.ip_proto]
+                    for field, port in ((dst_field, info.dst_port), (src_field, info.src_port)):
+                        if (info.ip_proto, port) not in pol.services:
+                            continue
                         match = parser.OFPMatch(
                             in_port=in_port,
                             eth_src=src,
                             eth_dst=dst,
                             eth_type=0x0800,
-                            ip_proto=17,
-                            udp_dst=9999
+                            ip_proto=info.ip_proto,
+                            **{field: port}
                         )
-                        self.add_flow(dp, self.PRIORITY_VIDEO, match, actions)
-
-                    if udp_pkt.src_port == 9999:
-                        match = parser.OFPMatch(
-                            in_port=in_port,
-                            eth_src=src,
-                            eth_dst=dst,
-                            eth_type=0x0800,
-                            ip_proto=17,
-                            udp_src=9999
-                        )
-                        self.add_flow(dp, self.PRIORITY_VIDEO, match, actions)
+                        svc_meter = None
+                        if meter is not None:
+                            svc_meter = self.meters.pick(
+                                pol.service_names.get((info.ip_proto, port)), meter)
+                        fut = self.add_flow(dp, self.PRIORITY_VIDEO, match, actions,
+                                            meter=svc_meter, timeout=self.TIMEOUT_VIDEO)
                 else:
                     match_default = parser.OFPMatch(
                         in_port=in_port,
                         eth_src=src,
                         eth_dst=dst
                     )
-                    self.add_flow(dp, self.PRIORITY_DEFAULT, match_default, actions)
+                    fut = self.add_flow(dp, self.PRIORITY_DEFAULT, match_default, actions,
+                                        meter=meter, timeout=self.TIMEOUT_DEFAULT)
 
             else:
                 # Flood verso host locali + uno tra S2/S3
-                flood_ports = list(self.HOST_PORTS[dpid])
-                flood_ports.append(self.PORT_S2 if is_video else self.PORT_S3)
+                flood_ports = list(pol.host_ports[dpid])
+                if (dpid, slice_name) in pol.slice_port:
+                    flood_ports.append(pol.slice_port[(dpid, slice_name)])
                 actions = [parser.OFPActionOutput(p) for p in flood_ports]
 
         else:  # Backbone switches (s2, s3)
-            if dst in self.mac_to_port[dpid]:
-                out_port = self.mac_to_port[dpid][dst]
+            out_port = self.mac_table.get(dpid, dst)
+            if out_port is not None:
                 actions = [parser.OFPActionOutput(out_port)]
 
                 match = parser.OFPMatch(
@@ -158,10 +594,12 @@ class SliceEnforcingController(app_manager.RyuApp):
                 )
 
                 if msg.buffer_id != ofp.OFP_NO_BUFFER:
-                    self.add_flow(dp, self.PRIORITY_DEFAULT, match, actions, msg.buffer_id)
+                    self.add_flow(dp, self.PRIORITY_DEFAULT, match, actions, msg.buffer_id,
+                                  timeout=self.TIMEOUT_DEFAULT)
                     return
                 else:
-                    self.add_flow(dp, self.PRIORITY_DEFAULT, match, actions)
+                    fut = self.add_flow(dp, self.PRIORITY_DEFAULT, match, actions,
+                                        timeout=self.TIMEOUT_DEFAULT)
             else:
                 actions = [parser.OFPActionOutput(ofp.OFPP_FLOOD)]
 
@@ -171,4 +609,35 @@ class SliceEnforcingController(app_manager.RyuApp):
             in_port=in_port, actions=actions,
             data=data
         )
-        dp.send_msg(out)
+        self.flows.packet_out(dp, out, after=[fut] + hops)
+
+    def _pipeline_packet_in(self, msg, dst, slice_name):
+        dp = msg.datapath
+        dpid = dp.id
+        parser = dp.ofproto_parser
+        ofp = dp.ofproto
+        in_port = msg.match['in_port']
+        pol = self.policy.compiled
+
+        fut = None
+        loc = self.hosts.get(self.HOSTS, dst)
+        if loc is not None:
+            # Rimanda il pacchetto nella pipeline, ora che la regola c'è
+            fut = self.install_host(dp, dst, loc)
+            actions = [parser.OFPActionOutput(ofp.OFPP_TABLE)]
+        elif pol.is_access(dpid):
+            # Flood verso host locali + backbone della slice
+            flood_ports = list(pol.host_ports[dpid])
+            if (dpid, slice_name) in pol.slice_port:
+                flood_ports.append(pol.slice_port[(dpid, slice_name)])
+            actions = [parser.OFPActionOutput(p) for p in flood_ports]
+        else:
+            actions = [parser.OFPActionOutput(ofp.OFPP_FLOOD)]
+
+        data = msg.data if msg.buffer_id == ofp.OFP_NO_BUFFER else None
+        out = parser.OFPPacketOut(
+            datapath=dp, buffer_id=msg.buffer_id,
+            in_port=in_port, actions=actions,
+            data=data
+        )
+        self.flows.packet_out(dp, out, after=fut)
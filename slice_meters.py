@@ -0,0 +1,125 @@
+# Meter OpenFlow 1.3 per slice e classe di servizio, usati dai controller
+# service e dynamic sugli access switch. La sezione "meters" della policy
+# assegna a ogni classe (nome di una slice o di un servizio) una banda in
+# kbit/s (burst in kbit) applicata da una OFPMeterBandDrop: le regole di ingresso dagli host
+# verso il backbone puntano al meter della propria classe, così i limiti non
+# dipendono dalle code configurate su OVS. set_rate cambia un limite a runtime
+# (OFPMC_MODIFY, le regole restano installate); i contatori dei meter (byte in
+# ingresso e byte scartati dalla banda) arrivano con OFPMeterStatsRequest.
+
+
+class SliceMeters(object):
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.config = {}       # classe -> (meter_id, kbit/s, burst in kbit)
+        self.in_bytes = {}     # classe -> byte entrati nel meter
+        self.drop_bytes = {}   # classe -> byte scartati dalla banda
+        self._names = {}       # meter_id -> classe
+        self._installed = set()
+        self._ids = {}         # dpid -> meter_id installati, anche di configurazioni precedenti
+        self._last = {}        # (dpid, meter_id) -> (byte in ingresso, byte scartati)
+
+    def configure(self, meters):
+        # meters: classe -> (meter_id, kbit/s, burst), da CompiledPolicy.meters
+        self.config = dict(meters)
+        self._names = {meter_id: name for name, (meter_id, _, _) in self.config.items()}
+        self._last.clear()
+
+    def meter_id(self, name):
+        entry = self.config.get(name)
+        return entry[0] if entry is not None else None
+
+    def pick(self, *names):
+        # Prima classe con un meter (es. servizio, poi la sua slice)
+        for name in names:
+            if name in self.config:
+                return name
+        return None
+
+    def attach(self, parser, name, inst):
+        # Istruzioni della regola precedute dal meter della classe, se previsto
+        meter_id = self.meter_id(name)
+        if meter_id is None:
+            return inst
+        return [parser.OFPInstructionMeter(meter_id)] + list(inst)
+
+    def meter_mod(self, dp, command, name):
+        parser, ofp = dp.ofproto_parser, dp.ofproto
+        meter_id, rate, burst = self.config[name]
+        flags = ofp.OFPMF_KBPS | ofp.OFPMF_STATS
+        if burst:
+            flags |= ofp.OFPMF_BURST
+        bands = [parser.OFPMeterBandDrop(rate=rate, burst_size=burst)]
+        return parser.OFPMeterMod(dp, command=command, flags=flags,
+                                  meter_id=meter_id, bands=bands)
+
+    def install(self, dp, warm=False):
+        # Inviati subito, prima delle FlowMod accodate che usano i meter.
+        # A freddo vengono cancellati solo i meter di questa app (quelli della
+        # policy e quelli installati prima di un reload): lo switch rimuove
+        # anche le regole che li usano, già cancellate dal controller, mentre
+        # gli altri meter restano. A caldo le regole restano: add (rifiutata
+        # se il meter esiste) seguita da modify
+        ids = {meter_id for meter_id, _, _ in self.config.values()}
+        parser, ofp = dp.ofproto_parser, dp.ofproto
+        if not warm:
+            for meter_id in sorted(ids | self._ids.get(dp.id, set())):
+                dp.send_msg(parser.OFPMeterMod(dp, command=ofp.OFPMC_DELETE, meter_id=meter_id))
+        self._ids[dp.id] = ids
+        if not self.config:
+            return
+        for key in [k for k in self._last if k[0] == dp.id]:
+            del self._last[key]
+        for name in sorted(self.config, key=lambda n: self.config[n][0]):
+            dp.send_msg(self.meter_mod(dp, ofp.OFPMC_ADD, name))
+            if warm:
+                dp.send_msg(self.meter_mod(dp, ofp.OFPMC_MODIFY, name))
+            else:
+                # Meter nuovi: i contatori partono da zero
+                self._last[(dp.id, self.config[name][0])] = (0, 0)
+        self._installed.add(dp.id)
+
+    def set_rate(self, datapaths, name, rate_kbps, burst_kbit=None):
+        # Nuovo limite per la classe su tutti gli switch con i meter installati
+        if name not in self.config:
+            raise KeyError("nessun meter per la classe %s" % name)
+        meter_id, _, burst = self.config[name]
+        self.config[name] = (meter_id, int(rate_kbps),
+                             burst if burst_kbit is None else int(burst_kbit))
+        for dp in datapaths:
+            if dp.id in self._installed:
+                dp.send_msg(self.meter_mod(dp, dp.ofproto.OFPMC_MODIFY, name))
+        if self.logger:
+            self.logger.info("Meter %s (%d): %d kbit/s", name, meter_id, int(rate_kbps))
+
+    def request(self, dp):
+        if dp.id in self._installed:
+            parser, ofp = dp.ofproto_parser, dp.ofproto
+            dp.send_msg(parser.OFPMeterStatsRequest(dp, 0, ofp.OFPM_ALL))
+
+    def stats_reply(self, dpid, body):
+        # Byte (in ingresso, scartati) per classe dall'ultima risposta dello switch
+        entered, dropped = {}, {}
+        for stat in body:
+            name = self._names.get(stat.meter_id)
+            if name is None:
+                continue
+            new = (stat.byte_in_count, sum(b.byte_band_count for b in stat.band_stats))
+            last = self._last.get((dpid, stat.meter_id))
+            self._last[(dpid, stat.meter_id)] = new
+            if last is None:
+                continue   # meter trovato già attivo: prima lettura come base
+            # Contatori ripartiti da zero (meter reinstallato)
+            d_in = new[0] - last[0] if new[0] >= last[0] else new[0]
+            d_drop = new[1] - last[1] if new[1] >= last[1] else new[1]
+            entered[name] = entered.get(name, 0) + d_in
+            dropped[name] = dropped.get(name, 0) + d_drop
+            self.in_bytes[name] = self.in_bytes.get(name, 0) + d_in
+            self.drop_bytes[name] = self.drop_bytes.get(name, 0) + d_drop
+        return entered, dropped
+
+    def forget(self, dpid):
+        self._installed.discard(dpid)
+        for key in [k for k in self._last if k[0] == dpid]:
+            del self._last[key]
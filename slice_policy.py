@@ -0,0 +1,257 @@
+import json
+import os
+from types import MappingProxyType
+
+from ryu.lib import hub
+
+try:
+    import yaml
+except ImportError:  # YAML opzionale, JSON sempre disponibile
+    yaml = None
+
+# Policy di slicing dichiarativa condivisa dai tre controller. Il file
+# (JSON o YAML) descrive slice, membri, classificatori di servizio, host,
+# collegamenti, percorso, banda e ritardo di ogni slice e i meter (banda per
+# slice o servizio); viene compilato in tabelle di lookup immutabili
+# indicizzate per MAC e DPID, così ogni decisione per pacchetto costa al più
+# una lookup in un dizionario. Il reload sostituisce le tabelle
+# compilate con un solo assegnamento, senza riavviare ryu-manager.
+
+DEFAULT_POLICY_FILE = os.environ.get(
+    'SLICE_POLICY', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'slice_policy.json'))
+
+IP_PROTOS = {'tcp': 6, 'udp': 17}
+L4_FIELDS = {
+    6:  ('tcp_src', 'tcp_dst'),
+    17: ('udp_src', 'udp_dst'),
+}
+
+# Banda (Mbit/s) e ritardo (ms) dei collegamenti senza valori di slice
+DEFAULT_BW    = 10.0
+DEFAULT_DELAY = 1.0
+
+
+def read_spec(path):
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ValueError("PyYAML non installato, impossibile leggere %s" % path)
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def _delay_ms(value):
+    # '25ms' come in topology.py, oppure un numero di millisecondi
+    if isinstance(value, str) and value.endswith('ms'):
+        value = value[:-2]
+    return float(value)
+
+
+def _ports(spec):
+    # Porte singole o intervalli [min, max]
+    for item in spec:
+        if isinstance(item, (list, tuple)):
+            lo, hi = item
+            for port in range(int(lo), int(hi) + 1):
+                yield port
+        else:
+            yield int(item)
+
+
+class CompiledPolicy(object):
+
+    def __init__(self, spec):
+        slices = spec['slices']
+        self.default_slice = spec.get('default_slice')
+        if self.default_slice is not None and self.default_slice not in slices:
+            raise ValueError("default_slice sconosciuta: %s" % self.default_slice)
+
+        links = {}
+        for dpid, neighbors in spec.get('links', {}).items():
+            links[int(dpid)] = MappingProxyType(
+                {int(n): int(port) for n, port in neighbors.items()})
+        self.links = MappingProxyType(links)
+
+        host_location = {}
+        host_ports = {}
+        host_ips = {}
+        for mac, entry in spec.get('hosts', {}).items():
+            # [dpid, porta] oppure [dpid, porta, ip]
+            dpid, port = int(entry[0]), int(entry[1])
+            host_location[mac.lower()] = (dpid, port)
+            host_ports.setdefault(dpid, set()).add(port)
+            if len(entry) > 2:
+                host_ips[entry[2]] = mac.lower()
+        self.host_location = MappingProxyType(host_location)
+        self.host_ips = MappingProxyType(host_ips)
+        self.host_ports = MappingProxyType(
+            {dpid: tuple(sorted(ports)) for dpid, ports in host_ports.items()})
+
+        slice_of = {}
+        allowed_at = set()
+        slice_port = {}
+        slice_paths = {}
+        for name, sl in slices.items():
+            path = tuple(int(d) for d in sl.get('path', ()))
+            slice_paths[name] = path
+            for mac in sl.get('members', ()):
+                mac = mac.lower()
+                if mac in slice_of:
+                    raise ValueError("%s appartiene a più slice" % mac)
+                slice_of[mac] = name
+                for dpid in path:
+                    allowed_at.add((mac, dpid))
+            # Porta di backbone della slice sugli access switch del percorso:
+            # il collegamento verso il primo switch di backbone della slice
+            backbone = [d for d in path if d not in self.host_ports]
+            for dpid in path:
+                if dpid not in self.host_ports:
+                    continue
+                for hop in backbone:
+                    if hop in links.get(dpid, {}):
+                        slice_port[(dpid, name)] = links[dpid][hop]
+                        break
+        self.slice_paths = MappingProxyType(slice_paths)
+
+        # Banda e ritardo dei collegamenti fra switch: quelli della slice a
+        # cui appartiene lo switch di backbone dell'estremo (come topology.py)
+        backbone_slice = {}
+        for name, path in slice_paths.items():
+            for dpid in path:
+                if dpid not in self.host_ports:
+                    backbone_slice[dpid] = slices[name]
+        link_bw = {}
+        link_delay = {}
+        for a, neighbors in links.items():
+            for b in neighbors:
+                sl = backbone_slice.get(a) or backbone_slice.get(b) or {}
+                link_bw[(a, b)] = float(sl.get('bw', DEFAULT_BW))
+                link_delay[(a, b)] = _delay_ms(sl.get('delay', DEFAULT_DELAY))
+        self.link_bw = MappingProxyType(link_bw)
+        self.link_delay = MappingProxyType(link_delay)
+        self.slice_ids = MappingProxyType({name: i + 1 for i, name in enumerate(slices)})
+        self.slice_of = MappingProxyType(slice_of)
+        self.allowed_at = frozenset(allowed_at)
+        self.slice_port = MappingProxyType(slice_port)
+        port_slice = {}
+        for (dpid, name), port in slice_port.items():
+            port_slice.setdefault(dpid, {})[port] = name
+        self.port_slice = MappingProxyType(
+            {dpid: MappingProxyType(ports) for dpid, ports in port_slice.items()})
+        self.allowed_pairs = frozenset(
+            (a, b) for a, sa in slice_of.items() for b, sb in slice_of.items()
+            if a != b and sa == sb)
+
+        services = {}
+        service_names = {}
+        service_matches = []
+        for svc in spec.get('services', ()):
+            if svc['slice'] not in slices:
+                raise ValueError("slice sconosciuta per %s: %s" % (svc.get('name'), svc['slice']))
+            proto = IP_PROTOS[svc['proto']] if svc['proto'] in IP_PROTOS else int(svc['proto'])
+            for port in _ports(svc['ports']):
+                services[(proto, port)] = svc['slice']
+                if 'name' in svc:
+                    service_names[(proto, port)] = svc['name']
+                service_matches.append((proto, port, svc['slice']))
+        self.services = MappingProxyType(services)
+        self.service_names = MappingProxyType(service_names)
+        self.service_matches = tuple(service_matches)
+
+        # Meter per classe (slice o servizio): ID assegnati in ordine di file
+        meters = {}
+        classes = set(slices) | set(service_names.values())
+        for i, (name, m) in enumerate(spec.get('meters', {}).items()):
+            if name not in classes:
+                raise ValueError("meter per una classe sconosciuta: %s" % name)
+            meters[name] = (i + 1, int(m['rate_kbps']), int(m.get('burst_kbit', 0)))
+        self.meters = MappingProxyType(meters)
+
+    def require_slices(self, names):
+        # Slice usate per nome da un controller: devono esistere e avere la
+        # porta di backbone su ogni access switch
+        for name in names:
+            if name not in self.slice_paths:
+                raise ValueError("slice %s assente dalla policy" % name)
+            missing = sorted(d for d in self.host_ports if (d, name) not in self.slice_port)
+            if missing:
+                raise ValueError("slice %s senza porta di backbone sugli switch %s"
+                                 % (name, missing))
+
+    def violates(self, mac, dpid):
+        # Solo gli host appartenenti a una slice possono violarla
+        return mac in self.slice_of and (mac, dpid) not in self.allowed_at
+
+    def slice_for(self, ip_proto, src_port, dst_port):
+        # Slice del servizio (porta destinazione prima della sorgente)
+        if ip_proto is None:
+            return self.default_slice
+        services = self.services
+        return (services.get((ip_proto, dst_port)) or
+                services.get((ip_proto, src_port)) or
+                self.default_slice)
+
+    def is_access(self, dpid):
+        return dpid in self.host_ports
+
+    def is_host_port(self, dpid, port):
+        return port in self.host_ports.get(dpid, ())
+
+
+def load_policy(path=DEFAULT_POLICY_FILE, required_slices=()):
+    compiled = CompiledPolicy(read_spec(path))
+    compiled.require_slices(required_slices)
+    return compiled
+
+
+class SlicePolicy(object):
+
+    def __init__(self, path=DEFAULT_POLICY_FILE, logger=None, required_slices=()):
+        # required_slices: slice che il controller usa per nome
+        self.path = path
+        self.logger = logger
+        self.required_slices = tuple(required_slices)
+        self.compiled = load_policy(path, self.required_slices)
+        self._mtime = os.stat(path).st_mtime
+        self._listeners = []
+        self._watcher = None
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def reload(self):
+        try:
+            compiled = load_policy(self.path, self.required_slices)
+        except Exception as e:   # anche yaml.YAMLError o una spec non dict
+            if self.logger:
+                self.logger.error("Policy %s non valida, mantengo la precedente: %s",
+                                  self.path, e)
+            return False
+
+        self.compiled = compiled   # swap atomico delle tabelle compilate
+        if self.logger:
+            self.logger.info("Policy %s ricaricata", self.path)
+        for fn in self._listeners:
+            fn(compiled)
+        return True
+
+    def watch(self, interval=2.0):
+        if self._watcher is None:
+            self._watcher = hub.spawn(self._watch, interval)
+
+    def _watch(self, interval):
+        while True:
+            hub.sleep(interval)
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                continue
+            if mtime != self._mtime:
+                self._mtime = mtime
+                # Un errore non deve fermare il watcher
+                try:
+                    self.reload()
+                except Exception:
+                    if self.logger:
+                        self.logger.exception("Ricaricamento della policy %s fallito",
+                                              self.path)
@@ -0,0 +1,262 @@
+import json
+import os
+
+from ryu.lib import hub
+
+from flow_cache import flow_key
+from flow_programmer import InstallFuture
+
+# Snapshot su disco dello stato dei controller, per riavviare ryu-manager a
+# caldo senza una tempesta di PacketIn e flood mentre tutto viene reimparato.
+# Lo stato è diviso in sezioni {chiave: valore JSON}; ogni modifica viene
+# scritta in coda a un journal (una riga JSON per modifica, a blocchi ogni
+# `interval` secondi) e il journal viene compattato nello snapshot quando
+# supera `compact_every` righe. In lettura: snapshot + replay del journal.
+# Lo snapshot è attivo solo con SLICING_STATE_DIR: una directory comune come
+# /tmp farebbe riprendere lo stato di altre istanze o di vecchie prove.
+
+STATE_DIR = os.path.expanduser(os.environ.get('SLICING_STATE_DIR', ''))
+
+
+def state_path(name):
+    # '' (snapshot spento) senza SLICING_STATE_DIR; la directory viene
+    # creata da StateSnapshot.start(), non all'import
+    if not STATE_DIR:
+        return ''
+    return os.path.join(STATE_DIR, '%s.state.json' % name)
+
+
+class StateSnapshot(object):
+
+    def __init__(self, path, logger=None, interval=1.0, compact_every=5000):
+        self.path = path
+        self.journal = path + '.journal'
+        self.logger = logger
+        self.interval = interval
+        self.compact_every = compact_every
+        self.data = {}            # sezione -> {chiave: valore}
+        self._pending = []        # modifiche non ancora scritte
+        self._journal_lines = 0
+        self._writer = None
+
+    def load(self):
+        if not self.path:
+            return self.data
+        data = {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            if self.logger:
+                self.logger.error("Snapshot %s illeggibile, ignorato: %s", self.path, e)
+        lines = 0
+        try:
+            with open(self.journal) as f:
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        break   # ultima riga troncata da un arresto brusco
+                    self._apply(data, op)
+                    lines += 1
+        except OSError:
+            pass
+        self.data = data
+        self._journal_lines = lines
+        return data
+
+    @staticmethod
+    def _apply(data, op):
+        if op[0] == 'set':
+            data.setdefault(op[1], {})[op[2]] = op[3]
+        elif op[0] == 'del':
+            data.get(op[1], {}).pop(op[2], None)
+        elif op[0] == 'clear':
+            data.pop(op[1], None)
+
+    def section(self, name):
+        return self.data.get(name, {})
+
+    def set(self, section, key, value):
+        if self.data.get(section, {}).get(key) != value:
+            self._record(['set', section, key, value])
+
+    def delete(self, section, key):
+        if key in self.data.get(section, {}):
+            self._record(['del', section, key])
+
+    def clear(self, section):
+        if section in self.data:
+            self._record(['clear', section])
+
+    def _record(self, op):
+        self._apply(self.data, op)
+        self._pending.append(op)
+
+    def start(self):
+        if self.path and self._writer is None:
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', mode=0o700, exist_ok=True)
+            except OSError as e:
+                if self.logger:
+                    self.logger.error("Snapshot %s non scrivibile: %s", self.path, e)
+            self._writer = hub.spawn(self._write_loop)
+
+    def _write_loop(self):
+        while True:
+            hub.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        try:
+            if self._journal_lines + len(pending) > self.compact_every:
+                self.compact()
+                return
+            with open(self.journal, 'a') as f:
+                f.write(''.join(json.dumps(op, separators=(',', ':')) + '\n' for op in pending))
+            self._journal_lines += len(pending)
+        except OSError as e:
+            if self.logger:
+                self.logger.error("Snapshot %s non scritto: %s", self.path, e)
+
+    def compact(self):
+        # Snapshot completo sostituito atomicamente, poi journal vuoto; un
+        # arresto fra i due passi rilegge modifiche già incluse (idempotenti)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f, separators=(',', ':'))
+        os.replace(tmp, self.path)
+        open(self.journal, 'w').close()
+        self._journal_lines = 0
+
+
+def _thaw(value):
+    # Liste lette dal JSON di nuovo tuple, come in flow_key()
+    if isinstance(value, (list, tuple)):
+        return tuple(_thaw(v) for v in value)
+    return value
+
+
+class WarmRestart(object):
+    # Stato comune dei controller nello snapshot: tabella MAC (sezione "mac")
+    # e inventario delle regole installate (sezione "rules", per switch).
+    # All'aggancio di uno switch già noto le sue regole vengono lette con
+    # OFPFlowStats e quelle ancora presenti tornano nella cache come
+    # installate, senza nuove FlowMod; le altre escono dall'inventario. La
+    # disconnessione di uno switch non cancella il suo stato salvato.
+    # Con path vuoto lo snapshot è spento e ogni switch parte a freddo.
+
+    def __init__(self, path, mac_table, flows, logger=None):
+        self.mac_table = mac_table
+        self.flows = flows
+        self.logger = logger
+        self.store = StateSnapshot(path, logger)
+        self.store.load()
+        self._reconciling = {}   # dpid -> (xid, statistiche ricevute)
+        if not path:
+            return
+
+        # Voci di regola senza la forma di flow_key() (istruzioni, cookie,
+        # idle, hard): formato precedente, non confrontabile con lo switch.
+        # Le chiavi salvate con i campi del match non ordinati vengono
+        # riscritte come le calcola ora rule_key()
+        for skey, spec in list(self.store.section('rules').items()):
+            if not isinstance(spec, list) or len(spec) != 4:
+                self.store.delete('rules', skey)
+                continue
+            dpid, key = skey.split(' ', 1)
+            key = json.loads(key)
+            if key[2] != sorted(key[2]):
+                self.store.delete('rules', skey)
+                key[2].sort()
+                self.store.set('rules', '%s %s' % (dpid, json.dumps(key, separators=(',', ':'))),
+                               spec)
+
+        restored = 0
+        for key, port in self.store.section('mac').items():
+            dpid, mac = key.split(' ', 1)
+            mac_table.learn(int(dpid), mac, port)
+            restored += 1
+        if logger and (restored or self.store.section('rules')):
+            logger.info("Snapshot %s: %d MAC, %d regole", path, restored,
+                        len(self.store.section('rules')))
+        mac_table.on_change = self._mac_changed
+        flows.cache.on_change = self._rule_changed
+        self.store.start()
+
+    def _mac_changed(self, dpid, mac, port):
+        key = '%d %s' % (dpid, mac)
+        if port is None:
+            self.store.delete('mac', key)
+        else:
+            self.store.set('mac', key, port)
+
+    def _rule_changed(self, dpid, key, rule):
+        skey = '%d %s' % (dpid, json.dumps(key, separators=(',', ':')))
+        if rule is None:
+            self.store.delete('rules', skey)
+        else:
+            self.store.set('rules', skey, rule.spec)
+
+    def clear_macs(self):
+        self.store.clear('mac')
+
+    def is_warm(self, dpid):
+        prefix = '%d ' % dpid
+        return any(k.startswith(prefix) for k in self.store.section('rules'))
+
+    def request(self, dp):
+        # Tutte le regole dello switch, da confrontare con l'inventario
+        parser, ofp = dp.ofproto_parser, dp.ofproto
+        req = parser.OFPFlowStatsRequest(dp, 0, ofp.OFPTT_ALL, ofp.OFPP_ANY, ofp.OFPG_ANY,
+                                         0, 0, parser.OFPMatch())
+        dp.set_xid(req)
+        self._reconciling[dp.id] = (req.xid, [])
+        dp.send_msg(req)
+
+    def flow_stats_reply(self, msg):
+        # Restituisce le statistiche della riconciliazione quando l'ultima
+        # parte è arrivata, [] per le parti intermedie, None per le altre risposte
+        dp = msg.datapath
+        entry = self._reconciling.get(dp.id)
+        if entry is None or entry[0] != msg.xid:
+            return None
+        entry[1].extend(msg.body)
+        if msg.flags & dp.ofproto.OFPMPF_REPLY_MORE:
+            return []
+        del self._reconciling[dp.id]
+        self._reconcile(dp, entry[1])
+        return entry[1]
+
+    def _reconcile(self, dp, stats):
+        prefix = '%d ' % dp.id
+        rules = self.store.section('rules')
+        known = {k for k in rules if k.startswith(prefix)}
+        adopted = 0
+        for stat in stats:
+            key = flow_key(stat.table_id, stat.priority, stat.match, stat.instructions,
+                           stat.cookie, (stat.idle_timeout, stat.hard_timeout))
+            skey = prefix + json.dumps(key[0], separators=(',', ':'))
+            saved = rules.get(skey)
+            # Ripresa solo se sullo switch c'è la regola salvata
+            if saved is None or _thaw(saved) != key[1]:
+                continue
+            known.discard(skey)
+            fut = InstallFuture(dp.id)
+            fut._set_done(0.0)
+            self.flows.cache.restore(dp.id, key, fut)
+            adopted += 1
+        # Regole dell'inventario non più sullo switch
+        for skey in known:
+            self.store.delete('rules', skey)
+        if self.logger:
+            self.logger.info("DPID=%s riconciliato: %d regole riprese, %d scomparse",
+                             dp.id, adopted, len(known))
+
+    def forget(self, dpid):
+        self._reconciling.pop(dpid, None)
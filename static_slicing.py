@@ -1,42 +1,151 @@
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, set_ev_cls
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER
+from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
-from ryu.lib.packet import packet, ethernet
 from ryu.lib.packet import ether_types
+from ryu.lib.packet.arp import ARP_REQUEST
+from ryu.lib import hub
+import time
 
-S1_DPID = 1
-S2_DPID = 2   # upper
-S3_DPID = 3   # lower
-S4_DPID = 4
+from arp_proxy import ArpProxy
+from control_plane import ControlPlaneGuard
+from flow_cache import flow_key
+from flow_lifecycle import FlowLifecycle, DEFAULT, DROP
+from flow_programmer import FlowProgrammer
+from mac_table import MacTable
+from metrics import ControllerMetrics
+from packet_classifier import classify
+from packet_workers import PacketInWorkers, THREADS
+from slice_policy import SlicePolicy
+from state_snapshot import WarmRestart, state_path
 
 class StrictSliceDPID(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
+    # Modalità proattiva: all'aggancio dello switch la policy e la topologia
+    # dichiarate in slice_policy.json vengono compilate in tutte le FlowMod (drop incluse), così il
+    # traffico a regime non genera PacketIn. La logica reattiva resta per il
+    # traffico non previsto (table-miss).
+    PROACTIVE = True
+
+    # Proxy ARP: le richieste verso host della stessa slice con IP noto
+    # (slice_policy.json) vanno al controller, che risponde dall'access switch
+    # di ingresso; le altre seguono il flood guidato della slice
+    PROXY_ARP = True
+
+    PRIORITY_FORWARD = 10
+    PRIORITY_ARP     = 15
+    PRIORITY_ARP_PROXY = 16
+    PRIORITY_HOST_DROP = 5
+    PRIORITY_HOST_PUNT = 6
+    PRIORITY_DROP    = 100
+
+    # Timeout (idle, hard) in secondi delle regole installate dai PacketIn,
+    # per classe (0 = nessuno): le tabelle restano limitate e una regola
+    # superata dalla policy scade da sola. Le regole proattive non scadono.
+    TIMEOUT_DEFAULT = (60, 600)
+    TIMEOUT_DROP    = (10, 60)
+
+    # Granularità delle regole di drop per le coppie non consentite:
+    #  - DROP_PAIR: una regola per (in_port, eth_src, eth_dst), comportamento
+    #    originale; un host che scandisce MAC crea una regola per destinazione
+    #  - DROP_SOURCE: una sola regola per (in_port, eth_src) sotto le regole di
+    #    inoltro; le destinazioni consentite e l'ARP della sorgente continuano
+    #    ad arrivare al controller (PRIORITY_HOST_PUNT)
+    DROP_PAIR   = 'pair'
+    DROP_SOURCE = 'source'
+    DROP_GRANULARITY = DROP_SOURCE
+
+    # Canale di controllo (control_plane.py): al più PACKET_IN_RATE PacketIn/s
+    # (burst PACKET_IN_BURST) per MAC sorgente, gli altri scartati dal
+    # controller (0 = nessun limite); table-miss limitata sullo switch dal
+    # meter CONTROL_METER_ID a CONTROL_METER_PPS pacchetti/s (0 = spento).
+    # MISS_SEND_LEN va allo switch con OFPSetConfig ed è il max_len delle
+    # azioni verso il controller: valori minori di OFPCML_NO_BUFFER
+    # richiedono uno switch che bufferizza i pacchetti.
+    PACKET_IN_RATE    = 100
+    PACKET_IN_BURST   = 200
+    CONTROL_METER_ID  = 0xffff
+    CONTROL_METER_PPS = 1000
+    CONTROL_METER_BURST = 200
+    MISS_SEND_LEN     = ofproto_v1_3.OFPCML_NO_BUFFER
+
+    # Decodifica dei frame dei PacketIn fuori dal hub (packet_workers.py), a
+    # lotti in un thread nativo (THREADS) o in processi (PROCESSES), con una
+    # coda per gruppo di datapath in ognuno dei WORKERS worker: i PacketIn di
+    # uno switch restano in ordine. Le decisioni restano seriali nel hub:
+    # nessun guadagno di throughput, latenza maggiore. Opzionale, per tenere
+    # il hub reattivo durante raffiche di frame; 0 = tutto nell'handler.
+    WORKERS     = 0
+    WORKER_MODE = THREADS
+
+    # Tabella MAC limitata: voci scadute dopo MAC_AGING secondi senza traffico,
+    # LRU oltre MAC_TABLE_SIZE voci
+    MAC_TABLE_SIZE = 4096
+    MAC_AGING      = 300
+
+    # Metriche Prometheus su http://127.0.0.1:METRICS_PORT/metrics (0 = spento)
+    METRICS_PORT   = 9101
+    STATS_INTERVAL = 5
+
+    # Riavvio a caldo: tabella MAC e regole installate salvate in STATE_FILE
+    # e riconciliate con le flow stats all'aggancio degli switch ('' = spento)
+    STATE_FILE = state_path('static_slicing')
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.mac_to_port = {}
-        self.H1 = '00:00:00:00:00:01'
-        self.H2 = '00:00:00:00:00:02'
-        self.H3 = '00:00:00:00:00:03'
-        self.H4 = '00:00:00:00:00:04'
-        self.allowed = {
-            (self.H1, self.H3), (self.H3, self.H1),
-            (self.H2, self.H4), (self.H4, self.H2)
-        }
-
-    def add_flow(self, dp, prio, match, actions, buffer_id=None):
+        self.mac_table = MacTable(self.MAC_TABLE_SIZE, self.MAC_AGING)
+        self.arp = ArpProxy(self.MAC_TABLE_SIZE, self.MAC_AGING)
+        self.datapaths = {}
+        self.flows = FlowProgrammer(self.logger)
+        self.state = WarmRestart(self.STATE_FILE, self.mac_table, self.flows, self.logger)
+        self.lifecycle = FlowLifecycle(self.logger)
+        self.guard = ControlPlaneGuard(self.logger, self.PACKET_IN_RATE, self.PACKET_IN_BURST,
+                                       self.MAC_TABLE_SIZE, self.CONTROL_METER_ID,
+                                       self.CONTROL_METER_PPS, self.CONTROL_METER_BURST,
+                                       self.MISS_SEND_LEN)
+        self.workers = None
+        if self.WORKERS:
+            self.workers = PacketInWorkers(self.WORKERS, self._handle_packet_in, classify,
+                                           self.WORKER_MODE, alive=self._datapath_alive,
+                                           logger=self.logger)
+        self._source_drops = {}   # (dpid, in_port, eth_src) -> scadenza del drop aggregato
+        self.metrics = ControllerMetrics(self.logger)
+        self.metrics.track(self)
+        self.metrics.serve(self.METRICS_PORT)
+
+        # Slice consentite (upper: H1-H3 via S2, lower: H2-H4 via S3) e
+        # topologia dichiarata, ricaricate a caldo quando il file cambia
+        self.policy = SlicePolicy(logger=self.logger)
+        self.policy.add_listener(self._policy_reloaded)
+        self.policy.watch()
+
+        self._stats_thread = hub.spawn(self._stats_loop)
+
+    def add_flow(self, dp, prio, match, actions, buffer_id=None, timeout=(0, 0), inst=None):
         parser, ofp = dp.ofproto_parser, dp.ofproto
-        inst = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
+        if inst is None:
+            inst = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
+        idle, hard = timeout
+        key = flow_key(0, prio, match, inst, 0, timeout)
         if buffer_id is not None and buffer_id != ofp.OFP_NO_BUFFER:
             mod = parser.OFPFlowMod(datapath=dp, buffer_id=buffer_id,
-                                    priority=prio, match=match, instructions=inst)
+                                    priority=prio, match=match, instructions=inst,
+                                    idle_timeout=idle, hard_timeout=hard,
+                                    flags=ofp.OFPFF_SEND_FLOW_REM)
         else:
+            # Regola già installata: niente FlowMod da costruire
+            fut = self.flows.cached(dp, key)
+            if fut is not None:
+                return fut
             mod = parser.OFPFlowMod(datapath=dp, priority=prio,
-                                    match=match, instructions=inst)
-        dp.send_msg(mod)
+                                    match=match, instructions=inst,
+                                    idle_timeout=idle, hard_timeout=hard,
+                                    flags=ofp.OFPFF_SEND_FLOW_REM)
+        return self.flows.add(dp, mod, key)
 
-    def pkt_out(self, dp, in_port, actions, data=None, buffer_id=None):
+    def pkt_out(self, dp, in_port, actions, data=None, buffer_id=None, after=None):
         parser, ofp = dp.ofproto_parser, dp.ofproto
         if buffer_id is not None and buffer_id != ofp.OFP_NO_BUFFER:
             out = parser.OFPPacketOut(datapath=dp, buffer_id=buffer_id,
@@ -44,70 +153,338 @@ class StrictSliceDPID(app_manager.RyuApp):
         else:
             out = parser.OFPPacketOut(datapath=dp, buffer_id=ofp.OFP_NO_BUFFER,
                                       in_port=in_port, actions=actions, data=data)
-        dp.send_msg(out)
+        self.flows.packet_out(dp, out, after=after)
 
     def violates_slice(self, src_mac, dpid):
-        if src_mac in (self.H1, self.H3) and dpid == S3_DPID:
-            return True
-        if src_mac in (self.H2, self.H4) and dpid == S2_DPID:
-            return True
-        return False
+        return self.policy.compiled.violates(src_mac, dpid)
+
+    def slice_path(self, pol, src, dst):
+        # Percorso (lista di DPID) da src a dst che non attraversa switch
+        # vietati alla slice di src
+        start = pol.host_location[src][0]
+        end = pol.host_location[dst][0]
+        prev = {start: None}
+        queue = [start]
+        for dpid in queue:
+            if dpid == end:
+                break
+            for nxt in sorted(pol.links[dpid]):
+                if nxt not in prev and not pol.violates(src, nxt):
+                    prev[nxt] = dpid
+                    queue.append(nxt)
+        if end not in prev:
+            return None
+
+        path = [end]
+        while prev[path[-1]] is not None:
+            path.append(prev[path[-1]])
+        return path[::-1]
+
+    def compile_flows(self, dpid):
+        # Restituisce (priorità, campi del match, porte di uscita) per dpid;
+        # nessuna porta di uscita = drop
+        pol = self.policy.compiled
+        unicast = {}   # (in_port, src, dst) -> out_port
+        arp = {}       # (in_port, src) -> {out_port}
+        for src, dst in sorted(pol.allowed_pairs):
+            if src not in pol.host_location or dst not in pol.host_location:
+                continue
+            path = self.slice_path(pol, src, dst)
+            if not path or dpid not in path:
+                continue
+            i = path.index(dpid)
+            if i == 0:
+                in_port = pol.host_location[src][1]
+            else:
+                in_port = pol.links[dpid][path[i - 1]]
+            if i == len(path) - 1:
+                out_port = pol.host_location[dst][1]
+            else:
+                out_port = pol.links[dpid][path[i + 1]]
+            unicast[(in_port, src, dst)] = out_port
+            arp.setdefault((in_port, src), set()).add(out_port)
+
+        flows = []
+        for src in sorted(pol.host_location):
+            host_dpid, host_port = pol.host_location[src]
+            if pol.violates(src, dpid):
+                flows.append((self.PRIORITY_DROP, {'eth_src': src}, []))
+            elif host_dpid == dpid:
+                # Tutto ciò che l'host invia fuori dalla propria slice
+                flows.append((self.PRIORITY_HOST_DROP,
+                              {'in_port': host_port, 'eth_src': src}, []))
+
+        if self.PROXY_ARP:
+            ip_of = {mac: ip for ip, mac in pol.host_ips.items()}
+            for src, dst in sorted(pol.allowed_pairs):
+                if dst not in ip_of or pol.host_location.get(src, (None,))[0] != dpid:
+                    continue
+                fields = {'in_port': pol.host_location[src][1], 'eth_src': src,
+                          'eth_type': ether_types.ETH_TYPE_ARP,
+                          'arp_op': ARP_REQUEST, 'arp_tpa': ip_of[dst]}
+                flows.append((self.PRIORITY_ARP_PROXY, fields, [ofproto_v1_3.OFPP_CONTROLLER]))
+
+        for (in_port, src), out_ports in sorted(arp.items()):
+            fields = {'in_port': in_port, 'eth_src': src,
+                      'eth_type': ether_types.ETH_TYPE_ARP}
+            flows.append((self.PRIORITY_ARP, fields, sorted(out_ports)))
+
+        for (in_port, src, dst), out_port in sorted(unicast.items()):
+            fields = {'in_port': in_port, 'eth_src': src, 'eth_dst': dst}
+            flows.append((self.PRIORITY_FORWARD, fields, [out_port]))
+        return flows
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         dp = ev.msg.datapath
-        parser, ofp = dp.ofproto_parser, dp.ofproto
         self.logger.info("Switch connected: DPID=%s", dp.id)
+        warm = self.state.is_warm(dp.id)
+        self.guard.configure(dp, warm)
+        self.install_base_flows(dp)
+        self.flows.flush(dp)
+        # Switch già noto: le regole ancora presenti tornano nella cache
+        if warm:
+            self.state.request(dp)
+
+    def install_base_flows(self, dp):
+        parser, ofp = dp.ofproto_parser, dp.ofproto
+        if self.PROACTIVE and dp.id in self.policy.compiled.links:
+            flows = self.compile_flows(dp.id)
+            for prio, fields, out_ports in flows:
+                actions = [parser.OFPActionOutput(p, self.MISS_SEND_LEN)
+                           if p == ofp.OFPP_CONTROLLER else parser.OFPActionOutput(p)
+                           for p in out_ports]
+                self.add_flow(dp, prio, parser.OFPMatch(**fields), actions)
+            self.logger.info("DPID=%s: installate %d regole proattive", dp.id, len(flows))
 
+        # Table-miss limitata dal meter del canale di controllo
         match = parser.OFPMatch()
-        actions = [parser.OFPActionOutput(ofp.OFPP_CONTROLLER, ofp.OFPCML_NO_BUFFER)]
-        self.add_flow(dp, 0, match, actions)
+        actions = [parser.OFPActionOutput(ofp.OFPP_CONTROLLER, self.MISS_SEND_LEN)]
+        inst = self.guard.attach(parser, [
+            parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)])
+        self.add_flow(dp, 0, match, None, inst=inst)
+
+    def delete_flows(self, dp, match=None):
+        parser, ofp = dp.ofproto_parser, dp.ofproto
+        mod = parser.OFPFlowMod(datapath=dp, command=ofp.OFPFC_DELETE,
+                                table_id=ofp.OFPTT_ALL, out_port=ofp.OFPP_ANY,
+                                out_group=ofp.OFPG_ANY, match=match or parser.OFPMatch())
+        return self.flows.add(dp, mod)
+
+    def drop_pair(self, dp, in_port, src, dst):
+        parser = dp.ofproto_parser
+        if self.DROP_GRANULARITY == self.DROP_PAIR:
+            match = parser.OFPMatch(in_port=in_port, eth_src=src, eth_dst=dst)
+            self.add_flow(dp, self.PRIORITY_DROP, match, [], timeout=self.TIMEOUT_DROP)
+            return
+        # Drop aggregato già installato: i PacketIn arrivati prima della
+        # regola non generano altre FlowMod
+        key = (dp.id, in_port, src)
+        now = time.time()
+        if self._source_drops.get(key, 0.0) > now:
+            return
+        timeout = self.TIMEOUT_DROP[1] or self.TIMEOUT_DROP[0]
+        self._source_drops[key] = now + timeout if timeout else float('inf')
+
+        ofp = dp.ofproto
+        self.add_flow(dp, self.PRIORITY_HOST_DROP, parser.OFPMatch(in_port=in_port, eth_src=src),
+                      [], timeout=self.TIMEOUT_DROP)
+        # Le punt non vedono traffico (le precedono le regole di inoltro):
+        # nessun idle timeout, e scadono dopo il drop che servono; se il drop
+        # viene rimosso prima vengono cancellate (_flow_removed_handler)
+        actions = [parser.OFPActionOutput(ofp.OFPP_CONTROLLER, self.MISS_SEND_LEN)]
+        for match in self.punt_matches(dp, in_port, src):
+            self.add_flow(dp, self.PRIORITY_HOST_PUNT, match, actions,
+                          timeout=(0, self.TIMEOUT_DROP[1]))
+
+    def punt_matches(self, dp, in_port, src):
+        # ARP e destinazioni consentite di src sopra il drop aggregato,
+        # coperte dalle regole proattive dove presenti
+        parser = dp.ofproto_parser
+        pol = self.policy.compiled
+        if self.PROACTIVE and dp.id in pol.links:
+            return []
+        punts = [{'eth_type': ether_types.ETH_TYPE_ARP}]
+        punts += [{'eth_dst': b} for a, b in sorted(pol.allowed_pairs) if a == src]
+        return [parser.OFPMatch(in_port=in_port, eth_src=src, **fields) for fields in punts]
+
+    def arp_reply(self, dp, in_port, data, allowed=None):
+        # Proxy ARP: risponde dall'access switch di ingresso se il target è noto
+        reply = self.arp.process(data, self.policy.compiled.host_ips, allowed)
+        if reply is None:
+            return False
+        parser, ofp = dp.ofproto_parser, dp.ofproto
+        out = parser.OFPPacketOut(datapath=dp, buffer_id=ofp.OFP_NO_BUFFER,
+                                  in_port=ofp.OFPP_CONTROLLER,
+                                  actions=[parser.OFPActionOutput(in_port)], data=reply)
+        self.flows.packet_out(dp, out)
+        return True
+
+    def host_moved(self, mac, dpid, port):
+        # Le regole verso il MAC puntano alla vecchia posizione: vengono
+        # rimosse su tutti gli switch e il MAC viene reimparato da capo
+        self.logger.info("Host %s spostato: DPID=%s porta %s", mac, dpid, port)
+        self.mac_table.remove(mac)
+        self.mac_table.learn(dpid, mac, port)
+        for other in list(self.datapaths.values()):
+            self.delete_flows(other, other.ofproto_parser.OFPMatch(eth_dst=mac))
+            self.flows.flush(other)
+
+    def _policy_reloaded(self, policy):
+        # Le regole installate riflettono la policy precedente: si riparte
+        # dalle regole di base (la barrier separa delete e nuove regole)
+        self.mac_table.clear()
+        self.state.clear_macs()
+        self._source_drops.clear()
+        for dp in list(self.datapaths.values()):
+            self.delete_flows(dp)
+            self.flows.flush(dp)
+            self.install_base_flows(dp)
+            self.flows.flush(dp)
+
+    def _stats_loop(self):
+        while True:
+            for dp in list(self.datapaths.values()):
+                self._request_stats(dp)
+            hub.sleep(self.STATS_INTERVAL)
+
+    def _request_stats(self, dp):
+        parser = dp.ofproto_parser
+        ofp = dp.ofproto
+        dp.send_msg(parser.OFPTableStatsRequest(dp, 0))
+        if dp.id in self.policy.compiled.port_slice:
+            dp.send_msg(parser.OFPPortStatsRequest(dp, 0, ofp.OFPP_ANY))
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def _port_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        self.metrics.port_stats(dpid, ev.msg.body, self.policy.compiled.port_slice.get(dpid, {}))
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev):
+        dp = ev.datapath
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[dp.id] = dp
+        elif ev.state == DEAD_DISPATCHER and dp.id is not None:
+            self.datapaths.pop(dp.id, None)
+            self.flows.forget(dp.id)
+            self.mac_table.forget(dp.id)
+            self.state.forget(dp.id)
+            self.lifecycle.forget(dp.id)
+            self.guard.forget(dp.id)
+            for key in [k for k in self._source_drops if k[0] == dp.id]:
+                del self._source_drops[key]
+            self.metrics.forget(dp.id)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def _barrier_reply_handler(self, ev):
+        self.flows.barrier_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def _error_msg_handler(self, ev):
+        # FlowMod rifiutata: il suo future fallisce e la regola esce dalla cache
+        msg = ev.msg
+        if not self.flows.error(msg):
+            self.logger.warning("DPID=%s: errore OpenFlow type=%s code=%s",
+                                msg.datapath.id, msg.type, msg.code)
+
+    @set_ev_cls(ofp_event.EventOFPTableStatsReply, MAIN_DISPATCHER)
+    def _table_stats_reply_handler(self, ev):
+        self.metrics.table_stats(ev.msg.datapath.id, ev.msg.body)
+        self.lifecycle.table_stats(ev.msg.datapath.id, ev.msg.body)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def _flow_stats_reply_handler(self, ev):
+        self.state.flow_stats_reply(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def _flow_removed_handler(self, ev):
+        msg = ev.msg
+        self.flows.cache.flow_removed(msg)
+        kind = DROP if msg.priority in (self.PRIORITY_DROP, self.PRIORITY_HOST_DROP) else DEFAULT
+        self.lifecycle.flow_removed(msg, kind)
+        if msg.priority == self.PRIORITY_HOST_DROP and 'in_port' in msg.match:
+            dp, in_port, src = msg.datapath, msg.match['in_port'], msg.match.get('eth_src')
+            self._source_drops.pop((dp.id, in_port, src), None)
+            # Drop scaduto: via anche le sue punt, reinstallate col prossimo
+            parser, ofp = dp.ofproto_parser, dp.ofproto
+            for match in self.punt_matches(dp, in_port, src):
+                self.flows.add(dp, parser.OFPFlowMod(
+                    datapath=dp, command=ofp.OFPFC_DELETE_STRICT,
+                    priority=self.PRIORITY_HOST_PUNT, out_port=ofp.OFPP_ANY,
+                    out_group=ofp.OFPG_ANY, match=match))
+            self.flows.flush(dp)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
+        if not self.guard.allow(ev.msg.datapath.id, ev.msg.data):
+            return
+        if self.workers is not None:
+            self.workers.submit(ev)
+            return
+        self._handle_packet_in(ev)
+
+    def _datapath_alive(self, dp):
+        # PacketIn ancora in coda nei worker di uno switch disconnesso
+        return self.datapaths.get(dp.id) is dp
+
+    def _handle_packet_in(self, ev, info=None):
+        start = time.perf_counter()
+        self._process_packet_in(ev, info)
+        self.flows.flush(ev.msg.datapath)
+        self.metrics.observe_packet_in(ev.msg.datapath.id, time.perf_counter() - start)
+
+    def _process_packet_in(self, ev, info=None):
         msg, dp = ev.msg, ev.msg.datapath
         parser, ofp = dp.ofproto_parser, dp.ofproto
         dpid, in_port = dp.id, msg.match['in_port']
+        pol = self.policy.compiled
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
-        if eth.ethertype == ether_types.ETH_TYPE_LLDP:
+        if info is None:
+            info = classify(msg.data)
+        if info is None or info.ethertype == ether_types.ETH_TYPE_LLDP:
             return
 
-        src, dst, etype = eth.src, eth.dst, eth.ethertype
-        self.mac_to_port.setdefault(dpid, {})
-        self.mac_to_port[dpid][src] = in_port
+        src, dst, etype = info.src, info.dst, info.ethertype
+        # MAC learning: un cambio di porta da/verso una porta host è uno spostamento
+        moved = self.mac_table.learn(dpid, src, in_port)
+        if moved is not None and (pol.is_host_port(dpid, moved) or
+                                  pol.is_host_port(dpid, in_port)):
+            self.host_moved(src, dpid, in_port)
 
-        
         if etype == ether_types.ETH_TYPE_ARP:
-            if self.violates_slice(src, dpid):
+            if pol.violates(src, dpid):
                 match = parser.OFPMatch(in_port=in_port, eth_src=src, eth_type=etype)
-                self.add_flow(dp, 100, match, [])
+                self.add_flow(dp, self.PRIORITY_DROP, match, [], timeout=self.TIMEOUT_DROP)
+                return
+            if (self.PROXY_ARP and pol.is_host_port(dpid, in_port) and
+                    self.arp_reply(dp, in_port, msg.data,
+                                   lambda a, b: (a, b) in pol.allowed_pairs)):
                 return
             actions = [parser.OFPActionOutput(ofp.OFPP_FLOOD)]
             self.pkt_out(dp, in_port, actions, data=msg.data, buffer_id=msg.buffer_id)
             return
 
-        if self.violates_slice(src, dpid):
+        if pol.violates(src, dpid):
             match = parser.OFPMatch(in_port=in_port, eth_src=src)
-            self.add_flow(dp, 100, match, [])
+            self.add_flow(dp, self.PRIORITY_DROP, match, [], timeout=self.TIMEOUT_DROP)
             return
 
-        if (src, dst) not in self.allowed:
-            match = parser.OFPMatch(in_port=in_port, eth_src=src, eth_dst=dst)
-            self.add_flow(dp, 100, match, [])
+        if (src, dst) not in pol.allowed_pairs:
+            self.drop_pair(dp, in_port, src, dst)
             return
 
-        if dst in self.mac_to_port[dpid]:
-            out_port = self.mac_to_port[dpid][dst]
-        else:
+        out_port = self.mac_table.get(dpid, dst)
+        if out_port is None:
             out_port = ofp.OFPP_FLOOD
 
         actions = [parser.OFPActionOutput(out_port)]
         match = parser.OFPMatch(in_port=in_port, eth_src=src, eth_dst=dst)
 
         if msg.buffer_id != ofp.OFP_NO_BUFFER:
-            self.add_flow(dp, 10, match, actions, buffer_id=msg.buffer_id)
+            self.add_flow(dp, self.PRIORITY_FORWARD, match, actions, buffer_id=msg.buffer_id,
+                          timeout=self.TIMEOUT_DEFAULT)
         else:
-            self.add_flow(dp, 10, match, actions)
-            self.pkt_out(dp, in_port, actions, data=msg.data)
+            fut = self.add_flow(dp, self.PRIORITY_FORWARD, match, actions,
+                                timeout=self.TIMEOUT_DEFAULT)
+            self.pkt_out(dp, in_port, actions, data=msg.data, after=fut)
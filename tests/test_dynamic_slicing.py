@@ -0,0 +1,80 @@
+import unittest
+
+from ryu.controller import ofp_event
+from ryu.controller.handler import MAIN_DISPATCHER
+from ryu.ofproto import ofproto_v1_3 as ofp, ofproto_v1_3_parser as parser
+
+import dynamic_slicing
+from bench_controllers import MockDatapath, build_frame, deliver_barriers, packet_in_events
+
+H2, H4 = '00:00:00:00:00:02', '00:00:00:00:00:04'
+IP_OF = {H2: '10.0.0.2', H4: '10.0.0.4'}
+
+
+class Controller(dynamic_slicing.SliceEnforcingController):
+    WORKERS = 0
+    METRICS_PORT = 0
+    STATE_FILE = ''
+
+
+class StandbyPathTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Controller()
+        self.datapaths = {}
+        self.sent = []
+        for dpid in (1, 2, 3, 4):
+            dp = self.datapaths[dpid] = MockDatapath(dpid)
+            ev = ofp_event.EventOFPStateChange(dp)
+            ev.state = MAIN_DISPATCHER
+            self.app._state_change_handler(ev)
+            features = parser.OFPSwitchFeatures(dp, datapath_id=dpid)
+            self.app.switch_features_handler(ofp_event.EventOFPSwitchFeatures(features))
+            self.record(dp)
+        self.settle()
+
+    def record(self, dp):
+        send_msg = dp.send_msg
+        dp.send_msg = lambda msg, close_socket=False: (self.sent.append((dp.id, msg))
+                                                       or send_msg(msg))
+
+    def settle(self, barriers=(1, 2, 3, 4)):
+        for dpid in barriers:
+            deliver_barriers(self.app, self.datapaths[dpid])
+        for dp in self.datapaths.values():
+            self.app.flows.flush(dp, now=True)
+
+    def flow_mods(self):
+        mods = [(dpid, msg.command) for dpid, msg in self.sent
+                if isinstance(msg, parser.OFPFlowMod)]
+        del self.sent[:]
+        return mods
+
+    def test_transition_reinstalls_expired_standby_path(self):
+        self.assertTrue(self.app.allow_non_video_upper)
+        data = build_frame(H2, H4, 'tcp', 40000, IP_OF)
+        for dp, ev in packet_in_events(self.datapaths, [(1, 2, data)]):
+            self.app._packet_in_handler(ev)
+        self.settle()
+        self.flow_mods()
+
+        # La regola della lower (S3), senza traffico, scade per idle timeout
+        removed = parser.OFPFlowRemoved(
+            self.datapaths[3], cookie=0, priority=self.app.PRIORITY_DEFAULT,
+            reason=ofp.OFPRR_IDLE_TIMEOUT, table_id=0, duration_sec=60, duration_nsec=0,
+            idle_timeout=60, hard_timeout=600, packet_count=0, byte_count=0,
+            match=parser.OFPMatch(_ordered_fields=[('in_port', 1), ('eth_src', H2),
+                                                   ('eth_dst', H4)]))
+        self.app._flow_removed_handler(ofp_event.EventOFPFlowRemoved(removed))
+
+        # Protezione del video: il non-video torna sulla lower
+        self.app.allow_non_video_upper = False
+        self.app._reroute_non_video()
+        self.settle(barriers=())
+        self.assertEqual(self.flow_mods(), [(3, ofp.OFPFC_ADD)])
+        self.settle(barriers=(3,))
+        self.assertEqual(sorted(self.flow_mods()), [(1, ofp.OFPFC_MODIFY), (4, ofp.OFPFC_MODIFY)])
+
+
+if __name__ == '__main__':
+    unittest.main()
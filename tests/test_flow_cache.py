@@ -0,0 +1,55 @@
+import unittest
+
+from ryu.ofproto import ofproto_v1_3 as ofp, ofproto_v1_3_parser as parser
+
+from flow_cache import FlowCache, flow_key
+from flow_programmer import InstallFuture
+
+H1, H3 = '00:00:00:00:00:01', '00:00:00:00:00:03'
+
+
+class FakeDatapath(object):
+
+    def __init__(self, dpid):
+        self.id = dpid
+        self.ofproto = ofp
+        self.ofproto_parser = parser
+
+
+def switch_match():
+    # Ordine dei campi come li invia OVS: eth_src prima di eth_dst
+    return parser.OFPMatch(_ordered_fields=[('in_port', 1), ('eth_src', H1), ('eth_dst', H3)])
+
+
+class FlowCacheMatchOrderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dp = FakeDatapath(1)
+        self.cache = FlowCache()
+        actions = [parser.OFPActionOutput(3)]
+        self.inst = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
+        match = parser.OFPMatch(in_port=1, eth_src=H1, eth_dst=H3)
+        self.key = flow_key(0, 10, match, self.inst, 0, (60, 600))
+        self.cache.insert(self.dp.id, self.key, InstallFuture(self.dp.id))
+
+    def test_flow_removed_with_switch_field_order(self):
+        msg = parser.OFPFlowRemoved(self.dp, cookie=0, priority=10, reason=ofp.OFPRR_IDLE_TIMEOUT,
+                                    table_id=0, match=switch_match())
+        self.cache.flow_removed(msg)
+        self.assertEqual(self.cache.size(), 0)
+        self.assertIsNone(self.cache.lookup(self.dp.id, self.key))
+
+    def test_modify_strict_with_switch_field_order(self):
+        actions = [parser.OFPActionOutput(4)]
+        inst = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
+        mod = parser.OFPFlowMod(self.dp, table_id=0, priority=10, command=ofp.OFPFC_MODIFY_STRICT,
+                                match=switch_match(), instructions=inst)
+        self.cache.apply(self.dp.id, mod)
+        self.assertIsNone(self.cache.lookup(self.dp.id, self.key))
+        moved = flow_key(0, 10, parser.OFPMatch(in_port=1, eth_src=H1, eth_dst=H3),
+                         inst, 0, (60, 600))
+        self.assertIsNotNone(self.cache.lookup(self.dp.id, moved))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import logging
+import unittest
+
+from ryu.ofproto import ofproto_v1_3 as ofp, ofproto_v1_3_parser as parser
+
+from bench_controllers import MockDatapath
+from flow_cache import mod_key
+from flow_programmer import FlowProgrammer
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+
+class FlowModErrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dp = MockDatapath(1)
+        self.sent = []
+        send_msg = self.dp.send_msg
+        self.dp.send_msg = lambda msg, close_socket=False: self.sent.append(msg) or send_msg(msg)
+        self.flows = FlowProgrammer(LOG)
+
+    def add_rule(self):
+        inst = [parser.OFPInstructionMeter(1),
+                parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS,
+                                             [parser.OFPActionOutput(2)])]
+        mod = parser.OFPFlowMod(self.dp, priority=10, match=parser.OFPMatch(in_port=1),
+                                instructions=inst)
+        return mod, self.flows.add(self.dp, mod)
+
+    def test_rejected_flow_mod_fails_and_leaves_the_cache(self):
+        mod, fut = self.add_rule()
+        out = parser.OFPPacketOut(self.dp, buffer_id=ofp.OFP_NO_BUFFER, in_port=1,
+                                  actions=[parser.OFPActionOutput(2)], data=b'x' * 60)
+        self.flows.packet_out(self.dp, out, after=fut)
+        self.flows.flush(self.dp, now=True)
+
+        error = parser.OFPErrorMsg(self.dp, type_=ofp.OFPET_METER_MOD_FAILED,
+                                   code=ofp.OFPMMFC_UNKNOWN_METER)
+        error.xid = mod.xid
+        self.assertTrue(self.flows.error(error))
+        for ev in self.dp.barrier_replies():
+            self.flows.barrier_reply(ev.msg)
+
+        self.assertIs(fut.error, error)
+        self.assertEqual(self.flows.cache.size(), 0)
+        self.assertIsNone(self.flows.cached(self.dp, mod_key(mod)))
+        self.assertFalse(any(isinstance(m, parser.OFPPacketOut) for m in self.sent))
+
+        # La stessa regola viene ritentata
+        retry, retry_fut = self.add_rule()
+        self.assertIsNot(retry_fut, fut)
+        self.flows.flush(self.dp, now=True)
+        self.assertEqual(sum(isinstance(m, parser.OFPFlowMod) for m in self.sent), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
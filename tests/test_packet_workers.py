@@ -0,0 +1,44 @@
+import unittest
+
+from ryu.lib import hub
+
+from bench_controllers import MockDatapath
+from packet_workers import PacketInWorkers
+
+
+class Msg(object):
+
+    def __init__(self, datapath, data):
+        self.datapath = datapath
+        self.data = data
+
+
+class Event(object):
+
+    def __init__(self, datapath, data):
+        self.msg = Msg(datapath, data)
+
+
+def parse(data):
+    return data if data != b'junk' else None
+
+
+class PacketInWorkersTest(unittest.TestCase):
+
+    def test_drops_unparsed_frames_and_gone_datapaths(self):
+        live, gone = MockDatapath(1), MockDatapath(2)
+        handled = []
+        workers = PacketInWorkers(2, lambda ev, info: handled.append((ev.msg.datapath.id, info)),
+                                  parse, alive=lambda dp: dp is live)
+        try:
+            for dp, data in ((live, b'a'), (gone, b'b'), (live, b'junk'), (live, b'c')):
+                workers.submit(Event(dp, data))
+            while sum(workers.processed) < 4:
+                hub.sleep(0.01)
+        finally:
+            workers.stop()
+        self.assertEqual(handled, [(1, b'a'), (1, b'c')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+from ryu.controller import ofp_event
+from ryu.controller.handler import MAIN_DISPATCHER
+from ryu.ofproto import ofproto_v1_3 as ofp, ofproto_v1_3_parser as parser
+
+import service_slicing
+from bench_controllers import MockDatapath, build_frame, deliver_barriers, packet_in_events
+
+H1, H3 = '00:00:00:00:00:01', '00:00:00:00:00:03'
+IP_OF = {H1: '10.0.0.1', H3: '10.0.0.3'}
+
+
+class PipelineController(service_slicing.SliceEnforcingController):
+    PIPELINE = True
+    WORKERS = 0
+    METRICS_PORT = 0
+    STATE_FILE = ''
+
+
+class SmallHostTableController(PipelineController):
+    MAC_TABLE_SIZE = 2
+
+
+class PipelineTestCase(unittest.TestCase):
+
+    controller = PipelineController
+
+    def setUp(self):
+        self.app = self.controller()
+        self.datapaths = {}
+        for dpid in (1, 2, 3, 4):
+            dp = self.datapaths[dpid] = MockDatapath(dpid)
+            ev = ofp_event.EventOFPStateChange(dp)
+            ev.state = MAIN_DISPATCHER
+            self.app._state_change_handler(ev)
+            features = parser.OFPSwitchFeatures(dp, datapath_id=dpid)
+            self.app.switch_features_handler(ofp_event.EventOFPSwitchFeatures(features))
+            deliver_barriers(self.app, dp)
+
+    def send(self, dpid, in_port, src, dst, kind, ip_of=IP_OF):
+        data = build_frame(src, dst, kind, 40000, ip_of)
+        for dp, ev in packet_in_events(self.datapaths, [(dpid, in_port, data)]):
+            self.app._packet_in_handler(ev)
+        for dp in self.datapaths.values():
+            self.app.flows.flush(dp, now=True)
+            deliver_barriers(self.app, dp)
+
+
+class PipelineProxyArpTest(PipelineTestCase):
+
+    def test_hosts_answered_by_proxy_arp_are_learned(self):
+        self.send(1, 1, H1, H3, 'arp')
+        self.send(1, 1, H1, H3, 'tcp')
+        self.send(4, 1, H3, H1, 'arp')
+        self.assertEqual(self.app.hosts.get(self.app.HOSTS, H1), (1, 1))
+        self.assertEqual(self.app.hosts.get(self.app.HOSTS, H3), (4, 1))
+
+        # h3 noto: il pacchetto torna nella pipeline invece del flood
+        dp = self.datapaths[1]
+        outs = []
+        send_msg = dp.send_msg
+        dp.send_msg = lambda msg, close_socket=False: outs.append(msg) or send_msg(msg)
+        self.send(1, 1, H1, H3, 'tcp')
+        packet_outs = [m for m in outs if isinstance(m, parser.OFPPacketOut)]
+        self.assertEqual([[a.port for a in m.actions] for m in packet_outs], [[ofp.OFPP_TABLE]])
+
+
+class PipelineHostTableTest(PipelineTestCase):
+
+    controller = SmallHostTableController
+
+    def test_host_table_is_bounded(self):
+        macs = ['00:00:00:00:01:%02x' % i for i in range(4)]
+        ip_of = dict(IP_OF, **{mac: '10.0.1.%d' % (i + 1) for i, mac in enumerate(macs)})
+        for mac in macs:
+            self.send(1, 1, mac, H3, 'tcp', ip_of)
+        self.assertEqual([mac for mac, loc in self.app.hosts.entries(self.app.HOSTS)], macs[2:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from slice_policy import DEFAULT_POLICY_FILE, SlicePolicy
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+
+class PolicyReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'policy.json')
+        shutil.copy(DEFAULT_POLICY_FILE, self.path)
+        self.policy = SlicePolicy(self.path, logger=LOG)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_invalid_spec_keeps_previous_policy(self):
+        previous = self.policy.compiled
+        for text in ('[1, 2]', '{"slices": []}', '{'):
+            with open(self.path, 'w') as f:
+                f.write(text)
+            self.assertFalse(self.policy.reload())
+            self.assertIs(self.policy.compiled, previous)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ryu.ofproto import ofproto_v1_3 as ofp, ofproto_v1_3_parser as parser
+
+from bench_controllers import MockDatapath
+from flow_cache import flow_key
+from flow_programmer import FlowProgrammer, InstallFuture
+from mac_table import MacTable
+from state_snapshot import WarmRestart
+
+H1, H3 = '00:00:00:00:00:01', '00:00:00:00:00:03'
+
+
+class WarmRestartMatchOrderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'state', 'test.state.json')
+        self.dp = MockDatapath(1)
+        actions = [parser.OFPActionOutput(3)]
+        self.inst = [parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def restart(self):
+        flows = FlowProgrammer(None)
+        return WarmRestart(self.path, MacTable(), flows), flows
+
+    def test_reconcile_with_switch_field_order(self):
+        state, flows = self.restart()
+        self.assertTrue(os.path.isdir(os.path.dirname(self.path)))
+        match = parser.OFPMatch(in_port=1, eth_src=H1, eth_dst=H3)
+        key = flow_key(0, 10, match, self.inst, 0, (60, 600))
+        flows.cache.insert(self.dp.id, key, InstallFuture(self.dp.id))
+        state.store.flush()
+
+        state, flows = self.restart()
+        self.assertTrue(state.is_warm(self.dp.id))
+        state.request(self.dp)
+        # Ordine dei campi come li invia OVS: eth_src prima di eth_dst
+        stat = parser.OFPFlowStats(
+            table_id=0, duration_sec=1, duration_nsec=0, priority=10, idle_timeout=60,
+            hard_timeout=600, flags=0, cookie=0, packet_count=1, byte_count=100,
+            match=parser.OFPMatch(_ordered_fields=[('in_port', 1), ('eth_src', H1),
+                                                   ('eth_dst', H3)]),
+            instructions=self.inst)
+        reply = parser.OFPFlowStatsReply(self.dp, body=[stat], flags=0)
+        reply.xid = self.dp.xid
+        self.assertEqual(state.flow_stats_reply(reply), [stat])
+        self.assertEqual(flows.cache.size(self.dp.id), 1)
+        self.assertTrue(flows.cached(self.dp, key).done())
+        self.assertEqual(len(state.store.section('rules')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
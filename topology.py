@@ -1,3 +1,5 @@
+import argparse
+import json
 import threading
 import random
 import time
@@ -6,45 +8,157 @@ from mininet.net import Mininet, CLI
 from mininet.node import OVSKernelSwitch, Host, RemoteController
 from mininet.link import TCLink
 
+# Banda (Mbit/s) e ritardo dei collegamenti di backbone per slice; le slice
+# oltre la seconda usano i valori della upper
+SLICE_NAMES = ['upper', 'lower']
+SLICE_BW    = {'upper': 10, 'lower': 1}
+SLICE_DELAY = {'upper': '25ms', 'lower': '25ms'}
+HOST_BW     = 10
+HOST_DELAY  = '0.0025ms'
+
+
+def host_mac(n):
+    return ':'.join('%02x' % b for b in n.to_bytes(6, 'big'))
+
+
+def host_ip(n):
+    return '10.%d.%d.%d' % ((n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff)
+
+
+def generate(access=2, hosts=2, slices=2, bw=None, delay=None):
+    # Fabric con `access` access switch, `hosts` host per access switch e
+    # `slices` backbone (uno switch per slice, collegato a tutti gli access
+    # switch). Restituisce la policy nel formato di slice_policy.json, con
+    # DPID e porte identici a quelli creati da Environment: con i valori di
+    # default è la topologia originale (s1/s4 access, s2 upper, s3 lower).
+    # DPID: primo access switch, poi i backbone, poi gli altri access switch;
+    # porte: prima gli host, poi i backbone in ordine di slice. Il video va
+    # sulla prima slice e il resto sulla seconda (default_slice); dalla terza
+    # in poi le slice hanno solo membri, rispettati dalla slicing statica.
+    if slices < 2:
+        raise ValueError("servono almeno 2 slice (upper e lower), richieste %d" % slices)
+    if slices > hosts:
+        raise ValueError("%d slice con %d host per access switch: slice senza membri"
+                         % (slices, hosts))
+    names = SLICE_NAMES[:slices] + ['slice%d' % k for k in range(len(SLICE_NAMES) + 1, slices + 1)]
+    bw = dict(SLICE_BW, **(bw or {}))
+    delay = dict(SLICE_DELAY, **(delay or {}))
+    backbone = [k + 2 for k in range(slices)]
+    access_dpids = [1] + [slices + 2 + i for i in range(access - 1)]
+
+    links = {dpid: {} for dpid in access_dpids + backbone}
+    for i, a in enumerate(access_dpids):
+        for k, b in enumerate(backbone):
+            links[a][b] = hosts + k + 1
+            links[b][a] = i + 1
+
+    host_map = {}
+    members = {name: [] for name in names}
+    n = 0
+    for a in access_dpids:
+        for j in range(hosts):
+            n += 1
+            mac = host_mac(n)
+            host_map[mac] = [a, j + 1, host_ip(n)]
+            members[names[j % slices]].append(mac)
+
+    spec = {
+        'slices': {},
+        'default_slice': names[1],
+        'services': [
+            {'name': 'video', 'proto': 'udp', 'ports': [9999], 'slice': names[0]},
+        ],
+        'meters': {},
+        'hosts': host_map,
+        'links': {str(d): {str(o): p for o, p in sorted(nbrs.items())}
+                  for d, nbrs in sorted(links.items())},
+    }
+    for name, b in zip(names, backbone):
+        spec['slices'][name] = {
+            'members': members[name],
+            'path': [access_dpids[0], b] + access_dpids[1:],
+            'bw': bw.get(name, bw['upper']),
+            'delay': delay.get(name, delay['upper']),
+        }
+        # Meter alla banda del backbone della slice (burst di 100 ms)
+        rate = spec['slices'][name]['bw'] * 1000
+        spec['meters'][name] = {'rate_kbps': int(rate), 'burst_kbit': int(rate / 10)}
+    spec['meters']['video'] = dict(spec['meters'][names[0]])
+    return spec
+
+
 class Environment(object):
-    def __init__(self):
-        
+    def __init__(self, spec=None):
+        spec = spec or generate()
+
         self.net = Mininet(controller=RemoteController, link=TCLink, switch=OVSKernelSwitch)
 
         # Controller remoto
         self.c1 = self.net.addController('c1', controller=RemoteController)
 
         info("*** CREAZIONE HOST E SWITCH\n")
-        self.h1 = self.net.addHost('h1', mac='00:00:00:00:00:01', ip='10.0.0.1')
-        self.h2 = self.net.addHost('h2', mac='00:00:00:00:00:02', ip='10.0.0.2')
-        self.h3 = self.net.addHost('h3', mac='00:00:00:00:00:03', ip='10.0.0.3')
-        self.h4 = self.net.addHost('h4', mac='00:00:00:00:00:04', ip='10.0.0.4')
+        self.hosts = {}
+        for n, (mac, (dpid, port, ip)) in enumerate(sorted(spec['hosts'].items()), 1):
+            self.hosts[mac] = self.net.addHost('h%d' % n, mac=mac, ip=ip)
 
-        self.s1 = self.net.addSwitch('s1', protocols='OpenFlow13')
-        self.s2 = self.net.addSwitch('s2', protocols='OpenFlow13')
-        self.s3 = self.net.addSwitch('s3', protocols='OpenFlow13')
-        self.s4 = self.net.addSwitch('s4', protocols='OpenFlow13')
+        self.switches = {}
+        for dpid in sorted(int(d) for d in spec['links']):
+            self.switches[dpid] = self.net.addSwitch('s%d' % dpid, dpid='%016x' % dpid,
+                                                     protocols='OpenFlow13')
 
         info("*** CREAZIONE COLLEGAMENTI\n")
-        self.net.addLink(self.h1, self.s1, bw=10, delay='0.0025ms')
-        self.net.addLink(self.h2, self.s1, bw=10, delay='0.0025ms')
-        self.net.addLink(self.h3, self.s4, bw=10, delay='0.0025ms')
-        self.net.addLink(self.h4, self.s4, bw=10, delay='0.0025ms')
+        for mac, (dpid, port, ip) in sorted(spec['hosts'].items()):
+            self.net.addLink(self.hosts[mac], self.switches[dpid], port2=port,
+                             bw=HOST_BW, delay=HOST_DELAY)
 
-        self.net.addLink(self.s1, self.s2, bw=10, delay='25ms')
-        self.net.addLink(self.s2, self.s4, bw=10, delay='25ms')
-        self.net.addLink(self.s1, self.s3, bw=1, delay='25ms')
-        self.net.addLink(self.s3, self.s4, bw=1, delay='25ms')
+        # Collegamenti di backbone con banda e ritardo della slice
+        access = {dpid for dpid, _, _ in spec['hosts'].values()}
+        slice_of = {}
+        for sl in spec['slices'].values():
+            for dpid in sl['path']:
+                if dpid not in access:
+                    slice_of[dpid] = sl
+        for d, nbrs in sorted(spec['links'].items(), key=lambda x: int(x[0])):
+            for o, port in sorted(nbrs.items(), key=lambda x: int(x[0])):
+                d1, d2 = int(d), int(o)
+                if d1 > d2 or d1 not in slice_of and d2 not in slice_of:
+                    continue
+                sl = slice_of.get(d1) or slice_of.get(d2)
+                self.net.addLink(self.switches[d1], self.switches[d2],
+                                 port1=port, port2=spec['links'][o][d],
+                                 bw=sl['bw'], delay=sl['delay'])
 
         info("*** AVVIO RETE\n")
         self.net.build()
         self.net.start()
 
 if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Topologia di slicing parametrica')
+    ap.add_argument('--access', type=int, default=2, help='access switch')
+    ap.add_argument('--hosts', type=int, default=2, help='host per access switch')
+    ap.add_argument('--slices', type=int, default=2, help='slice (backbone)')
+    ap.add_argument('--bw', action='append', default=[], metavar='SLICE=MBIT',
+                    help='banda del backbone di una slice, es. lower=1')
+    ap.add_argument('--delay', action='append', default=[], metavar='SLICE=DELAY',
+                    help='ritardo del backbone di una slice, es. upper=25ms')
+    ap.add_argument('--policy-out', metavar='FILE',
+                    help='scrive la mappa DPID/porte (formato slice_policy.json) '
+                         'da passare ai controller con SLICE_POLICY=FILE')
+    args = ap.parse_args()
+
+    try:
+        spec = generate(args.access, args.hosts, args.slices,
+                        bw={k: float(v) for k, v in (x.split('=', 1) for x in args.bw)},
+                        delay=dict(x.split('=', 1) for x in args.delay))
+    except ValueError as e:
+        ap.error(str(e))
+    if args.policy_out:
+        with open(args.policy_out, 'w') as f:
+            json.dump(spec, f, indent=2)
+
     setLogLevel('info')
     info('INIZIALIZZO AMBIENTE\n')
-    env = Environment()
+    env = Environment(spec)
 
     info("*** Running CLI\n")
     CLI(env.net)
-